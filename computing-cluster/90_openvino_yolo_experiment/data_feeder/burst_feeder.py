@@ -2,8 +2,10 @@ import numpy as np
 
 from .utilz.dataset_utils import load_dataset
 from .utilz.misc import resource_exists, log, create_lock, resize_array
+from .utilz.claim_check import create_local_blob_store
 from .utilz.kafka_utils import create_producer
-from threading import Thread, Semaphore
+from .utilz.rate_scheduler import create_rate_scheduler
+from threading import Thread
 import time, math, random, argparse
 import itertools
 
@@ -31,7 +33,7 @@ parser.add_argument(
     help="Number of threads to use. Default: 4."
 )
 
-def run(num_images=100, num_threads=4, kafka_servers="130.233.193.117:10001", dataset_path="./data_feeder/datasets/mini.hdf5"):
+def run(num_images=100, num_threads=4, kafka_servers="130.233.193.117:10001", dataset_path="./data_feeder/datasets/mini.hdf5", blob_dir=None):
 
 
     image_count = itertools.count()
@@ -61,9 +63,12 @@ def run(num_images=100, num_threads=4, kafka_servers="130.233.193.117:10001", da
     threads = []
     kafka_producers = []
 
+    # PAYLOADS ABOVE THE CLAIM-CHECK THRESHOLD ARE WRITTEN TO blob_dir, ONLY THEIR REFERENCES GO THROUGH KAFKA
+    blob_store = create_local_blob_store(blob_dir) if blob_dir else None
+
     # CREATE KAFKA PRODUCERS FOR EACH THREAD
     for _ in range(num_threads):
-        kafka_producer = create_producer(kafka_servers=kafka_servers)
+        kafka_producer = create_producer(kafka_servers=kafka_servers, blob_store=blob_store)
         kafka_producers.append(kafka_producer)
 
     # MAKE SURE KAFKA CONNECTION IS OK
@@ -85,16 +90,14 @@ def run(num_images=100, num_threads=4, kafka_servers="130.233.193.117:10001", da
         # RANDOMLY PICK A STARTING INDEX FROM THE DATASET
         next_index = random.randrange(dataset_length)
 
-        time_until_start = experiment_start - time.time()
-        log(f'THREAD {nth_thread} WILL SEND {images_to_send} IMAGES AFTER {time_until_start} SECONDS')
+        log(f'THREAD {nth_thread} WILL SEND {images_to_send} IMAGES')
 
-        # BUSY WAIT FOR A BIT TO SYNC THREADS
-        while time.time() < experiment_start:
-            pass
+        # WAIT FOR THE OTHER THREADS, THEN START TOGETHER
+        pacer = scheduler.join(nth_thread)
 
         # SEND SPECIFIED AMOUNT OF IMAGES
         for image in range(images_to_send):
-            if not alive_signal.is_active():
+            if not pacer.wait(alive_signal):
                 log(f'THREAD {nth_thread} WAS KILLED AT {time.time()}')
                 return
             image = dataset[next_index]
@@ -107,13 +110,14 @@ def run(num_images=100, num_threads=4, kafka_servers="130.233.193.117:10001", da
             next_index = (next_index+1) % dataset_length
 
         ended = time.time()
-        log(f'THREAD {nth_thread} HAS FINISHED AT {ended} -- (took {ended - experiment_start}) s')
+        log(f'THREAD {nth_thread} HAS FINISHED AT {ended} -- (took {ended - scheduler.start}) s')
 
     ########################################################################################
     ########################################################################################
 
     try:
-        experiment_start = time.time() + 3
+        # NO PACING, THE SCHEDULER ONLY SYNCHRONIZES THE START AND RECORDS THE SEND TIMES
+        scheduler = create_rate_scheduler(num_threads)
 
         log(f'CREATING PRODUCER THREAD POOL ({num_threads})')
 
@@ -126,11 +130,12 @@ def run(num_images=100, num_threads=4, kafka_servers="130.233.193.117:10001", da
         # WAIT FOR EVERY THREAD TO FINISH (MUST BE MANUALLY KILLED BY CANCELING LOCK)
         [[thread.join() for thread in threads]]
         end_time = time.time()
-        duration = end_time - experiment_start
+        duration = end_time - scheduler.start
         bps = (avg_dataset_item_size * num_images) / duration
         mbps = bps / 1000000  # Bytes or bits...? Assuming bytes, since each image is in byte-format
         log(f'EXPERIMENT DONE')
         log(f'SENT {num_images} IMAGES IN {duration} SECONDS ({mbps} MB/s)')
+        log(f'SEND SCHEDULE: {scheduler.summary()}')
 
     # TERMINATE MAIN PROCESS AND KILL HELPER THREADS
     except KeyboardInterrupt:
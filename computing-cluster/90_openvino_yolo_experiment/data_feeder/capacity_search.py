@@ -0,0 +1,202 @@
+from confluent_kafka.admin import AdminClient
+
+from .kafka_init import consumer_lag
+from .utilz.capacity import CAPACITY_FILE, evaluate_trial, search_capacity, update_capacity_table
+from .utilz.dataset_utils import load_dataset
+from .utilz.misc import resource_exists, log, create_lock
+from .utilz.kafka_utils import create_producer, create_consumer
+from .utilz.rate_scheduler import create_rate_scheduler
+from threading import Thread
+import threading, time, math, json, uuid, argparse
+import itertools
+
+
+"""
+Capacity search: Find the highest image rate the deployed YOLO consumers sustain, instead of copying it by hand.
+
+Every trial sends images at one rate and watches the consumers: the lag of yolo_input and the end-to-end latency of
+every image (from its intended send time to the Kafka timestamp of its result in yolo_output). The rate is doubled
+until a trial fails, then bisected (utilz/capacity.py). The result is stored per model and resolution in capacity.json,
+with the number of consumer replicas it was measured with.
+"""
+
+# DEPLOY THE CONSUMERS WITH THE MODEL AND THE RESOLUTION FIRST, THEN
+# python3 -m data_feeder.capacity_search --model yolo11n --resolution 640 --consumers 5 --slo_ms 2000
+
+# PARSE PYTHON ARGUMENTS
+parser = argparse.ArgumentParser()
+parser.add_argument("--model", type=str, required=True, help="Model of the deployed consumers, a key of the table.")
+parser.add_argument("--resolution", type=int, required=True,
+                    help="Resolution of the deployed consumers, a key of the table.")
+parser.add_argument("--consumers", type=int, required=True,
+                    help="Number of deployed consumer replicas. Runners only load entries of their own number.")
+parser.add_argument("--dataset", type=str, default="./data_feeder/datasets/mini.hdf5")
+parser.add_argument("--kafka_servers", type=str, default="130.233.193.117:10001")
+parser.add_argument("--slo_ms", type=float, default=2000, help="p99 end-to-end latency limit. Default: 2000.")
+parser.add_argument("--trial_seconds", type=int, default=60, help="Seconds per trial. Default: 60.")
+parser.add_argument("--warmup", type=float, default=0.2, help="Skipped fraction of every trial. Default: 0.2.")
+parser.add_argument("--tolerance", type=float, default=0.05,
+                    help="Allowed rate shortfall and lag growth, as a fraction of the rate. Default: 0.05.")
+parser.add_argument("--start_rate", type=float, default=5, help="Rate of the first trial (images/s). Default: 5.")
+parser.add_argument("--max_rate", type=float, default=1000, help="Highest rate to try (images/s). Default: 1000.")
+parser.add_argument("--precision", type=float, default=0.05,
+                    help="Stop bisecting when the bracket is narrower than this fraction. Default: 0.05.")
+parser.add_argument("--max_trials", type=int, default=16, help="Default: 16.")
+parser.add_argument("-t", "--num_threads", type=int, default=4, help="Feeder threads. Default: 4.")
+parser.add_argument("--drain_seconds", type=float, default=60,
+                    help="Seconds to wait for the last images of a trial before the next one. Default: 60.")
+parser.add_argument("--output", type=str, default=CAPACITY_FILE, help=f"Capacity table. Default: {CAPACITY_FILE}.")
+
+# THE IMAGE IDS OF EVERY TRIAL START AT A MULTIPLE OF THIS, SO THE RESULTS OF THE TRIALS DO NOT MIX
+MSG_IDS_PER_TRIAL = 10 ** 9
+LAG_INTERVAL = 1.0
+
+########################################################################################
+########################################################################################
+
+# SEND AND COMPLETION TIMES OF EVERY IMAGE: THE intended_time OF ITS RESULT (WHEN THE SCHEDULE HAD THE IMAGE DUE, SO
+# A LAGGING FEEDER DOES NOT HIDE ITS STALLS FROM THE SLO) AND THE KAFKA TIMESTAMP OF THE RESULT ITSELF
+class create_qos_collector:
+    def __init__(self, kafka_servers, timeout=60):
+        self.sent = {}
+        self.done = {}
+        self.thread_lock = create_lock()
+
+        # EVERY SEARCH READS THE RESULTS IN ITS OWN CONSUMER GROUP, NEXT TO THE RUNNERS' COLLECTORS
+        assigned = threading.Event()
+        consumer = create_consumer('yolo_output', kafka_servers=kafka_servers,
+                                   group_id=f'yolo_output.capacity.{uuid.uuid4().hex}',
+                                   on_assigned=lambda *_: assigned.set())
+        self.thread = Thread(target=consumer.poll_next, args=(1, self.thread_lock, self.on_result), daemon=True)
+        self.thread.start()
+        if not assigned.wait(timeout):
+            log(f'QoS COLLECTOR NOT ASSIGNED AFTER {timeout} SECONDS, THE FIRST RESULTS MAY BE MISSED')
+
+    def on_result(self, data_bytes, msg_key, time_received, time_sent):
+        record = json.loads(bytes(data_bytes).decode('utf-8'))
+        image_id = int(record['id'])
+        self.sent[image_id] = record['timestamps'].get('intended_time', record['timestamps']['start_time']) / 1000
+        self.done[image_id] = time_sent / 1000
+
+    # RESULTS OF THE TRIAL STARTING AT IMAGE ID first_id
+    def n_done(self, first_id):
+        return sum(1 for image_id in list(self.done) if first_id <= image_id < first_id + MSG_IDS_PER_TRIAL)
+
+    def trial_times(self, first_id):
+        ids = [image_id for image_id in list(self.sent) if first_id <= image_id < first_id + MSG_IDS_PER_TRIAL]
+        return [self.sent[image_id] for image_id in ids], [self.done[image_id] for image_id in ids]
+
+    def close(self):
+        self.thread_lock.kill()
+        self.thread.join()
+
+# APPEND (TIME, LAG OF yolo_input) EVERY LAG_INTERVAL SECONDS
+def sample_lag(kafka_servers, samples, thread_lock):
+    admin_client = AdminClient({'bootstrap.servers': kafka_servers})
+    while thread_lock.is_active():
+        try:
+            samples.append((time.time(), consumer_lag(kafka_servers, 'yolo_input', admin_client=admin_client) or 0))
+        except Exception as error:
+            log(f'COULD NOT READ THE CONSUMER LAG: {error}')
+        time.sleep(LAG_INTERVAL)
+
+########################################################################################
+########################################################################################
+
+def run(model, resolution, consumers, dataset_path="./data_feeder/datasets/mini.hdf5",
+        kafka_servers="130.233.193.117:10001", slo_ms=2000.0, trial_seconds=60, warmup=0.2, tolerance=0.05,
+        start_rate=5.0, max_rate=1000.0, precision=0.05, max_trials=16, num_threads=4, drain_seconds=60.0,
+        output=CAPACITY_FILE):
+
+    # MAKE SURE THE HDF5 DATASET EXISTS
+    if not resource_exists(f'{dataset_path}'):
+        return {}
+
+    # CREATE KAFKA PRODUCERS FOR EACH THREAD, SHARED BY ALL TRIALS
+    kafka_producers = [create_producer(kafka_servers=kafka_servers) for _ in range(num_threads)]
+    if not kafka_producers[0].connected():
+        log('KAFKA PRODUCER NOT CONNECTED! ABORTING...')
+        return {}
+
+    # LOAD THE DATASET
+    dataset = load_dataset({'dataset_path': dataset_path, 'max_frames': -1, 'repeat': 1})
+    dataset_length = len(dataset)
+    avg_dataset_item_size = math.ceil(sum([len(x) for x in dataset]) / len(dataset))
+
+    # SEND AT rate FOR trial_seconds, WITH IMAGE IDS FROM first_id ON
+    def send_at_rate(rate, first_id):
+        image_count = itertools.count(first_id)
+        scheduler = create_rate_scheduler(num_threads, num_threads / rate, duration=trial_seconds, start_delay=1)
+
+        def thread_work(nth_thread):
+            next_index = (nth_thread * 7919) % dataset_length
+            pacer = scheduler.join(nth_thread)
+            while pacer.wait():
+                image_id = next(image_count)
+                kafka_producers[nth_thread - 1].push_msg('yolo_input', dataset[next_index],
+                                                         key=str(image_id).encode('utf-8'), intended=pacer.due)
+                next_index = (next_index + 1) % dataset_length
+
+        threads = [Thread(target=thread_work, args=(nth + 1,)) for nth in range(num_threads)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        return scheduler.summary()
+
+    trial_count = itertools.count(1)
+
+    def measure(rate):
+        first_id = next(trial_count) * MSG_IDS_PER_TRIAL
+
+        lag_samples, lag_lock = [], create_lock()
+        lag_thread = Thread(target=sample_lag, args=(kafka_servers, lag_samples, lag_lock), daemon=True)
+        lag_thread.start()
+
+        try:
+            summary = send_at_rate(rate, first_id)
+            log(f'SENT {summary["sent"]} IMAGES AT {summary.get("achieved_per_second", 0.0):.1f}/s')
+
+            # WAIT FOR THE TAIL OF THE TRIAL, WHICH ALSO LETS THE NEXT TRIAL START FROM AN EMPTY TOPIC
+            deadline = time.time() + drain_seconds
+            while collector.n_done(first_id) < summary['sent'] and time.time() < deadline:
+                time.sleep(1)
+            if collector.n_done(first_id) < summary['sent']:
+                log(f'{summary["sent"] - collector.n_done(first_id)} IMAGES OF THE TRIAL STILL IN FLIGHT AFTER '
+                    f'{drain_seconds} SECONDS, THE NEXT TRIAL STARTS WITH A BACKLOG')
+        finally:
+            lag_lock.kill()
+            lag_thread.join()
+
+        sent, done = collector.trial_times(first_id)
+        return evaluate_trial(rate, summary.get('achieved_per_second', 0.0), summary['sent'], sent, done,
+                              lag_samples, slo_ms=slo_ms, tolerance=tolerance, warmup=warmup)
+
+    collector = create_qos_collector(kafka_servers)
+    try:
+        result = search_capacity(measure, start_rate, max_rate, precision=precision, max_trials=max_trials,
+                                 log_func=log)
+    finally:
+        collector.close()
+
+    # WITHOUT A SUSTAINABLE RATE THERE IS NOTHING TO STORE, AN ENTRY OF 0 WOULD READ AS A MEASURED CAPACITY
+    if result['max_per_second'] is None:
+        log(f'NO SUSTAINABLE RATE OF {model} AT {resolution}, NOTHING SAVED TO {output}')
+        return {}
+
+    entry = update_capacity_table(
+        output, 'yolo', model, resolution, result,
+        mb_per_second=result['max_per_second'] * avg_dataset_item_size / 1000000,
+        image_bytes=avg_dataset_item_size,
+        consumers=consumers,
+        slo={'latency_p99_ms': slo_ms, 'tolerance': tolerance, 'trial_seconds': trial_seconds, 'warmup': warmup},
+        dataset=dataset_path,
+    )
+    log(f'MAXIMUM SUSTAINABLE RATE OF {model} AT {resolution} WITH {consumers} CONSUMERS: '
+        f'{entry["max_per_second"]:.1f} IMAGES/S '
+        f'({entry["mb_per_second"]:.2f} MB/s), SAVED TO {output}')
+    return entry
+
+if __name__ == '__main__':
+    py_args = parser.parse_args()
+    run(py_args.model, py_args.resolution, py_args.consumers, py_args.dataset, py_args.kafka_servers, py_args.slo_ms,
+        py_args.trial_seconds, py_args.warmup, py_args.tolerance, py_args.start_rate, py_args.max_rate,
+        py_args.precision, py_args.max_trials, py_args.num_threads, py_args.drain_seconds, py_args.output)
@@ -2,9 +2,12 @@ import cv2
 import numpy as np
 
 from .utilz.dataset_utils import load_dataset
-from .utilz.misc import resource_exists, log, create_lock, resize_array
+from .utilz.misc import resource_exists, log, create_lock
+from .utilz.claim_check import create_local_blob_store
 from .utilz.kafka_utils import create_producer
-from threading import Thread, Semaphore
+from .utilz.rate_scheduler import create_rate_scheduler, sleep_until
+from .utilz.workload_profiles import day_night, parse_profile
+from threading import Thread
 import time, math, random, argparse
 import itertools
 
@@ -47,8 +50,20 @@ parser.add_argument(
     help="Reduce amount of data sent through Kafka by compressing images to JPEG. The max throughput mbps is computed"
          "before this compression, and compression will not affect it.",
 )
+parser.add_argument(
+    "--poisson",
+    action="store_true",
+    help="Exponential gaps between the images (Poisson arrivals) instead of fixed gaps.",
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    help="Workload profile as scales of --max_mbps, e.g. \"ramp(0.1, 1) + spike(600, 0.5, 60)\" "
+         "(see utilz/workload_profiles.py).",
+)
 
-def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, kafka_servers="130.233.193.117:10001", dataset_path="./data_feeder/datasets/mini.hdf5"):
+def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, kafka_servers="130.233.193.117:10001", dataset_path="./data_feeder/datasets/mini.hdf5", blob_dir=None, poisson=False, profile=None):
 
 
     image_count = itertools.count()
@@ -81,15 +96,17 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
     
     # INSTANTIATE THREAD LOCKS
     thread_lock = create_lock()
-    semaphore = Semaphore(1)
 
     # KEEP TRACK THREADS AND KAFKA PRODUCERS
     threads = []
     kafka_producers = []
 
+    # PAYLOADS ABOVE THE CLAIM-CHECK THRESHOLD ARE WRITTEN TO blob_dir, ONLY THEIR REFERENCES GO THROUGH KAFKA
+    blob_store = create_local_blob_store(blob_dir) if blob_dir else None
+
     # CREATE KAFKA PRODUCERS FOR EACH THREAD
     for _ in range(args['num_threads']):
-        kafka_producer = create_producer(kafka_servers=kafka_servers)
+        kafka_producer = create_producer(kafka_servers=kafka_servers, blob_store=blob_store)
         kafka_producers.append(kafka_producer)
 
     # MAKE SURE KAFKA CONNECTION IS OK
@@ -104,21 +121,15 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
     ########################################################################################
 
     def experiment_handler(lock):
-        global action_cooldown
-
-        # THE DEFAULT DAYNIGHT CYCLE WORKLOAD PERCENTAGES (01 => 23)
-        default_cycle = [
-            0.03,   0.06,   0.09,   0.12,   0.266,  0.412,
-            0.558,  0.704,  0.85,   0.7625, 0.675,  0.587,
-            0.5,    0.59,   0.68,   0.77,   0.86,   0.97,
-            0.813,  0.656,  0.5,    0.343,  0.186,  0.03
-        ] * n_cycles
-
-        # SCALE THE ARRAY WHILE MAINTAINING RATIOS
-        real_cycle = resize_array(
-            default_cycle,
-            args['experiment']['n_breakpoints']
+
+        # THE WORKLOAD PROFILE, EVALUATED ONCE AT EVERY BREAKPOINT (DEFAULT: n_cycles DAY-NIGHT CYCLES)
+        workload = parse_profile(profile) if isinstance(profile, str) else profile or day_night(n_cycles)
+        schedule = workload.compile(
+            args['experiment']['duration'],
+            args['experiment']['duration'] / args['experiment']['n_breakpoints']
         )
+        real_cycle = schedule.scales.tolist()
+        log(f'WORKLOAD PROFILE: ({workload})')
 
         # COMPUTE THE EQUAL TIME SLIVER
         time_sliver = args['experiment']['duration'] / args['experiment']['n_breakpoints']
@@ -132,6 +143,10 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
         log(f'TOTAL DURATION: ({args["experiment"]["duration"]})')
         log(f'SLIVER DURATION: ({time_sliver})')
 
+        # THE BREAKPOINTS ARE ABSOLUTE TIMES FROM THE COMMON START, SO THE CYCLE DOES NOT DRIFT
+        breakpoint_index = 0
+        first_breakpoint = True
+
         # STAY ACTIVE UNTIL LOCK IS MANUALLY KILLED
         while lock.is_active():
 
@@ -147,56 +162,50 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
 
             # COMPUTE THE NEW ACTION COOLDOWN
             events_per_second = (mbs_interval * 1000000) / avg_dataset_item_size
-            new_cooldown = (1 / (events_per_second / args['num_threads']))
 
-            # SAFELY SET THE NEXT COOLDOWN
-            with semaphore:
-                action_cooldown = new_cooldown
+            # THE PRODUCER THREADS USE THE NEW COOLDOWN FROM THEIR NEXT DEADLINE ON
+            if events_per_second > 0:
+                scheduler.set_interval(1 / (events_per_second / args['num_threads']))
+                scheduler.set_pause(None)
+
+            # A BREAKPOINT WITHOUT LOAD IS A PAUSE: THE THREADS RESUME AT THE NEXT BREAKPOINT WITH LOAD, A FIXED TIME
+            # THAT THE POISSON GAPS DO NOT MOVE
+            else:
+                scheduler.set_pause(float(schedule.resume[breakpoint_index]))
+
+            # ON THE FIRST RUN, WAIT FOR THE PRODUCER THREADS TO START
+            if first_breakpoint:
+                scheduler.wait_start()
+                first_breakpoint = False
 
-            # ON THE FIRST RUN, BUSY WAIT TO SYNC THREADS
-            while time.time() < experiment_start:
-                pass
-            
             # THEN SLEEP UNTIL THE NEXT BREAKPOINT
-            time.sleep(time_sliver)
+            breakpoint_index += 1
+            sleep_until(scheduler.start + breakpoint_index * time_sliver, lock)
 
     ########################################################################################
     ########################################################################################
 
     # PRODUCER THREAD WORK LOOP
     def thread_work(nth_thread, lock):
-        global action_cooldown
 
         # RANDOMLY PICK A STARTING INDEX FROM THE DATASET
         next_index = random.randrange(dataset_length)
-        cooldown = None
 
-        # BUSY WAIT FOR ABIT TO SYNC THREADS
-        while time.time() < experiment_start:
-            pass
+        # WAIT FOR THE OTHER THREADS, THEN START TOGETHER
+        pacer = scheduler.join(nth_thread)
 
         log(f'THREAD {nth_thread} HAS STARTED FROM INDEX {next_index}')
 
-        # KEEP GOING UNTIL LOCK IS MANUALLY
-        while lock.is_active():
-            started = time.time()
+        # KEEP GOING UNTIL LOCK IS MANUALLY KILLED, SLEEPING UNTIL EACH ABSOLUTE DEADLINE
+        while pacer.wait(lock):
 
             # SELECT NEXT BUFFER ITEM
             image = dataset[next_index]
             img_as_bytes = image
             image_id = next(image_count)
             image_id_encoded = str(image_id).encode('utf-8')
-            kafka_producers[nth_thread - 1].push_msg('yolo_input', img_as_bytes, key=image_id_encoded)
-            
-            # FETCH THE LATEST ACTION COOLDOWN
-            with semaphore:
-                cooldown = action_cooldown
-
-            # COMPUTE THE ADJUSTED ACTION COOLDOWN, THEN TAKE A NAP
-            ended = time.time()
-            action_duration = ended - started
-            adjusted_cooldown = max(cooldown - action_duration, 0)
-            time.sleep(adjusted_cooldown)
+            kafka_producers[nth_thread - 1].push_msg('yolo_input', img_as_bytes, key=image_id_encoded,
+                                                     intended=pacer.due)
 
             # INCREMENT ROLLING INDEX
             next_index = (next_index+1) % dataset_length
@@ -206,10 +215,8 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
 
     try:
     
-        # SHARED ACTION COOLDOWN FOR WORKER THREADS
-        # TIMESTAMP FOR THREADS TO SYNC TO
-        action_cooldown = None
-        experiment_start = time.time() + 3
+        # SHARED ACTION COOLDOWN AND START TIMESTAMP FOR THE PRODUCER THREADS
+        scheduler = create_rate_scheduler(args['num_threads'], poisson=poisson)
 
         # CREATE THE EXPERIMENT HANDLER
         log(f'CREATING EXPERIMENT HANDLER')
@@ -226,6 +233,7 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
 
         # WAIT FOR EVERY THREAD TO FINISH (MUST BE MANUALLY KILLED BY CANCELING LOCK)
         [[thread.join() for thread in threads]]
+        log(f'SEND SCHEDULE: {scheduler.summary()}')
 
     # TERMINATE MAIN PROCESS AND KILL HELPER THREADS
     except KeyboardInterrupt:
@@ -236,4 +244,5 @@ def run(max_mbps=1, breakpoints=200, duration_seconds=60 * 60 * 2, n_cycles=5, k
 
 if __name__ == '__main__':
     py_args = parser.parse_args()
-    run(py_args.max_mbps, py_args.breakpoints, py_args.duration, py_args.n_cycles, py_args.compress)
+    run(py_args.max_mbps, py_args.breakpoints, py_args.duration, py_args.n_cycles, poisson=py_args.poisson,
+        profile=py_args.profile)
@@ -4,6 +4,8 @@ import time
 from kafka import KafkaConsumer
 from kafka.errors import KafkaTimeoutError
 
+from .utilz.latency_stats import create_latency_tracker
+
 
 
 # Configure the Kafka consumer
@@ -33,6 +35,7 @@ def wait_for_results(image_ids, kafka_servers, msg_callback=None, timeout_s=10):
             print(msg)
 
 
+    latencies = create_latency_tracker()  # Corrected and uncorrected latency of the received images
     duplicates = 0
     unknowns = 0
     errors = 0
@@ -45,6 +48,7 @@ def wait_for_results(image_ids, kafka_servers, msg_callback=None, timeout_s=10):
             print(f"Messages received: {received_ids}")
             print(f"Messages missing: {len(image_ids - received_ids)}")
             print(f"Duplicates: {duplicates}, errors: {errors}")
+            print(latencies.report())
             running = False
             break
 
@@ -55,6 +59,7 @@ def wait_for_results(image_ids, kafka_servers, msg_callback=None, timeout_s=10):
             print(f"Messages received: {received_ids}")
             print(f"Messages missing: {len(image_ids - received_ids)}")
             print(f"Duplicates: {duplicates}, errors: {errors}")
+            print(latencies.report())
             running = False
             break
 
@@ -82,11 +87,13 @@ def wait_for_results(image_ids, kafka_servers, msg_callback=None, timeout_s=10):
                     unknowns += 1
                 else:
                     received_ids.add(img_id)
+                    latencies.add(message.value.get('timestamps', {}))
                     remaining = get_num_msg_remaining()
                     print_sparse(f"Received message {message.value['id']} with timestamp: {message.value['timestamps']}, ({remaining} remaining)")
                 if get_num_msg_remaining() == 0:
                     print(
                         f"Successfully received all {len(image_ids)} messages! (duplicates: {duplicates}, unknowns: {unknowns})")
+                    print(latencies.report())
                     running = False
         prev_msg_received_time = time.time()
 
@@ -1,5 +1,7 @@
-from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic
-from confluent_kafka import TopicPartition
+from concurrent.futures import wait
+
+from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic, OffsetSpec
+from confluent_kafka import ConsumerGroupTopicPartitions, TopicPartition
 import json, time, argparse
 
 from .utilz.kafka_utils import create_producer, create_consumer
@@ -38,14 +40,16 @@ def init_kafka(kafka_servers, num_partitions=5):
         if name in topic_data:
             raise Exception(f'ERROR: TOPIC ({name}) ALREADY EXISTS')
 
-        # OTHERWISE, CREATE IT
-        admin_client.create_topics(
+        # OTHERWISE, CREATE IT AND WAIT FOR THE BROKER TO CONFIRM
+        futures = admin_client.create_topics(
             new_topics=[NewTopic(
                 topic=name,
                 num_partitions=partitions,
                 replication_factor=replication
             )]
         )
+        for future in futures.values():
+            future.result()
 
         return True
 
@@ -71,7 +75,6 @@ def init_kafka(kafka_servers, num_partitions=5):
         print(err)
 
     # PRINT CURRENT KAFKA TOPIC STATE
-    time.sleep(1)
     print(json.dumps(query_topics(), indent=4))
 
     ###################################################################################
@@ -86,6 +89,9 @@ def init_kafka(kafka_servers, num_partitions=5):
             while lock.is_active():
                 kafka_client.poll_next(1, lock, lambda *_: lock.kill())
 
+            # LEAVE THE CONSUMER GROUP, ITS OFFSETS CANNOT BE RESET (reset_topics) WHILE IT HAS A MEMBER
+            kafka_client.close()
+
         consumer_thread = Thread(target=cons, args=(thread_lock,))
         consumer_thread.start()
 
@@ -110,3 +116,138 @@ def init_kafka(kafka_servers, num_partitions=5):
 
     test_topic('yolo_input')
     test_topic('yolo_output')
+
+
+def reset_topics(kafka_servers, topic_names, group_ids=None, timeout=10, target_seconds=1.0, log_func=print):
+    """
+    Empty the given topics without deleting them, so no messages leak from one run into the next.
+    Every partition is truncated to its high watermark with delete_records, and the committed offsets of the
+    consumer groups are moved to the same position. The requests for all topics and groups run in parallel,
+    so a reset takes a few broker round trips instead of the deletion wait of recreate_topic.
+
+    The offsets of a group with active members cannot be changed. Stop the consumers before the reset.
+    Needs confluent-kafka 2.4 or newer.
+
+    Args:
+        kafka_servers (str): Kafka bootstrap servers.
+        topic_names (list): Topics to empty. Missing topics are skipped.
+        group_ids (list): Consumer groups to reset. Default: every group with committed offsets on the topics.
+        timeout (float): Seconds to wait for each request.
+        target_seconds (float): A reset that takes longer is logged as a warning. Default: 1 second.
+        log_func (func): Logging function to use for output.
+
+    Returns:
+        dict: Number of deleted messages per topic.
+    """
+    start = time.time()
+    admin_client = AdminClient({'bootstrap.servers': kafka_servers})
+
+    # FIND ALL PARTITIONS OF THE TOPICS
+    metadata = admin_client.list_topics(timeout=timeout).topics
+    partitions = [TopicPartition(name, partition) for name in topic_names if name in metadata
+                  for partition in metadata[name].partitions]
+    for name in topic_names:
+        if name not in metadata:
+            log_func(f"WARNING: Topic {name} does not exist, nothing to reset")
+    if not partitions:
+        return {}
+
+    # START AND END OFFSET OF EVERY PARTITION, TWO REQUESTS IN TOTAL
+    earliest = admin_client.list_offsets({tp: OffsetSpec.earliest() for tp in partitions}, request_timeout=timeout)
+    latest = admin_client.list_offsets({tp: OffsetSpec.latest() for tp in partitions}, request_timeout=timeout)
+    if group_ids is None:
+        groups_future = admin_client.list_consumer_groups(request_timeout=timeout)
+    starts = {(tp.topic, tp.partition): future.result().offset for tp, future in earliest.items()}
+    ends = {(tp.topic, tp.partition): future.result().offset for tp, future in latest.items()}
+    deleted = {name: 0 for name in topic_names if name in metadata}
+    for (topic, partition), end in ends.items():
+        deleted[topic] += end - starts[(topic, partition)]
+
+    # TRUNCATE THE NON-EMPTY PARTITIONS
+    futures = {}
+    to_truncate = [TopicPartition(topic, partition, end) for (topic, partition), end in ends.items()
+                   if end > starts[(topic, partition)]]
+    if to_truncate:
+        for tp, future in admin_client.delete_records(to_truncate, request_timeout=timeout).items():
+            futures[future] = f"truncate {tp.topic} [{tp.partition}]"
+
+    # FIND THE GROUPS THAT HAVE COMMITTED OFFSETS ON THE TOPICS (ONE GROUP PER REQUEST, ALL IN PARALLEL)
+    if group_ids is None:
+        all_groups = [listing.group_id for listing in groups_future.result().valid]
+        offset_futures = [admin_client.list_consumer_group_offsets([ConsumerGroupTopicPartitions(group_id)],
+                                                                   request_timeout=timeout)[group_id]
+                          for group_id in all_groups]
+        group_topics = {}
+        for group_id, future in zip(all_groups, offset_futures):
+            try:
+                topics = {tp.topic for tp in future.result().topic_partitions or [] if tp.topic in deleted}
+                if topics:
+                    group_topics[group_id] = topics
+            except Exception as e:
+                log_func(f"WARNING: Could not read the offsets of group {group_id}: {e}")
+    else:
+        group_topics = {group_id: set(deleted) for group_id in group_ids}
+
+    # MOVE THE COMMITTED OFFSETS OF EVERY GROUP TO THE END OF ITS TOPICS
+    for group_id, topics in group_topics.items():
+        request = ConsumerGroupTopicPartitions(
+            group_id, [TopicPartition(topic, partition, end) for (topic, partition), end in ends.items()
+                       if topic in topics])
+        for future in admin_client.alter_consumer_group_offsets([request], request_timeout=timeout).values():
+            futures[future] = f"reset offsets of group {group_id}"
+
+    done, not_done = wait(futures, timeout=timeout)
+    for future in not_done:
+        log_func(f"ERROR: Timed out: {futures[future]}")
+    for future in done:
+        try:
+            future.result()
+        except Exception as e:
+            log_func(f"ERROR: Failed to {futures[future]}: {e}")
+
+    seconds = time.time() - start
+    log_func(f"INFO: Reset {len(deleted)} topics and {len(group_topics)} consumer groups in {seconds:.2f} seconds "
+             f"(target: {target_seconds:.2f}), deleted messages: {deleted}")
+    if seconds > target_seconds:
+        log_func(f"WARNING: The reset took {seconds:.2f} seconds, more than the target of {target_seconds:.2f} seconds")
+    return deleted
+
+
+def consumer_lag(kafka_servers, topic_name, group_id=None, timeout=10, admin_client=None):
+    """
+    Number of messages in the given topic that the consumer group has not committed yet, summed over the partitions.
+    Partitions without a committed offset count from their start. Sampled over time, a growing lag means the
+    consumers do not keep up with the producers.
+
+    Args:
+        kafka_servers (str): Kafka bootstrap servers.
+        topic_name (str): The topic to read the lag of.
+        group_id (str): Consumer group. Default: <topic_name>.consumers, the group of kafka_utils.create_consumer.
+        timeout (float): Seconds to wait for each request.
+        admin_client (AdminClient): Optional client to reuse when the lag is sampled repeatedly.
+
+    Returns:
+        int: The lag of the group, or None if the topic does not exist.
+    """
+    if admin_client is None:
+        admin_client = AdminClient({'bootstrap.servers': kafka_servers})
+    if group_id is None:
+        group_id = f'{topic_name}.consumers'
+
+    metadata = admin_client.list_topics(topic=topic_name, timeout=timeout).topics
+    if topic_name not in metadata or metadata[topic_name].error:
+        return None
+    partitions = [TopicPartition(topic_name, partition) for partition in metadata[topic_name].partitions]
+
+    # START AND END OF EVERY PARTITION, AND THE COMMITTED OFFSETS OF THE GROUP, ALL IN PARALLEL
+    earliest = admin_client.list_offsets({tp: OffsetSpec.earliest() for tp in partitions}, request_timeout=timeout)
+    latest = admin_client.list_offsets({tp: OffsetSpec.latest() for tp in partitions}, request_timeout=timeout)
+    committed_future = admin_client.list_consumer_group_offsets(
+        [ConsumerGroupTopicPartitions(group_id, partitions)], request_timeout=timeout)[group_id]
+
+    starts = {tp.partition: future.result().offset for tp, future in earliest.items()}
+    ends = {tp.partition: future.result().offset for tp, future in latest.items()}
+    committed = {tp.partition: tp.offset for tp in committed_future.result().topic_partitions or []}
+
+    # NO COMMIT YET (NEGATIVE OFFSET) OR A COMMIT BEFORE THE START OF A TRUNCATED PARTITION COUNTS FROM THE START
+    return sum(end - max(committed.get(partition, -1), starts[partition]) for partition, end in ends.items())
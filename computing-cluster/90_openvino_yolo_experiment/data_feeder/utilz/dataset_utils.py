@@ -2,6 +2,7 @@ from typing import NamedTuple, Dict
 from multiprocessing import Queue
 import h5py, json
 from .misc import log
+from .packed_dataset import create_packed_dataset, is_packed_dataset
 
 # DATASET FRAME STRUCT
 class Frame(NamedTuple):
@@ -61,6 +62,14 @@ def parse_dataset(args, buffer: Queue, thread_lock):
     dataset.close()
 
 def load_dataset(args):
+
+    # PACKED DATASETS ARE MEMORY-MAPPED, THE IMAGES ARE READ FROM THE PAGE CACHE AS THEY ARE SENT
+    # max_frames COUNTS FRAMES (NOT IMAGES) AND repeat PLAYS THE IMAGES AGAIN, AS FOR HDF5 DATASETS
+    if is_packed_dataset(args['dataset_path']):
+        packed = create_packed_dataset(args['dataset_path'])
+        limit = packed.frame_records(args['max_frames']) if args['max_frames'] > 0 else -1
+        return packed.stream('images', limit, args['repeat'])
+
     container = []
 
     # EXTRACT DATASET COMPONENTS
@@ -1,5 +1,8 @@
-from confluent_kafka import Consumer, Producer
-from .misc import log
+from confluent_kafka import Consumer, KafkaException, Producer, TopicPartition
+from .claim_check import CLAIM_CHECK_THRESHOLD, check_in, is_claim_check
+from .misc import log, create_lock, hot_log
+from collections import deque
+from threading import Lock, Thread
 import sys, time
 
 # GOOD DOCS FOR CONSUMER API
@@ -16,14 +19,39 @@ VERBOSE = True
 ###################################################################################################
 ###################################################################################################
 
+# INTENDED SEND TIMES
+#   THE KAFKA TIMESTAMP SAYS WHEN THE PRODUCER SENT A MESSAGE, NOT WHEN THE FEEDER'S SCHEDULE HAD IT DUE. A STALLED
+#   FEEDER SENDS THE HELD-BACK MESSAGES LATE, AND LATENCIES MEASURED FROM THE KAFKA TIMESTAMP HIDE THE STALL
+#   (COORDINATED OMISSION). PACED FEEDERS PASS THE DUE TIME TO push_msg(..., intended=SECONDS), WHICH CARRIES IT IN
+#   THE intended_ms HEADER. CONSUMERS POLLING WITH intended=True RECEIVE IT AS ONE MORE CALLBACK ARGUMENT (ms)
+#   MESSAGES WITHOUT THE HEADER (E.G. FROM THE BURST FEEDER) WERE DUE WHEN THEY WERE SENT
+INTENDED_HEADER = 'intended_ms'
+
+def intended_header(intended):
+    return [(INTENDED_HEADER, str(round(intended * 1000)).encode('utf-8'))]
+
+# THE DUE TIME OF A MESSAGE IN ms, OR default WITHOUT THE HEADER
+def intended_time(msg, default=None):
+    for key, value in msg.headers() or []:
+        if key == INTENDED_HEADER:
+            return int(value)
+    return default
+
+###################################################################################################
+###################################################################################################
+
 class create_producer:
 
     # ON LOAD, CREATE KAFKA PRODUCER
-    def __init__(self, kafka_servers=KAFKA_SERVERS, verbosity_interval=100):
+    # blob_store ENABLES CLAIM CHECKS: PAYLOADS ABOVE claim_threshold BYTES ARE SENT AS BLOB REFERENCES
+    def __init__(self, kafka_servers=KAFKA_SERVERS, verbosity_interval=100, blob_store=None,
+                 claim_threshold=CLAIM_CHECK_THRESHOLD):
         self.kafka_servers = kafka_servers
         self.kafka_client = Producer({
             'bootstrap.servers': kafka_servers,
         })
+        self.blob_store = blob_store
+        self.claim_threshold = claim_threshold
         self.verbosity_interval = verbosity_interval
         self.ack_counter = 0
 
@@ -47,65 +75,368 @@ class create_producer:
         self.ack_counter += 1
 
     # PUSH MESSAGE TO A KAFK TOPIC
-    def push_msg(self, topic_name, bytes_data, key=None):
+    def push_msg(self, topic_name, bytes_data, key=None, intended=None):
 
         # PUSH MESSAGE TO KAFKA TOPIC
+        value, headers = check_in(self.blob_store, bytes_data, self.claim_threshold)
+        if intended is not None:
+            headers = headers + intended_header(intended)
         self.kafka_client.produce(
             topic_name,
-            value=bytes_data,
+            value=value,
             on_delivery=self.ack_callback,
             key=key,
+            headers=headers,
         )
 
         # ASYNCRONOUSLY AWAIT CONSUMER ACK BEFORE SENDING NEXT MSG
         self.kafka_client.poll(1)
         # self.kafka_client.flush()
+
+    # WAIT FOR ALL QUEUED MESSAGES, RETURNS THE NUMBER OF UNDELIVERED MESSAGES
+    def close(self, timeout=30):
+        return self.kafka_client.flush(timeout)
 	
 ###################################################################################################
 ###################################################################################################
 
+# HIGH-THROUGHPUT MODE: MESSAGES ARE BATCHED BY LIBRDKAFKA AND DELIVERY REPORTS ARE SERVED BY A BACKGROUND THREAD
+class create_batch_producer:
+
+    # ON LOAD, CREATE KAFKA PRODUCER AND START THE DELIVERY REPORT THREAD
+    def __init__(self, kafka_servers=KAFKA_SERVERS, linger_ms=20, batch_size=1048576, compression='lz4',
+                 verbosity_interval=100, poll_interval=0.1, blob_store=None, claim_threshold=CLAIM_CHECK_THRESHOLD):
+        self.kafka_servers = kafka_servers
+        self.kafka_client = Producer({
+            'bootstrap.servers': kafka_servers,
+            'linger.ms': linger_ms,
+            'batch.size': batch_size,
+            'compression.type': compression,
+        })
+        self.verbosity_interval = verbosity_interval
+        self.poll_interval = poll_interval
+        self.blob_store = blob_store
+        self.claim_threshold = claim_threshold
+
+        # DELIVERY COUNTERS, UPDATED FROM THE SENDING THREADS AND THE POLL THREAD
+        self.counter_lock = Lock()
+        self.produced = 0
+        self.delivered = 0
+        self.failed = 0
+
+        # SERVE DELIVERY REPORTS IN THE BACKGROUND, SO PUSH_MSG NEVER WAITS FOR THE BROKER
+        self.thread_lock = create_lock()
+        self.poll_thread = Thread(target=self.poll_loop, daemon=True)
+        self.poll_thread.start()
+
+    # MESSAGES PRODUCED BUT NOT YET ACKNOWLEDGED
+    @property
+    def in_flight(self):
+        with self.counter_lock:
+            return self.produced - self.delivered - self.failed
+
+    # MAKE SURE KAFKA CONNECTION IS OK
+    def connected(self):
+        try:
+            metadata = self.kafka_client.list_topics(timeout=2)
+            log('SUCCESSFULLY CONNECTED TO KAFKA')
+            return True
+        except:
+            log(f'COULD NOT CONNECT WITH KAFKA SERVER ({self.kafka_servers})')
+            return False
+
+    # KEEP SERVING DELIVERY CALLBACKS UNTIL THE PRODUCER IS CLOSED
+    def poll_loop(self):
+        while self.thread_lock.is_active():
+            self.kafka_client.poll(self.poll_interval)
+
+    # ON DELIVERY REPORT, UPDATE COUNTERS
+    def ack_callback(self, error, message):
+        with self.counter_lock:
+            if error:
+                self.failed += 1
+            else:
+                self.delivered += 1
+            delivered = self.delivered
+        if error:
+            print('ACK ERROR', error)
+        elif VERBOSE and delivered % self.verbosity_interval == 0:
+            log(f'MESSAGES DELIVERED: {delivered} (in flight: {self.in_flight})')
+
+    # QUEUE MESSAGE FOR A KAFKA TOPIC
+    def push_msg(self, topic_name, bytes_data, key=None, intended=None):
+        value, headers = check_in(self.blob_store, bytes_data, self.claim_threshold)
+        if intended is not None:
+            headers = headers + intended_header(intended)
+
+        # COUNT THE MESSAGE BEFORE PRODUCING IT -- ITS DELIVERY REPORT CAN BE SERVED BY THE POLL THREAD RIGHT AWAY
+        with self.counter_lock:
+            self.produced += 1
+        try:
+            while True:
+                try:
+                    self.kafka_client.produce(
+                        topic_name,
+                        value=value,
+                        on_delivery=self.ack_callback,
+                        key=key,
+                        headers=headers,
+                    )
+                    break
+
+                # LOCAL QUEUE IS FULL -- WAIT FOR DELIVERIES TO FREE SPACE, THEN RETRY
+                except BufferError:
+                    self.kafka_client.poll(self.poll_interval)
+
+        # THE MESSAGE WAS NEVER QUEUED, SO NO DELIVERY REPORT WILL COME FOR IT
+        except Exception:
+            with self.counter_lock:
+                self.produced -= 1
+            raise
+
+    # STOP THE POLL THREAD AND WAIT FOR ALL QUEUED MESSAGES, RETURNS THE NUMBER OF UNDELIVERED MESSAGES
+    def close(self, timeout=30):
+        self.thread_lock.kill()
+        self.poll_thread.join()
+        remaining = self.kafka_client.flush(timeout)
+        log(f'PRODUCER CLOSED (delivered: {self.delivered}, failed: {self.failed}, undelivered: {remaining})')
+        return remaining
+
+###################################################################################################
+###################################################################################################
+
+# AT-LEAST-ONCE OFFSET TRACKING: OFFSETS ARE STORED AFTER PROCESSING AND COMMITTED IN BATCHES
+class create_offset_manager:
+
+    # commit_every MESSAGES OR commit_interval SECONDS, WHICHEVER COMES FIRST
+    def __init__(self, kafka_client, commit_interval=5.0, commit_every=500, latency_window=1000):
+        self.kafka_client = kafka_client
+        self.commit_interval = commit_interval
+        self.commit_every = commit_every
+
+        # (TOPIC, PARTITION) -> [NEXT OFFSET TO CONSUME, PROCESSED BUT UNCOMMITTED MESSAGES]
+        self.stored = {}
+
+        # OUT-OF-ORDER PROCESSING (E.G. A PROCESS POOL): (TOPIC, PARTITION) -> OFFSETS HANDED OUT BUT NOT FINISHED,
+        # AND OFFSETS FINISHED AFTER AN UNFINISHED ONE, WHICH CANNOT BE COMMITTED YET
+        self.pending = {}
+        self.finished = {}
+        self.uncommitted = 0
+        self.last_commit = time.time()
+
+        # COMMIT STATISTICS
+        self.commits = 0
+        self.committed_messages = 0
+        self.commit_latencies_ms = deque(maxlen=latency_window)
+
+    # MARK A MESSAGE AS PROCESSED
+    def store(self, msg):
+        self.store_offset(msg.topic(), msg.partition(), msg.offset())
+
+    # MARK A MESSAGE AS HANDED OUT, FOR CALLERS THAT FINISH THE MESSAGES OF A PARTITION OUT OF ORDER
+    def begin(self, topic, partition, offset):
+        self.pending.setdefault((topic, partition), set()).add(offset)
+
+    # MARK A MESSAGE AS PROCESSED, FOR CALLERS THAT NO LONGER HOLD THE MESSAGE OBJECT
+    # A MESSAGE PASSED TO begin() ONLY MOVES THE STORED OFFSET UP TO THE LOWEST UNFINISHED ONE OF ITS PARTITION,
+    # SO A COMMIT NEVER SKIPS A MESSAGE THAT IS STILL PROCESSED (A FAILED MESSAGE MUST STILL BE STORED, OR ITS
+    # PARTITION STOPS COMMITTING HERE)
+    def store_offset(self, topic, partition, offset):
+        key = (topic, partition)
+        n_messages = 1
+        pending = self.pending.get(key)
+        if pending is not None and offset in pending:
+            pending.remove(offset)
+            finished = self.finished.setdefault(key, set())
+            finished.add(offset)
+            if pending:
+                lowest_pending = min(pending)
+                ready = [o for o in finished if o < lowest_pending]
+            else:
+                ready = list(finished)
+            if not ready:
+                return
+            finished.difference_update(ready)
+            offset, n_messages = max(ready), len(ready)
+
+        stored = self.stored.setdefault(key, [0, 0])
+        stored[0] = offset + 1
+        stored[1] += n_messages
+        self.uncommitted += n_messages
+
+    # COMMIT WHEN ENOUGH MESSAGES OR TIME HAVE PASSED
+    def maybe_commit(self):
+        if self.uncommitted >= self.commit_every or \
+                (self.uncommitted > 0 and time.time() - self.last_commit >= self.commit_interval):
+            self.commit()
+
+    # SYNCHRONOUSLY COMMIT THE STORED OFFSETS, OPTIONALLY ONLY FOR THE GIVEN PARTITIONS
+    def commit(self, partitions=None):
+        keys = [key for key in self.stored if partitions is None or key in partitions]
+        if not keys:
+            return
+        offsets = [TopicPartition(topic, partition, self.stored[(topic, partition)][0]) for topic, partition in keys]
+
+        t1 = time.perf_counter()
+        try:
+            self.kafka_client.commit(offsets=offsets, asynchronous=False)
+        except KafkaException as error:
+            log(f'OFFSET COMMIT FAILED: {error}')
+            return
+        latency_ms = (time.perf_counter() - t1) * 1000
+
+        n_messages = sum(self.stored.pop(key)[1] for key in keys)
+        self.uncommitted -= n_messages
+        self.commits += 1
+        self.committed_messages += n_messages
+        self.commit_latencies_ms.append(latency_ms)
+        self.last_commit = time.time()
+        if VERBOSE:
+            log(f'COMMITTED {len(offsets)} PARTITIONS IN {latency_ms:.1f} ms')
+
+    # FORGET THE OFFSETS OF LOST PARTITIONS -- THEY CAN NO LONGER BE COMMITTED BY THIS CONSUMER
+    def drop(self, partitions):
+        for key in partitions:
+            _, n_messages = self.stored.pop(key, (0, 0))
+            self.uncommitted -= n_messages
+            self.pending.pop(key, None)
+            self.finished.pop(key, None)
+
+    # SUMMARY OF THE COMMIT LATENCIES
+    def stats(self):
+        latencies = sorted(self.commit_latencies_ms) or [0.0]
+        return {
+            'commits': self.commits,
+            'committed_messages': self.committed_messages,
+            'mean_ms': sum(latencies) / len(latencies),
+            'p95_ms': latencies[int(0.95 * (len(latencies) - 1))],
+            'max_ms': latencies[-1],
+        }
+
+###################################################################################################
+###################################################################################################
+
 class create_consumer:
 
     # ON LOAD, CREATE KAFKA CONSUMER CLIENT
-    def __init__(self, kafka_topic, kafka_servers=KAFKA_SERVERS):
+    # commit_mode='eager' COMMITS EVERY MESSAGE BEFORE PROCESSING IT (AT-MOST-ONCE)
+    # commit_mode='batched' STORES OFFSETS AFTER PROCESSING AND COMMITS THEM IN BATCHES (AT-LEAST-ONCE)
+    # assignment='cooperative' MOVES ONLY THE REASSIGNED PARTITIONS ON A REBALANCE, INSTEAD OF PAUSING THE WHOLE GROUP
+    # instance_id ENABLES STATIC MEMBERSHIP: A RESTARTED CONSUMER WITH THE SAME ID GETS ITS PARTITIONS BACK
+    # on_assigned(partitions) IS CALLED WHEN THE CONSUMER RECEIVES PARTITIONS WHILE IT HAS NONE
+    # on_unassigned() IS CALLED WHEN IT HAS NO PARTITIONS LEFT (REVOKED OR LOST) AND WHEN IT IS CLOSED
+    # blob_store RESOLVES CLAIM-CHECK REFERENCES INTO MEMORY-MAPPED BLOBS
+    # group_id DEFAULTS TO '<TOPIC>.consumers'. CONSUMERS IN DIFFERENT GROUPS EACH RECEIVE EVERY MESSAGE (BROADCAST)
+    def __init__(self, kafka_topic, kafka_servers=KAFKA_SERVERS, commit_mode='eager', commit_interval=5.0,
+                 commit_every=500, assignment='eager', instance_id=None, on_assigned=None, blob_store=None,
+                 group_id=None, on_unassigned=None):
 
         # SET STATIC CONSUMPTION CONFIGS
         self.kafka_topic = kafka_topic
         self.kafka_servers = kafka_servers
+        self.closed = False
+
+        # OPTIONAL CALLBACK THAT FINISHES IN-FLIGHT WORK BEFORE THE REVOKED OFFSETS ARE COMMITTED
+        self.before_revoke = None
+
+        # READINESS SIGNAL FOR EXPERIMENT RUNNERS
+        self.on_assigned = on_assigned
+        self.on_unassigned = on_unassigned
+        self.ready = False
+        self.partitions = set()
+
+        # CLAIM-CHECK BLOBS
+        self.blob_store = blob_store
+
+        # TRACK PROCESSED OFFSETS IN BATCHED MODE (SET BELOW, ONCE THE CLIENT EXISTS)
+        self.offsets = None
+
+        # THROUGHPUT COUNTERS, READ BY THE METRICS EXPORTER
+        self.processed = 0
+        self.processing_seconds = 0.0
 
         # CREATE THE CONSUMER CLIENT
-        self.kafka_client = Consumer({
+        kafka_config = {
             'bootstrap.servers': kafka_servers,
-            'group.id': kafka_topic + '.consumers',
+            'group.id': group_id or kafka_topic + '.consumers',
             'enable.auto.commit': False,
             'on_commit': self.ack_callback,
             'auto.offset.reset': 'latest',
             # 'auto.offset.reset': 'earliest'
-        })
+        }
+        if assignment == 'cooperative':
+            kafka_config['partition.assignment.strategy'] = 'cooperative-sticky'
+        if instance_id:
+            kafka_config['group.instance.id'] = instance_id
+        self.kafka_client = Consumer(kafka_config)
+
+        if commit_mode == 'batched':
+            self.offsets = create_offset_manager(self.kafka_client, commit_interval, commit_every)
 
         # SUBSCRIBE TO THE KAFKA TOPIC
         self.kafka_client.subscribe([kafka_topic], self.assigned, self.revoked, self.lost)
 
-    # WHEN CLASS DIES, KILL THE KAFKA CLIENT
-    def __del__(self):
-        log('KAFKA CLIENT CLOSED')
+    # COMMIT THE PROCESSED OFFSETS AND LEAVE THE CONSUMER GROUP
+    def close(self):
+        if self.closed:
+            return
+        if self.offsets is not None:
+            self.offsets.commit()
+            log(f'COMMIT LATENCY: {self.offsets.stats()}')
         self.kafka_client.close()
+        self.closed = True
+        self.unassign(self.partitions)
+        log('KAFKA CLIENT CLOSED')
+
+    # WHEN CLASS DIES, KILL THE KAFKA CLIENT -- UNLESS CREATING IT FAILED
+    def __del__(self):
+        if hasattr(self, 'kafka_client'):
+            self.close()
 
-    # PARTITION ASSIGNMENT SUCCESS
+    # PARTITION ASSIGNMENT SUCCESS -- WITH COOPERATIVE ASSIGNMENT, ONLY THE NEWLY ADDED PARTITIONS
     def assigned(self, consumer, partition_data):
         if VERBOSE:
             partitions = [p.partition for p in partition_data]
             log(f'CONSUMER ASSIGNED PARTITIONS: {partitions}')
 
-    # PARTITION ASSIGNMENT REVOKED
+        # THE CONSUMER CAN RECEIVE MESSAGES FROM NOW ON
+        self.partitions |= {(p.topic, p.partition) for p in partition_data}
+        if self.partitions and not self.ready:
+            self.ready = True
+            log(f'CONSUMER READY WITH {len(partition_data)} PARTITIONS')
+            if self.on_assigned is not None:
+                self.on_assigned(partition_data)
+
+    # PARTITION ASSIGNMENT REVOKED -- WITH COOPERATIVE ASSIGNMENT, ONLY THE PARTITIONS THAT MOVE ELSEWHERE
     def revoked(self, consumer, partition_data):
         if VERBOSE:
             partitions = [p.partition for p in partition_data]
             log(f'CONSUMER PARTITION ASSIGNMENT REVOKED: {partitions}')
 
+        # COMMIT WHAT WAS PROCESSED BEFORE THE NEXT OWNER STARTS FROM THE COMMITTED OFFSETS
+        if self.before_revoke is not None:
+            self.before_revoke(partition_data)
+        if self.offsets is not None:
+            revoked = {(p.topic, p.partition) for p in partition_data}
+            self.offsets.commit(partitions=revoked)
+            self.offsets.drop(revoked)
+        self.unassign({(p.topic, p.partition) for p in partition_data})
+
     # PARTITION ASSIGNMENT LOST
     def lost(self, consumer, partition_data):
         log(f'CONSUMER ASSIGNMENT LOST: {consumer} {partition_data}')
+        if self.offsets is not None:
+            self.offsets.drop({(p.topic, p.partition) for p in partition_data})
+        self.unassign({(p.topic, p.partition) for p in partition_data})
+
+    # FORGET THE GIVEN PARTITIONS, THE CONSUMER IS NO LONGER READY WHEN NONE ARE LEFT
+    def unassign(self, partitions):
+        self.partitions -= set(partitions)
+        if self.ready and not self.partitions:
+            self.ready = False
+            log('CONSUMER HAS NO PARTITIONS LEFT')
+            if self.on_unassigned is not None:
+                self.on_unassigned()
 
     # MAKE SURE KAFKA CONNECTION IS OK
     def connected(self):
@@ -122,8 +453,43 @@ class create_consumer:
         if error:
             return print('ACK ERROR', error)
 
+    # RETURN (VALUE, BLOB REFERENCE) -- FOR CLAIM CHECKS, THE VALUE IS A MEMORY-MAPPED VIEW OF THE BLOB
+    def check_out(self, msg):
+        if not is_claim_check(msg):
+            return msg.value(), None
+        if self.blob_store is None:
+            raise ValueError('CLAIM-CHECK MESSAGE RECEIVED, BUT THE CONSUMER HAS NO BLOB STORE')
+        return self.blob_store.open(msg.value()), msg.value()
+
+    # UNMAP THE HANDLED BLOBS AND DELETE THE EXPIRED ONES
+    def release_blobs(self, refs):
+        if self.blob_store is None:
+            return
+        for ref in refs:
+            if ref is not None:
+                self.blob_store.release(ref)
+        self.blob_store.collect_garbage()
+
+    # AT-LEAST-ONCE: A HANDLER FAILED ON THESE MESSAGES, SO THEIR OFFSETS ARE NOT STORED. SEEK EVERY PARTITION BACK TO
+    # ITS FIRST FAILED MESSAGE, OTHERWISE THE NEXT HANDLED MESSAGE WOULD STORE A HIGHER OFFSET AND COMMIT PAST THEM
+    # A MESSAGE THAT ALWAYS FAILS IS RETRIED UNTIL THE CONSUMER IS STOPPED
+    def rewind(self, msgs):
+        first = {}
+        for msg in msgs:
+            key = (msg.topic(), msg.partition())
+            first[key] = min(first.get(key, msg.offset()), msg.offset())
+        for (topic, partition), offset in first.items():
+            self.kafka_client.seek(TopicPartition(topic, partition, offset))
+            log(f'HANDLER FAILED, {topic} [{partition}] REWOUND TO OFFSET {offset}')
+
+    # COUNT HANDLED MESSAGES AND THE TIME SPENT ON THEM
+    def record_processed(self, n_messages, seconds):
+        self.processed += n_messages
+        self.processing_seconds += seconds
+
     # START CONSUMING TOPIC EVENTS
-    def poll_next(self, nth_thread, thread_lock, on_message):
+    # intended=True CALLS on_message(value, key, time_received_ms, time_sent_ms, time_intended_ms)
+    def poll_next(self, nth_thread, thread_lock, on_message, intended=False):
         log(f'THREAD {nth_thread}: NOW POLLING')
         
         # KEEP POLLING WHILE LOCK IS ACTIVE
@@ -132,8 +498,9 @@ class create_consumer:
                 # POLL NEXT MESSAGE
                 msg = self.kafka_client.poll(1)
 
-                # NULL MESSAGE -- SKIP
+                # NULL MESSAGE -- SKIP (BUT KEEP THE COMMIT TIMER RUNNING)
                 if msg is None:
+                    if self.offsets is not None: self.offsets.maybe_commit()
                     continue
 
                 # CATCH ERRORS
@@ -141,12 +508,30 @@ class create_consumer:
                     print('FAULTY EVENT RECEIVED', msg.error())
                     continue
                 # COMMIT THE EVENT TO PREVENT OTHERS FROM TAKING IT
-                self.kafka_client.commit(msg, asynchronous=True)
+                if self.offsets is None:
+                    self.kafka_client.commit(msg, asynchronous=True)
 
                 # HANDLE THE EVENT VIA CALLBACK FUNC
-                if VERBOSE: log(f'THREAD {nth_thread}: EVENT RECEIVED ({self.kafka_topic})')
-                on_message(msg.value(), msg.key(), int(time.time() * 1000), msg.timestamp()[1])
-                if VERBOSE: log(f'THREAD {nth_thread}: EVENT HANDLED')
+                if VERBOSE: hot_log('EVENT RECEIVED', thread=nth_thread, topic=self.kafka_topic)
+                value, ref = self.check_out(msg)
+                t1 = time.perf_counter()
+                try:
+                    times = (int(time.time() * 1000), msg.timestamp()[1])
+                    if intended:
+                        times += (intended_time(msg, times[1]),)
+                    on_message(value, msg.key(), *times)
+                except Exception:
+                    if self.offsets is not None: self.rewind([msg])
+                    raise
+                finally:
+                    self.release_blobs([ref])
+                self.record_processed(1, time.perf_counter() - t1)
+                if VERBOSE: hot_log('EVENT HANDLED', thread=nth_thread)
+
+                # THE EVENT WAS PROCESSED, ITS OFFSET CAN BE COMMITTED
+                if self.offsets is not None:
+                    self.offsets.store(msg)
+                    self.offsets.maybe_commit()
 
             # SILENTLY DEAL WITH OTHER ERRORS
             except Exception as error:
@@ -155,3 +540,171 @@ class create_consumer:
             
         # LOCK WAS KILLED, THEREFORE THREAD LOOP ENDS
         log(f'THREAD {nth_thread}: MANUALLY KILLED')
+
+    # START CONSUMING TOPIC EVENTS IN BATCHES OF UP TO batch_size MESSAGES
+    # on_batch RECEIVES A LIST OF (value, key, time_sent_ms) TUPLES AND THE TIME THE BATCH WAS RECEIVED
+    # intended=True ADDS time_intended_ms TO THE TUPLES
+    def poll_batch(self, nth_thread, thread_lock, on_batch, batch_size=100, timeout=1, intended=False):
+        log(f'THREAD {nth_thread}: NOW POLLING BATCHES OF {batch_size}')
+
+        # KEEP POLLING WHILE LOCK IS ACTIVE
+        while thread_lock.is_active():
+            try:
+                # WAIT UNTIL batch_size MESSAGES ARRIVE OR THE TIMEOUT EXPIRES
+                msgs = self.kafka_client.consume(num_messages=batch_size, timeout=timeout)
+
+                # CATCH ERRORS, KEEP THE VALID EVENTS
+                valid_msgs = []
+                for msg in msgs:
+                    if msg.error():
+                        print('FAULTY EVENT RECEIVED', msg.error())
+                        continue
+                    valid_msgs.append(msg)
+
+                # EMPTY BATCH -- SKIP (BUT KEEP THE COMMIT TIMER RUNNING)
+                if not valid_msgs:
+                    if self.offsets is not None: self.offsets.maybe_commit()
+                    continue
+
+                # COMMIT THE CONSUMED OFFSETS TO PREVENT OTHERS FROM TAKING THE EVENTS
+                if self.offsets is None:
+                    self.kafka_client.commit(asynchronous=True)
+
+                # HANDLE THE EVENTS VIA CALLBACK FUNC
+                checked_out = [self.check_out(msg) for msg in valid_msgs]
+                batch = [(value, msg.key(), msg.timestamp()[1]) for (value, _), msg in zip(checked_out, valid_msgs)]
+                if intended:
+                    batch = [item + (intended_time(msg, item[2]),) for item, msg in zip(batch, valid_msgs)]
+                if VERBOSE: hot_log('BATCH RECEIVED', thread=nth_thread, topic=self.kafka_topic, size=len(batch))
+                t1 = time.perf_counter()
+                try:
+                    on_batch(batch, int(time.time() * 1000))
+                except Exception:
+                    if self.offsets is not None: self.rewind(valid_msgs)
+                    raise
+                finally:
+                    self.release_blobs([ref for _, ref in checked_out])
+                self.record_processed(len(batch), time.perf_counter() - t1)
+                if VERBOSE: hot_log('BATCH HANDLED', thread=nth_thread)
+
+                # THE EVENTS WERE PROCESSED, THEIR OFFSETS CAN BE COMMITTED
+                if self.offsets is not None:
+                    for msg in valid_msgs:
+                        self.offsets.store(msg)
+                    self.offsets.maybe_commit()
+
+            # SILENTLY DEAL WITH OTHER ERRORS
+            except Exception as error:
+                print('CONSUMER ERROR', error)
+                continue
+
+        # LOCK WAS KILLED, THEREFORE THREAD LOOP ENDS
+        log(f'THREAD {nth_thread}: MANUALLY KILLED')
+
+###################################################################################################
+###################################################################################################
+
+# PROMETHEUS ENDPOINT WITH THE QUEUE DEPTH AND THROUGHPUT OF ONE CONSUMER, REFRESHED BY A BACKGROUND THREAD
+class create_metrics_exporter:
+
+    # ON LOAD, START THE HTTP ENDPOINT AND THE REFRESH THREAD
+    def __init__(self, consumer, port=8000, interval=5.0, timeout=5):
+
+        # OPTIONAL DEPENDENCY -- ONLY NEEDED WHEN METRICS ARE ENABLED
+        from prometheus_client import CollectorRegistry, Gauge, start_http_server
+
+        self.consumer = consumer
+        self.interval = interval
+        self.timeout = timeout
+
+        # PER-PARTITION OFFSETS, ONE TIME SERIES PER ASSIGNED PARTITION
+        self.registry = CollectorRegistry()
+        labels = ['topic', 'partition']
+        self.position = Gauge('kafka_consumer_position', 'Next offset handed to the application',
+                              labels, registry=self.registry)
+        self.committed = Gauge('kafka_consumer_committed_offset', 'Committed offset of the consumer group',
+                               labels, registry=self.registry)
+        self.high_watermark = Gauge('kafka_consumer_high_watermark', 'Offset of the next message written',
+                                    labels, registry=self.registry)
+        self.lag = Gauge('kafka_consumer_lag', 'Messages written but not yet handed to the application',
+                         labels, registry=self.registry)
+
+        # CONSUMER TOTALS
+        self.total_lag = Gauge('kafka_consumer_total_lag', 'Sum of the lag over the assigned partitions',
+                               registry=self.registry)
+        self.assigned = Gauge('kafka_consumer_assigned_partitions', 'Number of assigned partitions',
+                              registry=self.registry)
+        self.messages_per_second = Gauge('kafka_consumer_messages_per_second',
+                                         'Messages handled per second over the last interval', registry=self.registry)
+        self.processing_ms = Gauge('kafka_consumer_processing_ms',
+                                   'Mean handling time per message over the last interval', registry=self.registry)
+
+        # PARTITIONS WITH EXPORTED TIME SERIES, SO REVOKED ONES CAN BE REMOVED
+        self.exported = set()
+        self.last_processed = consumer.processed
+        self.last_processing_seconds = consumer.processing_seconds
+        self.last_update = time.time()
+
+        start_http_server(port, registry=self.registry)
+        log(f'METRICS EXPORTED ON PORT {port}')
+
+        self.thread_lock = create_lock()
+        self.thread = Thread(target=self.refresh_loop, daemon=True)
+        self.thread.start()
+
+    # REFRESH UNTIL STOPPED OR THE CONSUMER IS CLOSED
+    def refresh_loop(self):
+        while self.thread_lock.is_active() and not self.consumer.closed:
+            try:
+                self.refresh()
+            except Exception as error:
+                log(f'METRICS ERROR: {error}')
+            time.sleep(self.interval)
+
+    # READ THE OFFSETS OF THE ASSIGNED PARTITIONS AND THE THROUGHPUT SINCE THE LAST REFRESH
+    def refresh(self):
+        kafka_client = self.consumer.kafka_client
+        assignment = kafka_client.assignment()
+        positions = kafka_client.position(assignment)
+        committed = kafka_client.committed(assignment, timeout=self.timeout)
+
+        total_lag = 0
+        current = set()
+        for position, commit in zip(positions, committed):
+            key = (position.topic, str(position.partition))
+            _, high = kafka_client.get_watermark_offsets(
+                TopicPartition(position.topic, position.partition), timeout=self.timeout)
+
+            # NOTHING CONSUMED YET -- START FROM THE COMMITTED OFFSET, OR THE END OF THE TOPIC (auto.offset.reset=latest)
+            consumed = position.offset if position.offset >= 0 else commit.offset if commit.offset >= 0 else high
+            lag = max(high - consumed, 0)
+            total_lag += lag
+
+            # BEFORE THE FIRST CONSUMPTION AND COMMIT, THE OFFSETS ARE OFFSET_INVALID (-1001), WHICH IS NOT AN OFFSET
+            self.position.labels(*key).set(position.offset if position.offset >= 0 else float('nan'))
+            self.committed.labels(*key).set(commit.offset if commit.offset >= 0 else float('nan'))
+            self.high_watermark.labels(*key).set(high)
+            self.lag.labels(*key).set(lag)
+            current.add(key)
+
+        # DROP THE TIME SERIES OF PARTITIONS THAT MOVED TO ANOTHER CONSUMER
+        for key in self.exported - current:
+            for gauge in [self.position, self.committed, self.high_watermark, self.lag]:
+                gauge.remove(*key)
+        self.exported = current
+        self.total_lag.set(total_lag)
+        self.assigned.set(len(assignment))
+
+        # THROUGHPUT OVER THE LAST INTERVAL
+        now = time.time()
+        processed = self.consumer.processed - self.last_processed
+        processing_seconds = self.consumer.processing_seconds - self.last_processing_seconds
+        self.messages_per_second.set(processed / max(now - self.last_update, 1e-9))
+        self.processing_ms.set(processing_seconds / processed * 1000 if processed else 0.0)
+        self.last_processed += processed
+        self.last_processing_seconds += processing_seconds
+        self.last_update = now
+
+    # STOP REFRESHING -- THE ENDPOINT KEEPS SERVING THE LAST VALUES
+    def stop(self):
+        self.thread_lock.kill()
@@ -0,0 +1,225 @@
+import json
+import mmap
+import os
+
+import h5py
+import numpy as np
+
+# PACKED DATASET: THE RECORDS OF AN HDF5 DATASET, SERIALIZED ONCE INTO ONE FLAT BINARY FILE PLUS AN INDEX
+#   name.packed              THE RECORDS, BACK TO BACK
+#   name.packed.index.npz    offsets: RECORD i IS packed[offsets[i]:offsets[i + 1]]
+#                            starts: FIRST RECORD OF EVERY STREAM (A SENSOR, OR ALL THE IMAGES), PLUS THE RECORD COUNT
+#                            names, metadata: STREAM NAMES AND THE METADATA OF THE HDF5 FILE
+#                            frames: FIRST RECORD OF EVERY FRAME, PLUS THE RECORD COUNT (IMAGE DATASETS ONLY)
+# THE READERS MAP THE FILE READ-ONLY, SO FEEDER PROCESSES SHARE ONE PAGE-CACHED COPY, AND A DATASET LARGER THAN RAM
+# IS PAGED IN AS IT IS SENT INSTEAD OF BEING LOADED UP FRONT
+#   LIDAR RECORDS: THE BYTES OF LidarFrame.to_bytes(), ONE STREAM PER SENSOR
+#   IMAGE RECORDS: THE IMAGE BYTES OF dataset_utils.load_dataset(), IN THE SAME ORDER, IN ONE STREAM ('images')
+
+PACKED_SUFFIX = '.packed'
+INDEX_SUFFIX = '.index.npz'
+
+# FRAMES READ FROM THE HDF5 FILE AT A TIME WHILE PACKING, SO PACKING ALSO WORKS FOR DATASETS LARGER THAN RAM
+PACK_CHUNK_FRAMES = 256
+
+def is_packed_dataset(path):
+    return path.endswith(PACKED_SUFFIX)
+
+###################################################################################################
+###################################################################################################
+
+# WRITE streams (PAIRS OF NAME AND AN ITERABLE OF BYTES-LIKE RECORDS) TO output_path, RETURNS THE NUMBER OF RECORDS
+# frames IS SAVED AFTER THE RECORDS ARE WRITTEN, SO THE RECORD ITERABLES CAN FILL IT AS THEY GO
+def write_packed(output_path, streams, metadata=None, frames=None):
+    offsets = [0]
+    starts = []
+    names = []
+
+    # WRITTEN UNDER TEMPORARY NAMES, SO A READER NEVER OPENS A HALF-WRITTEN DATASET
+    with open(output_path + '.tmp', 'wb') as file:
+        for name, records in streams:
+            names.append(name)
+            starts.append(len(offsets) - 1)
+            for record in records:
+                offsets.append(offsets[-1] + file.write(record))
+    starts.append(len(offsets) - 1)
+
+    with open(output_path + INDEX_SUFFIX + '.tmp', 'wb') as file:
+        extra = {} if frames is None else {'frames': np.array(frames, dtype=np.int64)}
+        np.savez(
+            file,
+            offsets=np.array(offsets, dtype=np.int64),
+            starts=np.array(starts, dtype=np.int64),
+            names=np.array(names),
+            metadata=np.array(json.dumps(metadata or {})),
+            **extra,
+        )
+    os.replace(output_path + '.tmp', output_path)
+    os.replace(output_path + INDEX_SUFFIX + '.tmp', output_path + INDEX_SUFFIX)
+    return len(offsets) - 1
+
+# LIDAR DATASET: ONE STREAM OF SERIALIZED LidarFrames PER SENSOR
+def pack_lidar_dataset(dataset_path, output_path):
+    with h5py.File(dataset_path, 'r') as dataset:
+        metadata = json.loads(dataset['metadata'][()])
+        ids = dataset['state/id'][()]
+        rotations = dataset['state/rotation'][()]
+        locations = dataset['state/location'][()]
+
+        def sensor_records(sensor):
+            sensor_data = dataset['sensors'][sensor]
+            n_frames = len(sensor_data)
+
+            # ROW OF THE SENSOR'S ACTOR IN EVERY FRAME, THE SAME LOOKUP AS lidar_dataset_reader
+            matches = ids[:n_frames] == metadata[sensor]['id']
+            if not matches.any(axis=1).all():
+                raise ValueError(f"ACTOR {metadata[sensor]['id']} OF SENSOR {sensor} IS MISSING FROM SOME FRAMES")
+            actor_index = matches.argmax(axis=1)
+
+            # SAME LAYOUT AS LidarFrame.to_bytes(): POINTS, ROTATION, POSITION (ALL float32)
+            for first in range(0, n_frames, PACK_CHUNK_FRAMES):
+                chunk = sensor_data[first:first + PACK_CHUNK_FRAMES]
+                for i, points in enumerate(chunk, start=first):
+                    yield b''.join([
+                        points.astype(np.float32, copy=False).tobytes(),
+                        rotations[i, actor_index[i]].astype(np.float32, copy=False).tobytes(),
+                        locations[i, actor_index[i]].astype(np.float32, copy=False).tobytes(),
+                    ])
+
+        sensors = list(dataset['sensors'].keys())
+        return write_packed(output_path, [(sensor, sensor_records(sensor)) for sensor in sensors], metadata)
+
+# IMAGE DATASET: THE ACTIVE IMAGES OF ALL SENSORS, FRAME BY FRAME, LIKE dataset_utils.load_dataset()
+def pack_image_dataset(dataset_path, output_path):
+    with h5py.File(dataset_path, 'r') as dataset:
+        metadata = json.loads(dataset['metadata'][()])
+        activity = dataset['is_enabled']
+        sensors = dataset['sensors']
+        frames = [0]
+
+        def image_records():
+            sensor_data_iters = {key: iter(sensors[key]) for key in sensors.keys()}
+            n_records = 0
+            for frame in range(metadata['n_frames']):
+                for sensor_name, data_iter in sensor_data_iters.items():
+                    if activity[sensor_name][frame]:
+                        image = next(data_iter)
+                        yield image.tobytes() if isinstance(image, np.ndarray) else bytes(image)
+                        n_records += 1
+                frames.append(n_records)
+
+        return write_packed(output_path, [('images', image_records())], metadata, frames)
+
+# THE HDF5 LAYOUT TELLS THE DATASETS APART: LIDAR DATASETS HAVE ROBOT STATES, IMAGE DATASETS HAVE ACTIVITY FLAGS
+def pack_dataset(dataset_path, output_path=None):
+    if output_path is None:
+        output_path = os.path.splitext(dataset_path)[0] + PACKED_SUFFIX
+    with h5py.File(dataset_path, 'r') as dataset:
+        is_lidar = 'state' in dataset
+    n_records = (pack_lidar_dataset if is_lidar else pack_image_dataset)(dataset_path, output_path)
+    return output_path, n_records
+
+###################################################################################################
+###################################################################################################
+
+# THE RECORDS OF ONE STREAM AS A SEQUENCE OF READ-ONLY MEMORYVIEWS, NOTHING IS READ UNTIL A RECORD IS ACCESSED
+# repeat PLAYS THE RECORDS THAT MANY TIMES IN A ROW, WITHOUT COPYING THEM
+class create_packed_stream:
+    def __init__(self, view, offsets, first, count, repeat=1):
+        self.view = view
+        self.offsets = offsets
+        self.first = first
+        self.count = count
+        self.repeat = max(1, int(repeat))
+
+    def __len__(self):
+        return self.count * self.repeat
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f'RECORD {index} OUT OF RANGE ({length} RECORDS)')
+        index %= self.count
+        start = self.offsets[self.first + index]
+        return self.view[start:self.offsets[self.first + index + 1]]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    # BYTES OF ALL RECORDS (EVERY REPETITION), READ FROM THE INDEX ONLY
+    @property
+    def nbytes(self):
+        return (self.offsets[self.first + self.count] - self.offsets[self.first]) * self.repeat
+
+class create_packed_dataset:
+    def __init__(self, path):
+        with np.load(path + INDEX_SUFFIX) as index:
+            # PLAIN INTS ARE FASTER TO SLICE WITH THAN NUMPY SCALARS
+            self.offsets = index['offsets'].tolist()
+            self.starts = index['starts'].tolist()
+            self.names = [str(name) for name in index['names']]
+            self.metadata = json.loads(str(index['metadata']))
+            # DATASETS PACKED BEFORE THE FRAME INDEX EXISTED HAVE NONE
+            self.frames = index['frames'].tolist() if 'frames' in index.files else None
+
+        with open(path, 'rb') as file:
+            # AN EMPTY FILE CANNOT BE MAPPED
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else None
+        self.view = memoryview(self.mapping) if self.mapping is not None else memoryview(b'')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # A STREAM BY NAME OR BY POSITION, limit CAPS THE NUMBER OF RECORDS
+    def stream(self, key, limit=-1, repeat=1):
+        position = self.names.index(key) if isinstance(key, str) else key
+        first, end = self.starts[position], self.starts[position + 1]
+        count = end - first if limit < 0 else min(end - first, limit)
+        return create_packed_stream(self.view, self.offsets, first, count, repeat)
+
+    # NUMBER OF RECORDS IN THE FIRST n_frames FRAMES (IMAGE DATASETS, WHERE A FRAME HOLDS 0 OR MORE IMAGES)
+    def frame_records(self, n_frames):
+        if self.frames is None:
+            raise ValueError('THE DATASET HAS NO FRAME INDEX, PACK IT AGAIN TO LIMIT IT BY FRAMES')
+        return self.frames[min(n_frames, len(self.frames) - 1)]
+
+    # LIDAR DATASETS: THE SENSORS ARE THE STREAMS, SO A PACKED DATASET CAN STAND IN FOR create_frame_buffer
+    @property
+    def n_sensors(self):
+        return len(self.names)
+
+    def sensor(self, sensor_index):
+        return self.stream(sensor_index)
+
+    def frame(self, sensor_index, frame_index):
+        return self.stream(sensor_index)[frame_index]
+
+    @property
+    def nbytes(self):
+        return self.offsets[-1]
+
+    # THE VIEWS HANDED OUT KEEP THE MAP OPEN UNTIL THEY ARE RELEASED
+    def close(self):
+        self.view.release()
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                pass
+
+###################################################################################################
+###################################################################################################
+
+# python3 -m warehouse.utils.packed_dataset datasets/robots-4_points-5000.hdf5
+# python3 -m data_feeder.utilz.packed_dataset data_feeder/datasets/mini.hdf5
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('datasets', nargs='+', help='HDF5 datasets to pack, next to the originals.')
+    for dataset_path in parser.parse_args().datasets:
+        output_path, n_records = pack_dataset(dataset_path)
+        print(f'PACKED {n_records} RECORDS FROM {dataset_path} INTO {output_path}')
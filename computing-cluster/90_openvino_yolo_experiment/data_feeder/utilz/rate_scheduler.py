@@ -0,0 +1,215 @@
+import bisect
+import random
+import time
+from threading import Barrier, Event, Lock
+
+import numpy as np
+
+# PACES THE PRODUCER THREADS OF A FEEDER ON ABSOLUTE DEADLINES
+#   THE k-TH SEND OF A THREAD IS DUE AT start + (SUM OF THE FIRST k GAPS), NOT "INTERVAL AFTER THE PREVIOUS SEND ENDED",
+#   SO A SLOW PRODUCE IS CAUGHT UP BY THE FOLLOWING SENDS INSTEAD OF LOWERING THE RATE FOR THE REST OF THE RUN
+#   THE THREADS MEET AT A BARRIER AND START TOGETHER AT A COMMON TIMESTAMP, WITHOUT BUSY-WAITING
+#   EVERY SEND RECORDS ITS INTENDED (DEADLINE) AND ACTUAL TIME, SO THE OFFERED LOAD IS MEASURED, NOT ASSUMED
+#   THE RECORD OF A THREAD HAS A FIXED SIZE (COUNTS, LATEST TIMES AND A LATENESS HISTOGRAM), SO A LONG RUN DOES NOT GROW
+
+# LATENESS HISTOGRAM EDGES: 50 LOG-SPACED BINS PER DECADE FROM 0.01 ms TO 1000 s, SO A PERCENTILE IS WITHIN ABOUT 5%
+LATENESS_EDGES_MS = np.logspace(-2, 6, 8 * 50 + 1).tolist()
+
+###################################################################################################
+###################################################################################################
+
+class create_rate_scheduler:
+
+    # interval: SECONDS BETWEEN TWO SENDS OF ONE THREAD, A FUNCTION OF THE SECONDS SINCE THE START, OR None/0 FOR NO PACING
+    # poisson: EXPONENTIAL GAPS WITH interval AS THEIR MEAN, INSTEAD OF FIXED GAPS
+    # pause: SECONDS SINCE THE START WHEN THE CURRENT PAUSE (A STRETCH WITHOUT SENDS) ENDS, OR A FUNCTION OF THE SECONDS
+    #   SINCE THE START RETURNING THAT END, OR None OUTSIDE A PAUSE. A DEADLINE IN A PAUSE MOVES TO ITS END
+    # duration: SECONDS AFTER THE START WHEN THE THREADS STOP, OR None TO STOP ONLY WHEN KILLED OR DONE
+    # start_delay: SECONDS BETWEEN THE LAST THREAD REACHING THE BARRIER AND THE COMMON START
+    # start_at: ABSOLUTE START TIME, E.G. ONE SHARED BY SEVERAL FEEDER PROCESSES, INSTEAD OF start_delay
+    def __init__(self, n_threads, interval=None, poisson=False, duration=None, start_delay=3, seed=None, start_at=None,
+                 pause=None):
+        self.interval = interval
+        self.poisson = poisson
+        self.pause = pause
+        self.duration = duration
+        self.start_delay = start_delay
+        self.seed = seed
+        self.start_at = start_at
+
+        # THE LAST THREAD TO ARRIVE SETS THE START TIME FOR EVERYONE
+        self.start = None
+        self.started = Event()
+        self.barrier = Barrier(n_threads, action=self._set_start)
+
+        self.lock = Lock()
+        self.pacers = []
+
+    def _set_start(self):
+        self.start = self.start_at if self.start_at is not None else time.time() + self.start_delay
+        self.started.set()
+
+    # CHANGE THE INTERVAL WHILE RUNNING (E.G. AT A BREAKPOINT OF A WORKLOAD CYCLE), USED FROM THE NEXT GAP ON
+    def set_interval(self, interval):
+        self.interval = interval
+
+    def current_interval(self, seconds_since_start):
+        interval = self.interval
+        if callable(interval):
+            interval = interval(seconds_since_start)
+        return interval or 0.0
+
+    # START OR END A PAUSE WHILE RUNNING, E.G. AT A BREAKPOINT WITHOUT LOAD (None ENDS IT)
+    def set_pause(self, pause):
+        self.pause = pause
+
+    # THE DEADLINE, OR THE END OF THE PAUSE IT FALLS IN. THE END IS AN ABSOLUTE TIME AND IS NEVER RANDOMIZED, SO POISSON
+    # GAPS ARE ONLY DRAWN WHILE THERE IS LOAD, AND THE LOAD RESUMES ON TIME AFTER EVERY PAUSE
+    def resume_deadline(self, deadline):
+        pause = self.pause
+        if callable(pause):
+            pause = pause(deadline - self.start)
+        if pause is None:
+            return deadline
+        return max(deadline, self.start + pause)
+
+    # FOR THREADS THAT ARE NOT PACED THEMSELVES (E.G. A WORKLOAD HANDLER): BLOCK UNTIL THE COMMON START
+    def wait_start(self):
+        self.started.wait()
+        sleep_until(self.start)
+        return self.start
+
+    # CALLED BY EVERY PRODUCER THREAD: BLOCKS AT THE BARRIER AND RETURNS THE PACER OF THE THREAD
+    def join(self, nth_thread):
+        pacer = create_pacer(self, nth_thread)
+        with self.lock:
+            self.pacers.append(pacer)
+        self.barrier.wait()
+        pacer.deadline = self.start
+        return pacer
+
+    # OFFERED LOAD AS INTENDED AND AS ACHIEVED, AND HOW LATE THE SENDS WERE
+    def summary(self):
+        with self.lock:
+            pacers = [pacer for pacer in self.pacers if pacer.sent > 0]
+        if not pacers:
+            return {'sent': 0}
+        sent = sum(pacer.sent for pacer in pacers)
+        end = max(pacer.max_actual for pacer in pacers)
+        summary = {
+            'sent': int(sent),
+            'seconds': float(end - self.start),
+            'achieved_per_second': float(sent / max(end - self.start, 1e-9)),
+        }
+
+        # WITHOUT PACING EVERY SEND IS DUE AT THE START, SO THERE IS NO INTENDED RATE TO COMPARE WITH
+        max_intended = max(pacer.max_intended for pacer in pacers)
+        if max_intended > self.start:
+            counts = np.sum([pacer.lateness_counts for pacer in pacers], axis=0)
+            max_lateness = max(pacer.max_lateness_ms for pacer in pacers)
+            summary.update({
+                'intended_per_second': float(sent / (max_intended - self.start)),
+                'lateness_p50_ms': histogram_percentile(counts, 50, max_lateness),
+                'lateness_p99_ms': histogram_percentile(counts, 99, max_lateness),
+                'lateness_max_ms': float(max_lateness),
+            })
+        return summary
+
+###################################################################################################
+###################################################################################################
+
+# THE DEADLINES AND SEND RECORDS OF ONE THREAD
+class create_pacer:
+    def __init__(self, scheduler, nth_thread):
+        self.scheduler = scheduler
+        self.deadline = None
+
+        # SEND RECORD: THE LAST INTENDED TIME, THE LATEST INTENDED AND ACTUAL TIMES AND THE LATENESS DISTRIBUTION
+        self.sent = 0
+        self.due = None
+        self.max_intended = float('-inf')
+        self.max_actual = float('-inf')
+        self.max_lateness_ms = float('-inf')
+        self.lateness_counts = [0] * (len(LATENESS_EDGES_MS) + 1)
+
+        # SEEDED PER THREAD, SO POISSON RUNS ARE REPRODUCIBLE. THE SUM OF THE THREADS IS AGAIN A POISSON PROCESS
+        seed = None if scheduler.seed is None else scheduler.seed + nth_thread
+        self.random = random.Random(seed)
+
+    # RECORD THE SEND THAT wait() OR wait_until() RELEASES AT THE CURRENT DEADLINE
+    # due IS ITS INTENDED SEND TIME, FOR push_msg(..., intended=). UNLIKE THE KAFKA TIMESTAMP, IT DOES NOT MOVE WHEN
+    # THE THREAD FALLS BEHIND ITS SCHEDULE
+    def record(self):
+        actual = time.time()
+        lateness_ms = (actual - self.deadline) * 1000
+        self.sent += 1
+        self.due = self.deadline
+        self.max_intended = max(self.max_intended, self.deadline)
+        self.max_actual = max(self.max_actual, actual)
+        self.max_lateness_ms = max(self.max_lateness_ms, lateness_ms)
+        self.lateness_counts[bisect.bisect_right(LATENESS_EDGES_MS, lateness_ms)] += 1
+
+    # SLEEP UNTIL THE NEXT DEADLINE. RETURNS False WHEN THE THREAD SHOULD STOP (KILLED OR PAST THE DURATION)
+    def wait(self, alive_signal=None):
+        scheduler = self.scheduler
+        while True:
+            # A GAP THAT ENDS IN A PAUSE DOES NOT SEND IN IT, THE SEND MOVES TO THE END OF THE PAUSE
+            self.deadline = scheduler.resume_deadline(self.deadline)
+            if scheduler.duration is not None:
+                end = scheduler.start + scheduler.duration
+
+                # WITHOUT PACING THE DEADLINES STAY AT THE START, SO AN UNPACED THREAD STOPS BY THE CLOCK
+                paced = scheduler.current_interval(self.deadline - scheduler.start) > 0
+                if self.deadline >= end or (not paced and time.time() >= end):
+                    return False
+
+            sleep_until(self.deadline, alive_signal)
+            if alive_signal is not None and not alive_signal.is_active():
+                return False
+
+            # A PAUSE SET WHILE THE THREAD SLEPT (set_pause) HOLDS THE SEND BACK TOO
+            if scheduler.resume_deadline(self.deadline) == self.deadline:
+                break
+
+        self.record()
+
+        # THE NEXT DEADLINE FOLLOWS FROM THIS DEADLINE, NOT FROM WHEN THIS SEND HAPPENS TO FINISH
+        interval = scheduler.current_interval(self.deadline - scheduler.start)
+        if interval > 0 and scheduler.poisson:
+            interval = self.random.expovariate(1 / interval)
+        self.deadline += interval
+        return True
+
+    # FOR A GIVEN SCHEDULE (E.G. A REPLAYED TRACE): SLEEP UNTIL seconds_since_start INSTEAD OF THE NEXT GAP
+    # RECORDED LIKE wait(), RETURNS False WHEN THE THREAD SHOULD STOP (KILLED OR PAST THE DURATION)
+    def wait_until(self, seconds_since_start, alive_signal=None):
+        scheduler = self.scheduler
+        if scheduler.duration is not None and seconds_since_start >= scheduler.duration:
+            return False
+
+        self.deadline = scheduler.start + seconds_since_start
+        sleep_until(self.deadline, alive_signal)
+        if alive_signal is not None and not alive_signal.is_active():
+            return False
+
+        self.record()
+        return True
+
+###################################################################################################
+###################################################################################################
+
+# THE percentile-TH VALUE OF A LATENESS HISTOGRAM: THE UPPER EDGE OF ITS BIN, AT MOST THE LARGEST LATENESS SEEN
+def histogram_percentile(counts, percentile, max_value):
+    cumulative = np.cumsum(counts)
+    rank = max(1, int(np.ceil(cumulative[-1] * percentile / 100)))
+    index = int(np.searchsorted(cumulative, rank))
+    upper = LATENESS_EDGES_MS[index] if index < len(LATENESS_EDGES_MS) else max_value
+    return float(min(upper, max_value))
+
+# SLEEP UNTIL AN ABSOLUTE TIMESTAMP, WAKING UP AT LEAST EVERY SECOND TO NOTICE A KILLED THREAD
+def sleep_until(timestamp, alive_signal=None):
+    while True:
+        remaining = timestamp - time.time()
+        if remaining <= 0 or (alive_signal is not None and not alive_signal.is_active()):
+            return
+        time.sleep(min(remaining, 1.0))
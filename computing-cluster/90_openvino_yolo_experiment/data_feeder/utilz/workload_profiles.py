@@ -0,0 +1,309 @@
+import ast
+import bisect
+
+import numpy as np
+
+# WORKLOAD PROFILES: THE SHAPE OF THE OFFERED LOAD OVER A RUN, AS A SCALE OF THE MAXIMUM RATE (1.0 = FULL RATE)
+#   A PROFILE IS A VECTORIZED FUNCTION OF (SECONDS SINCE THE START, RUN DURATION), BUILT FROM PRIMITIVES:
+#     constant, steps, ramp, cycle (E.G. day_night), sinusoid, spike, bursts, random_walk, sequence
+#   PROFILES COMPOSE WITH + - * AND .clip(), E.G. day_night(5) * 0.8 + spike(600, 0.5, 30)
+#   profile.compile(duration) EVALUATES THE PROFILE ONCE INTO A PER-SECOND SCHEDULE. THE FEEDERS ONLY INDEX THAT
+#   SCHEDULE ON THE SEND PATH, SO A NEW STRESS PATTERN IS A NEW EXPRESSION (--profile), NOT A NEW FEEDER SCRIPT
+
+# THE DAY-NIGHT CYCLE OF THE FEEDERS, WORKLOAD PERCENTAGES OF THE HOURS 01 => 24
+DAY_NIGHT_CYCLE = [
+    0.03,   0.06,   0.09,   0.12,   0.266,  0.412,
+    0.558,  0.704,  0.85,   0.7625, 0.675,  0.587,
+    0.5,    0.59,   0.68,   0.77,   0.86,   0.97,
+    0.813,  0.656,  0.5,    0.343,  0.186,  0.03
+]
+
+###################################################################################################
+###################################################################################################
+
+class create_profile:
+
+    # function(t, duration): SCALES AT THE SECONDS t (A NUMPY ARRAY) OF A RUN OF duration SECONDS
+    def __init__(self, function, description='profile'):
+        self.function = function
+        self.description = description
+
+    def __call__(self, t, duration):
+        t = np.asarray(t, dtype=np.float64)
+        return np.broadcast_to(np.asarray(self.function(t, duration), dtype=np.float64), t.shape)
+
+    def __repr__(self):
+        return self.description
+
+    def _combine(self, other, operator, symbol, reverse=False):
+        other = as_profile(other)
+        first, second = (other, self) if reverse else (self, other)
+        return create_profile(lambda t, duration: operator(first(t, duration), second(t, duration)),
+                              f'({first} {symbol} {second})')
+
+    def __add__(self, other):
+        return self._combine(other, np.add, '+')
+
+    def __radd__(self, other):
+        return self._combine(other, np.add, '+', reverse=True)
+
+    def __sub__(self, other):
+        return self._combine(other, np.subtract, '-')
+
+    def __rsub__(self, other):
+        return self._combine(other, np.subtract, '-', reverse=True)
+
+    def __mul__(self, other):
+        return self._combine(other, np.multiply, '*')
+
+    def __rmul__(self, other):
+        return self._combine(other, np.multiply, '*', reverse=True)
+
+    def clip(self, low=0.0, high=None):
+        return create_profile(lambda t, duration: np.clip(self(t, duration), low, high),
+                              f'{self}.clip({low}, {high})')
+
+    # THE SCALE OF EVERY resolution SECONDS, HELD UNTIL THE NEXT ONE. NEGATIVE SCALES ARE CLIPPED TO 0 (NO SENDS)
+    def compile(self, duration, resolution=1.0):
+        times = np.arange(0.0, duration, resolution)
+        scales = np.clip(self(times, duration), 0.0, None)
+        return create_rate_schedule(times, scales, resolution, duration)
+
+def as_profile(value):
+    return value if isinstance(value, create_profile) else constant(value)
+
+###################################################################################################
+###################################################################################################
+
+def constant(level=1.0):
+    return create_profile(lambda t, duration: np.full(t.shape, float(level)), f'constant({level})')
+
+# levels FOR durations SECONDS EACH, OR SPREAD EVENLY OVER THE RUN. THE LAST LEVEL HOLDS UNTIL THE END, SO ITS
+# DURATION CAN BE LEFT OUT
+def steps(levels, durations=None):
+    levels = np.asarray(levels, dtype=np.float64)
+
+    def function(t, duration):
+        lengths = np.full(len(levels), duration / len(levels)) if durations is None else np.asarray(durations)
+        starts = np.concatenate([[0.0], np.cumsum(lengths)])[:len(levels)]
+        return levels[np.clip(np.searchsorted(starts, t, side='right') - 1, 0, len(levels) - 1)]
+    return create_profile(function, f'steps({levels.tolist()}, {durations})')
+
+# LINEAR FROM low AT start TO high AT stop (DEFAULT: THE END OF THE RUN), FLAT BEFORE AND AFTER
+def ramp(low=0.0, high=1.0, start=0.0, stop=None):
+    def function(t, duration):
+        end = duration if stop is None else stop
+        return np.interp(t, [start, end], [low, high])
+    return create_profile(function, f'ramp({low}, {high}, {start}, {stop})')
+
+# BREAKPOINTS SPREAD EVENLY OVER THE RUN AND LINEARLY INTERPOLATED, REPEATED n_cycles TIMES
+def cycle(points, n_cycles=1):
+    points = list(points) * n_cycles
+
+    def function(t, duration):
+        return np.interp(t, np.linspace(0, duration, len(points)), points)
+    return create_profile(function, f'cycle({len(points)} points)')
+
+def day_night(n_cycles=5):
+    profile = cycle(DAY_NIGHT_CYCLE, n_cycles)
+    profile.description = f'day_night({n_cycles})'
+    return profile
+
+# mean + amplitude * sin(...), period IN SECONDS (DEFAULT: ONE PERIOD OVER THE RUN), phase IN FRACTIONS OF A PERIOD
+def sinusoid(mean=0.5, amplitude=0.5, period=None, phase=0.0):
+    def function(t, duration):
+        length = duration if period is None else period
+        return mean + amplitude * np.sin(2 * np.pi * (t / length + phase))
+    return create_profile(function, f'sinusoid({mean}, {amplitude}, {period}, {phase})')
+
+# height FOR width SECONDS FROM at ON, 0 OTHERWISE. ADD IT TO A BASE PROFILE
+def spike(at, height=1.0, width=10.0):
+    def function(t, duration):
+        return np.where((t >= at) & (t < at + width), float(height), 0.0)
+    return create_profile(function, f'spike({at}, {height}, {width})')
+
+# A SPIKE EVERY every SECONDS FROM start ON. jitter MOVES EVERY BURST BY UP TO jitter SECONDS (SEEDED)
+def bursts(height=1.0, every=60.0, width=5.0, start=0.0, jitter=0.0, seed=None):
+    def function(t, duration):
+        onsets = np.arange(start, duration, every)
+        if jitter:
+            onsets = onsets + np.random.default_rng(seed).uniform(-jitter, jitter, len(onsets))
+        onsets = np.sort(onsets)
+
+        # THE LAST ONSET AT OR BEFORE EVERY t DECIDES WHETHER t IS IN A BURST
+        previous = np.searchsorted(onsets, t, side='right') - 1
+        in_burst = (previous >= 0) & (t - onsets[np.maximum(previous, 0)] < width)
+        return np.where(in_burst, float(height), 0.0)
+    return create_profile(function, f'bursts({height}, {every}, {width}, {start}, {jitter}, {seed})')
+
+# GAUSSIAN STEPS OF step EVERY every SECONDS, KEPT BETWEEN low AND high (SEEDED, SO A RUN CAN BE REPEATED)
+def random_walk(start=0.5, step=0.05, every=1.0, low=0.0, high=1.0, seed=None):
+    def function(t, duration):
+        n_steps = int(np.ceil(duration / every)) + 1
+        walk = np.empty(n_steps)
+        walk[0] = start
+        moves = np.random.default_rng(seed).normal(0.0, step, n_steps - 1)
+        for i, move in enumerate(moves, start=1):
+            walk[i] = min(max(walk[i - 1] + move, low), high)
+        return walk[np.clip((t // every).astype(np.int64), 0, n_steps - 1)]
+    return create_profile(function, f'random_walk({start}, {step}, {every}, {low}, {high}, {seed})')
+
+# PROFILES ONE AFTER THE OTHER: parts ARE (PROFILE, SECONDS) PAIRS, EVERY PROFILE SEES ITS OWN PART AS THE RUN
+# THE LAST PART HOLDS UNTIL THE END
+def sequence(*parts):
+    def function(t, duration):
+        result = np.zeros(t.shape)
+        offset = 0.0
+        for nth, (profile, seconds) in enumerate(parts):
+            last = nth == len(parts) - 1
+            mask = (t >= offset) if last else (t >= offset) & (t < offset + seconds)
+            if mask.any():
+                result[mask] = as_profile(profile)(t[mask] - offset, seconds)
+            offset += seconds
+        return result
+    return create_profile(function, f'sequence({", ".join(f"({p}, {s})" for p, s in parts)})')
+
+PRIMITIVES = {
+    'constant': constant,
+    'steps': steps,
+    'ramp': ramp,
+    'cycle': cycle,
+    'day_night': day_night,
+    'sinusoid': sinusoid,
+    'spike': spike,
+    'bursts': bursts,
+    'random_walk': random_walk,
+    'sequence': sequence,
+}
+
+###################################################################################################
+###################################################################################################
+
+class create_rate_schedule:
+
+    # scales[i]: THE SCALE FROM times[i] = i * resolution UNTIL THE NEXT STEP
+    def __init__(self, times, scales, resolution, duration):
+        self.times = times
+        self.scales = scales
+        self.resolution = resolution
+        self.duration = duration
+
+        # SECONDS FROM EVERY STEP TO THE NEXT STEP WITH SENDS, SO A THREAD IDLES THROUGH A SILENT STRETCH
+        active_steps = np.flatnonzero(scales > 0)
+        next_active = np.searchsorted(active_steps, np.arange(len(scales)))
+        has_next = next_active < len(active_steps)
+        self.resume = np.full(len(scales), float(duration))
+        self.resume[has_next] = times[active_steps[next_active[has_next]]]
+
+    def __len__(self):
+        return len(self.scales)
+
+    def step_index(self, seconds_since_start):
+        return min(max(int(seconds_since_start / self.resolution), 0), len(self.scales) - 1)
+
+    def scale_at(self, seconds_since_start):
+        return float(self.scales[self.step_index(seconds_since_start)])
+
+    # max_rate TIMES THE SCALE OF EVERY STEP
+    def rates(self, max_rate):
+        return self.scales * max_rate
+
+    # FOR create_rate_scheduler: base_interval IS THE GAP AT FULL RATE, A LOOKUP PER SEND INSTEAD OF AN np.interp
+    def interval_function(self, base_interval):
+        scales = self.scales.tolist()
+        resume = self.resume.tolist()
+        resolution = self.resolution
+        last = len(scales) - 1
+
+        def interval(seconds_since_start):
+            index = min(max(int(seconds_since_start / resolution), 0), last)
+            scale = scales[index]
+            if scale > 0:
+                return base_interval / scale
+            # NO SENDS IN THIS STEP: THE NEXT DEADLINE IS THE START OF THE NEXT STEP WITH SENDS (OR THE END). ONLY A
+            # FALLBACK FOR A SCHEDULER WITHOUT pause_function(), WHERE A POISSON SCHEDULER WOULD RANDOMIZE THIS GAP
+            return max(resume[index] - seconds_since_start, resolution)
+        return interval
+
+    # FOR create_rate_scheduler(pause=...): IN A STEP WITHOUT SENDS, THE START OF THE NEXT STEP WITH SENDS (OR THE END)
+    def pause_function(self):
+        scales = self.scales.tolist()
+        resume = self.resume.tolist()
+        resolution = self.resolution
+        last = len(scales) - 1
+
+        def pause(seconds_since_start):
+            index = min(max(int(seconds_since_start / resolution), 0), last)
+            return None if scales[index] > 0 else resume[index]
+        return pause
+
+    # [[SECONDS SINCE THE START, RATE], ...] WITH A STEP ONLY WHERE THE RATE CHANGES, FOR process_feeder AND THE FLEET
+    def steps(self, max_rate=1.0):
+        rates = self.rates(max_rate)
+        changes = np.flatnonzero(np.diff(rates, prepend=np.nan) != 0)
+        return [[float(self.times[i]), float(rates[i])] for i in changes]
+
+    def summary(self):
+        return {
+            'duration': self.duration,
+            'steps': len(self.scales),
+            'mean_scale': float(self.scales.mean()) if len(self.scales) else 0.0,
+            'peak_scale': float(self.scales.max()) if len(self.scales) else 0.0,
+        }
+
+# THE RATE OF [[SECONDS SINCE THE START, RATE], ...] STEPS AT A POINT IN TIME, BY BINARY SEARCH OVER THE STEP STARTS
+def step_rate(step_starts, step_rates, seconds_since_start):
+    return step_rates[max(bisect.bisect_right(step_starts, seconds_since_start) - 1, 0)]
+
+###################################################################################################
+###################################################################################################
+
+# PARSE A PROFILE EXPRESSION FROM THE COMMAND LINE, E.G. "day_night(5) * 0.8 + spike(600, 0.5, width=30)"
+# ONLY THE PRIMITIVES, NUMBERS, LISTS, TUPLES, + - * AND .clip() ARE ALLOWED, NOTHING IS eval'd
+def parse_profile(expression):
+    operators = {ast.Add: lambda a, b: a + b, ast.Sub: lambda a, b: a - b, ast.Mult: lambda a, b: a * b}
+
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and (node.value is None or isinstance(node.value, (int, float))):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -evaluate(node.operand)
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [evaluate(element) for element in node.elts]
+        if isinstance(node, ast.BinOp) and type(node.op) in operators:
+            left, right = evaluate(node.left), evaluate(node.right)
+            if not isinstance(left, create_profile) and not isinstance(right, create_profile):
+                return operators[type(node.op)](left, right)
+            return operators[type(node.op)](as_profile(left), right)
+        if isinstance(node, ast.Call):
+            args = [evaluate(arg) for arg in node.args]
+            kwargs = {keyword.arg: evaluate(keyword.value) for keyword in node.keywords}
+            if isinstance(node.func, ast.Name) and node.func.id in PRIMITIVES:
+                return PRIMITIVES[node.func.id](*args, **kwargs)
+            if isinstance(node.func, ast.Attribute) and node.func.attr == 'clip':
+                return as_profile(evaluate(node.func.value)).clip(*args, **kwargs)
+        raise ValueError(f'UNSUPPORTED PROFILE EXPRESSION: {ast.unparse(node)} (PRIMITIVES: {", ".join(PRIMITIVES)})')
+
+    return as_profile(evaluate(ast.parse(expression, mode='eval')))
+
+###################################################################################################
+###################################################################################################
+
+# python3 -m warehouse.utils.workload_profiles "day_night(5) * 0.8 + spike(600, 0.5, 30)" --duration 3600
+# python3 -m data_feeder.utilz.workload_profiles "ramp(0.1, 1) + bursts(0.5, every=120, width=10)" --duration 7200
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('profile', help='Profile expression, e.g. "ramp(0.1, 1) + bursts(0.5, every=120, width=10)".')
+    parser.add_argument('--duration', type=float, default=3600, help='Run duration in seconds. Default: 3600.')
+    parser.add_argument('--max_rate', type=float, default=1.0, help='Rate at scale 1. Default: 1 (print the scales).')
+    py_args = parser.parse_args()
+
+    profile = parse_profile(py_args.profile)
+    schedule = profile.compile(py_args.duration)
+    print(f'{profile}: {schedule.summary()}')
+    for step_start, rate in schedule.steps(py_args.max_rate):
+        print(f'{step_start:>10.0f} s {rate:>12.3f}')
@@ -84,6 +84,8 @@ class YoloToCSV:
 
         start_time = yolo_results['timestamps']['start_time']
         end_time = yolo_results['timestamps']['end_time']
+        # SCHEDULED SEND TIME OF THE FEEDER, FOR THE LATENCY CORRECTED FOR COORDINATED OMISSION
+        intended_time = yolo_results['timestamps'].get('intended_time', start_time)
 
         dat = copy.deepcopy(self.history)
         for key in self.history.keys():
@@ -105,6 +107,7 @@ class YoloToCSV:
             'post': post,
             'queue': queue,
             'start_time': start_time,
+            'intended_time': intended_time,
             'end_time': end_time,
             'id': img_id,
         })
@@ -34,7 +34,7 @@ yolo_models += ["yolov8n", "yolov8s", "yolov8m", "yolov8l", "yolov8x"]
 # feeder = day_night_feeder
 feeder = burst_feeder  # Use linear_feeder or day_night_feeder
 resolutions = [160, 320, 640, 1280]
-idle_before_start_1 = 120 # (seconds) Wait for yolo instances to receive their kafka assignments - otherwise might get stuck
+idle_before_start_1 = 120 # (seconds) Max wait for yolo instances to receive their kafka assignments - otherwise might get stuck
 idle_before_start_2 = 0.5 * 60  # (seconds) Additional wait after Kafka is verified working
 idle_after_end = 0.5 * 60  # (seconds) Catch the tail of the experiment metrics
 num_images_for_small_models = 30000  # (1000 img -> 2s to send --- 5000 img -> 10s to send)
@@ -96,6 +96,28 @@ def wait_for_amount_replicas(num_replicas):
         time.sleep(5)  # Wait for 10 seconds before checking again
 
 
+def wait_for_ready(num_replicas, timeout_s):
+    # Pods turn ready once their consumer has received its kafka partitions (readinessProbe in consumer_template.yaml)
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        result = subprocess.run(
+            ["kubectl", "get", "pods", "-n", "workloadb", "-l", "run=yolo-consumer", "-o", "yaml"],
+            capture_output=True,
+            text=True
+        )
+        pods = yaml.safe_load(result.stdout)
+        ready_pods = [pod for pod in pods["items"] if any(
+            condition["type"] == "Ready" and condition["status"] == "True"
+            for condition in pod["status"].get("conditions", []))]
+        if len(ready_pods) >= num_replicas:
+            log(f"All {num_replicas} yolo-consumer pods have received their kafka assignments")
+            return True
+        log(f"Waiting for {len(ready_pods)}/{num_replicas} yolo-consumer pods to receive their kafka assignments...")
+        time.sleep(5)
+    log("Timed out waiting for yolo-consumer pods to become ready, starting anyway")
+    return False
+
+
 def wait_for_terminate(num_replicas):
     while True:
         result = subprocess.run(
@@ -191,9 +213,8 @@ clean_up()
 wait_for_terminate(0)
 log(f"Make sure the Kafka topics exist")
 kafka_init.init_kafka(kafka_servers=kafka_servers, num_partitions=num_yolo_consumers)
-log(f"Waiting for any delayed images before the next experiment...")
-leftover_images = dummy_validate.wait_for_results({-1}, kafka_servers=kafka_servers, msg_callback=None, timeout_s=5)
-log(f"Received {leftover_images} delayed images.")
+log(f"Emptying the Kafka topics before the next experiment...")
+kafka_init.reset_topics(kafka_servers, ["yolo_input", "yolo_output"], log_func=log)
 
 for resolution in resolutions:
     for model in yolo_models:
@@ -216,10 +237,10 @@ for resolution in resolutions:
             ["kubectl", "scale", "deployment", "yolo-consumer", "-n", "workloadb", f"--replicas={num_yolo_consumers}"])
         wait_for_amount_replicas(num_yolo_consumers)
         log("Application deployed.")
-        log(f"Waiting for {idle_before_start_1} seconds so applications have a chance to set up completely")
+        log(f"Waiting up to {idle_before_start_1} seconds for the consumers to receive their kafka assignments")
         # Maybe related Kafka issue: https://github.com/akka/alpakka-kafka/issues/382
         # Our problem also seems to happen like: A) consumer pulls message B) other consumer connects C) Kafka reassigns -> message lost
-        time.sleep(idle_before_start_1)  # Wait for initialization (How to know how long to wait?)
+        wait_for_ready(num_yolo_consumers, timeout_s=idle_before_start_1)
         # Check that the applications are ready
         log("")
         log("Sending some images to check that at least one pod can process data.")
@@ -291,9 +312,7 @@ for resolution in resolutions:
         snapshot_path = snapshot_results["path"]
         zip_snapshot(snapshot_path, yolo_csv_folder, name=f"{run_name}")
         log(f"Zipping done\n")
-        log(f"Waiting for any delayed images before the next experiment...")
-        leftover_images = dummy_validate.wait_for_results(image_ids, kafka_servers=kafka_servers, msg_callback=None,
-                                                          timeout_s=10)
-        log(f"Received {leftover_images} delayed images.")
+        log(f"Emptying the Kafka topics before the next experiment...")
+        kafka_init.reset_topics(kafka_servers, ["yolo_input", "yolo_output"], log_func=log)
         log(f"Experiment with YOLO_MODEL={run_name} completed.\n\n")
 log("All experiments completed.")
@@ -141,9 +141,8 @@ kafka_init.init_kafka(kafka_servers=kafka_servers, num_partitions=num_yolo_consu
 log(f"Removing any leftover containers from previous experiments...")
 clean_up()
 wait_for_terminate(0)
-log(f"Waiting for any delayed images before the next experiment...")
-leftover_images = dummy_validate.wait_for_results({-1}, kafka_servers=kafka_servers, msg_callback=None, timeout_s=5)
-log(f"Received {leftover_images} delayed images.")
+log(f"Emptying the Kafka topics before the next experiment...")
+kafka_init.reset_topics(kafka_servers, ["yolo_input", "yolo_output"], log_func=log)
 
 for model in yolo_models:
     log(f"Starting experiment with YOLO_MODEL={model}")
@@ -227,9 +226,8 @@ for model in yolo_models:
     zip_snapshot(snapshot_path, yolo_csv_folder, name=model)
     log(f"Zipping done\n")
 
-    log(f"Waiting for any delayed images before the next experiment...")
-    leftover_images = dummy_validate.wait_for_results(image_ids, kafka_servers=kafka_servers, msg_callback=None, timeout_s=10)
-    log(f"Received {leftover_images} delayed images.")
+    log(f"Emptying the Kafka topics before the next experiment...")
+    kafka_init.reset_topics(kafka_servers, ["yolo_input", "yolo_output"], log_func=log)
     log(f"Experiment with YOLO_MODEL={model} completed.\n\n")
 
 log("All experiments completed.")
@@ -0,0 +1,111 @@
+import mmap
+import os
+import time
+import uuid
+from collections import deque
+from threading import Lock
+
+# CLAIM CHECK: LARGE PAYLOADS ARE WRITTEN TO A BLOB STORE AND ONLY THEIR REFERENCE TRAVELS THROUGH KAFKA
+
+# MESSAGES WITH THIS HEADER CARRY A BLOB REFERENCE INSTEAD OF THE PAYLOAD
+CLAIM_CHECK_HEADER = 'claim-check'
+
+# KAFKA REJECTS MESSAGES ABOVE 1 MB BY DEFAULT (message.max.bytes), SO LARGER PAYLOADS ARE CHECKED IN WELL BEFORE THAT
+CLAIM_CHECK_THRESHOLD = 512 * 1024
+
+###################################################################################################
+###################################################################################################
+
+# PRODUCER SIDE: REPLACE A LARGE PAYLOAD WITH A REFERENCE, RETURNS (VALUE, HEADERS) FOR PRODUCE()
+def check_in(blob_store, bytes_data, threshold=CLAIM_CHECK_THRESHOLD):
+    if blob_store is None or len(bytes_data) <= threshold:
+        return bytes_data, []
+    return blob_store.put(bytes_data), [(CLAIM_CHECK_HEADER, b'1')]
+
+# CONSUMER SIDE: DOES THE MESSAGE CARRY A BLOB REFERENCE?
+def is_claim_check(msg):
+    return any(key == CLAIM_CHECK_HEADER for key, _ in msg.headers() or [])
+
+###################################################################################################
+###################################################################################################
+
+# BLOBS ARE FILES IN A DIRECTORY -- A SHARED VOLUME WHEN PRODUCERS AND CONSUMERS RUN ON DIFFERENT MACHINES
+# OTHER BACKENDS (E.G. AN OBJECT STORE) ONLY NEED THE SAME FOUR METHODS: put, open, release AND collect_garbage
+class create_local_blob_store:
+
+    # release_delay: SECONDS A CONSUMED BLOB IS KEPT, SO A REDELIVERED MESSAGE (AT-LEAST-ONCE) CAN STILL READ IT
+    # max_age: BLOBS OLDER THAN THIS ARE DELETED EVEN IF NOBODY CONSUMED THEM (E.G. THE CONSUMER CRASHED)
+    def __init__(self, root, release_delay=60.0, max_age=3600.0, sweep_interval=60.0):
+        self.root = root
+        self.release_delay = release_delay
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        os.makedirs(root, exist_ok=True)
+
+        # OPEN MEMORY MAPS, AND CONSUMED BLOBS WAITING FOR DELETION
+        self.lock = Lock()
+        self.mapped = {}
+        self.released = deque()
+        self.last_sweep = time.time()
+
+    # WRITE A BLOB AND RETURN ITS REFERENCE
+    def put(self, bytes_data):
+        name = uuid.uuid4().hex
+        path = os.path.join(self.root, name)
+
+        # WRITE UNDER A TEMPORARY NAME, SO CONSUMERS NEVER SEE A HALF-WRITTEN BLOB
+        with open(path + '.tmp', 'wb') as file:
+            file.write(bytes_data)
+        os.replace(path + '.tmp', path)
+        return name.encode('utf-8')
+
+    # MAP A BLOB INTO MEMORY AND RETURN A ZERO-COPY VIEW OF IT
+    def open(self, ref):
+        with open(os.path.join(self.root, ref.decode('utf-8')), 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        with self.lock:
+            self.mapped[ref] = (mapping, view)
+        return view
+
+    # THE BLOB WAS HANDLED -- UNMAP IT AND SCHEDULE ITS DELETION
+    def release(self, ref):
+        with self.lock:
+            mapping, view = self.mapped.pop(ref, (None, None))
+            self.released.append((time.time(), ref))
+        if mapping is not None:
+            view.release()
+            try:
+                mapping.close()
+
+            # THE HANDLER KEPT A VIEW (E.G. A NUMPY ARRAY) -- THE MAP CLOSES WHEN THAT IS GARBAGE-COLLECTED
+            except BufferError:
+                pass
+
+    # DELETE RELEASED BLOBS AFTER release_delay, AND ORPHANED BLOBS AFTER max_age. RETURNS THE NUMBER DELETED
+    def collect_garbage(self):
+        now = time.time()
+        expired = []
+        with self.lock:
+            while self.released and now - self.released[0][0] >= self.release_delay:
+                expired.append(self.released.popleft()[1])
+
+        deleted = 0
+        for ref in expired:
+            try:
+                os.remove(os.path.join(self.root, ref.decode('utf-8')))
+                deleted += 1
+            except FileNotFoundError:
+                pass  # ALREADY DELETED BY ANOTHER CONSUMER THAT READ THE SAME MESSAGE
+
+        # SWEEPING THE DIRECTORY IS SLOW, SO IT ONLY HAPPENS EVERY sweep_interval SECONDS
+        if now - self.last_sweep >= self.sweep_interval:
+            self.last_sweep = now
+            for entry in os.scandir(self.root):
+                try:
+                    if now - entry.stat().st_mtime >= self.max_age:
+                        os.remove(entry.path)
+                        deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
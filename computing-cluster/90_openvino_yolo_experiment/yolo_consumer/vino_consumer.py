@@ -2,8 +2,9 @@ import time
 
 import numpy as np
 
-from utilz.kafka_utils import create_consumer, create_producer
-from utilz.misc import custom_serializer, resource_exists, log, create_lock
+from utilz.claim_check import create_local_blob_store
+from utilz.kafka_utils import create_batch_producer, create_consumer, create_metrics_exporter, create_producer
+from utilz.misc import custom_serializer, resource_exists, hot_log, log, create_lock, mark_ready, mark_unready
 from PIL import Image
 from numpy import asarray
 import io, socket, os
@@ -26,21 +27,44 @@ def run():
         'kafka_output': os.environ.get('KAFKA_OUTPUT_TOPIC', 'yolo_output'),
         'kafka_servers': os.environ.get('KAFKA_SERVERS', 'localhost:10001,localhost:10002,localhost:10003'),
         'VERBOSE': os.environ.get('VERBOSE', 'FALSE') == 'TRUE',
+        'producer_mode': os.environ.get('PRODUCER_MODE', 'default'),  # 'batch' for the batching producer
+        'commit_mode': os.environ.get('COMMIT_MODE', 'eager'),  # 'batched' commits processed offsets in batches
+        'assignment': os.environ.get('ASSIGNMENT', 'eager'),  # 'cooperative' rebalances without pausing the group
+        'instance_id': os.environ.get('POD_NAME'),  # Static group membership, set from the pod name
+        'metrics_port': int(os.environ.get('METRICS_PORT', '0')),  # Prometheus lag/throughput endpoint, 0 disables
+        'log_mode': os.environ.get('LOG_MODE', 'async'),  # Per-message logs: 'async', 'sync' or 'off'
+        'log_sample_every': int(os.environ.get('LOG_SAMPLE_EVERY', '1')),  # Log 1 in N per call site
+        'log_max_per_second': float(os.environ.get('LOG_MAX_PER_SECOND', '0')),  # Per call site, 0 is unlimited
+        'claim_check_dir': os.environ.get('CLAIM_CHECK_DIR', ''),  # Shared blob directory for large payloads
         'resolution': os.environ.get('RESOLUTION', '640'),
+        'batch_size': int(os.environ.get('BATCH_SIZE', '1')),  # Images per consume() call and inference request
 
     }
     print(args)
 
     logging.basicConfig(filename='yolo_log.log', level=logging.DEBUG)
-
-    kafka_consumer = create_consumer(args['kafka_input'], kafka_servers=args['kafka_servers'])
-    kafka_producer = create_producer(kafka_servers=args['kafka_servers'])
+    hot_log.configure(args['log_mode'], args['log_sample_every'], args['log_max_per_second'])
+
+    # Payloads above the claim-check threshold arrive as references to blobs in this directory
+    blob_store = create_local_blob_store(args['claim_check_dir']) if args['claim_check_dir'] else None
+    kafka_consumer = create_consumer(args['kafka_input'], kafka_servers=args['kafka_servers'],
+                                     commit_mode=args['commit_mode'], assignment=args['assignment'],
+                                     instance_id=args['instance_id'], on_assigned=lambda partitions: mark_ready(),
+                                     on_unassigned=mark_unready, blob_store=blob_store)
+    if args['producer_mode'] == 'batch':
+        kafka_producer = create_batch_producer(kafka_servers=args['kafka_servers'])
+    else:
+        kafka_producer = create_producer(kafka_servers=args['kafka_servers'])
 
     # Check that Kafka is working
     if not kafka_producer.connected() or not kafka_consumer.connected():
         log(f'Could not connect Kafka producer or consumer!')
         return
 
+    # Export the queue depth and throughput of the consumer
+    if args['metrics_port'] > 0:
+        create_metrics_exporter(kafka_consumer, port=args['metrics_port'])
+
     # Check that model exists
     model = args['model']
     if not os.path.exists(f"{model}_openvino_model"):
@@ -55,6 +79,9 @@ def run():
     device = core.available_devices[0]
     log(f'Available devices: {core.available_devices}')
     non_compiled_model = core.read_model(f"{model}.onnx")
+    if args['batch_size'] > 1:
+        # Dynamic batch dimension, so a whole consumed batch runs as one inference request
+        non_compiled_model.reshape([-1, 3, int(args['resolution']), int(args['resolution'])])
     config = {props.hint.performance_mode: props.hint.PerformanceMode.LATENCY}
     yolo_ov_core = core.compile_model(non_compiled_model, device, config)
     log(f'Loaded model ({args["model"]}) on device ({device})')
@@ -67,31 +94,35 @@ def run():
     thread_lock = create_lock()
 
 
-    def process_event(img_bytes, msg_key, time_received, time_sent):
+    def preprocess(img_bytes):
+        img = Image.open(io.BytesIO(img_bytes))
+        image_array = asarray(img)
+        image_array = image_array.reshape((1, 3, 640, 640))
+        resolution = int(args['resolution'])
+        if resolution != 640:
+            image_array = image_array.copy()  # Fix ownership of the image by copying
+            image_array = image_array.resize((1, 3, int(args['resolution']), int(args['resolution'])))
+        return image_array
+
+    def process_event(img_bytes, msg_key, time_received, time_sent, time_intended):
         global errors
         nonlocal idle_timer
         queue_time = time_received - time_sent  # How long was the message waiting in queue?
         img_id = msg_key.decode('utf-8')
 
         if args['VERBOSE']:
-            print(f"Image {img_id} received! Queue_time: {queue_time} ms, size {len(img_bytes)} bytes.")
+            hot_log("Image received", id=img_id, queue_ms=queue_time, bytes=len(img_bytes))
         t_idle = time.time() - idle_timer
         t1 = time.time()
         # Preprocess: Fetch image
-        img = Image.open(io.BytesIO(img_bytes))
-        image_array = asarray(img)
-        image_array = image_array.reshape((1, 3, 640, 640))
-        resolution = int(args['resolution'])
-        if resolution != 640:
-            image_array = image_array.copy()  # Fix ownership of the image by copying
-            image_array = image_array.resize((1, 3, int(args['resolution']), int(args['resolution'])))
+        image_array = preprocess(img_bytes)
         t_pre = (time.time() - t1) * 1000
         t2 = time.time()
         # Inference
         results = yolo_ov_core(image_array)
         t_inf = (time.time() - t2) * 1000
         if args['VERBOSE']:
-            print(f"queue: {queue_time}, t_pre: {t_pre}, t_inf: {t_inf}")
+            hot_log("Image handled", queue_ms=queue_time, pre_ms=t_pre, inf_ms=t_inf)
 
         # Postprocess: (TODO: Does ultralytics library do postprocessing by itself?)
 
@@ -105,7 +136,9 @@ def run():
                     'inf': t_inf,
                     'post': 0.0, # No postprocessing
                     'queue': queue_time,
+                    'queue_corrected': time_received - time_intended,  # From the feeder's schedule
                     'start_time': time_sent,
+                    'intended_time': time_intended,  # Scheduled send time of the feeder
                     'end_time': time_received
                 },
                 'id': img_id,
@@ -113,19 +146,69 @@ def run():
                 'source': ip_addr,
                 'model': args['model'],
                 #'dimensions': results[0].orig_shape
-                'dimensions': results[0].shape
+                'dimensions': results[0].shape,
+                'batch_size': 1,
             }))
         print("Errors:", errors)
 
+    def process_batch(batch, time_received):
+        global errors
+        nonlocal idle_timer
+
+        if args['VERBOSE']:
+            hot_log("Batch received", size=len(batch))
+        t_idle = time.time() - idle_timer
+        t1 = time.time()
+        # Preprocess: Stack the images into one (N, 3, H, W) array
+        image_arrays = np.concatenate([preprocess(img_bytes) for img_bytes, _, _, _ in batch])
+        t_pre = (time.time() - t1) * 1000
+        t2 = time.time()
+        # Inference
+        results = yolo_ov_core(image_arrays)
+        t_inf = (time.time() - t2) * 1000
+        if args['VERBOSE']:
+            hot_log("Batch handled", size=len(batch), pre_ms=t_pre, inf_ms=t_inf)
+
+        idle_timer = time.time()  # Do not count pushing results to idle timer
+        # Every image gets a record with the timings of its whole batch
+        if args['validate_results']:
+            for i, (_, msg_key, time_sent, time_intended) in enumerate(batch):
+                kafka_producer.push_msg(args['kafka_output'], custom_serializer({
+                    'timestamps': {
+                        'idle': t_idle,  # Time spent waiting for next batch
+                        'pre': t_pre,
+                        'inf': t_inf,
+                        'post': 0.0, # No postprocessing
+                        'queue': time_received - time_sent,
+                        'queue_corrected': time_received - time_intended,
+                        'start_time': time_sent,
+                        'intended_time': time_intended,
+                        'end_time': time_received
+                    },
+                    'id': msg_key.decode('utf-8'),
+                    'errors': errors,
+                    'source': ip_addr,
+                    'model': args['model'],
+                    'dimensions': results[0][i:i + 1].shape,
+                    'batch_size': len(batch),
+                }))
+        print("Errors:", errors)
+
     # Create & start worker threads
     try:
-        kafka_consumer.poll_next(1, thread_lock, process_event)
+        if args['batch_size'] > 1:
+            kafka_consumer.poll_batch(1, thread_lock, process_batch, batch_size=args['batch_size'], intended=True)
+        else:
+            kafka_consumer.poll_next(1, thread_lock, process_event, intended=True)
     except KeyboardInterrupt:
         thread_lock.kill()
         log('Worker manually killed.', True)
     except Exception as e:
         log(f'Exception: {e}', True)
         print(e)
+    finally:
+        kafka_producer.close()  # Deliver the queued results before exiting
+        kafka_consumer.close()  # Commit the processed offsets before leaving the group
 
 
 run()
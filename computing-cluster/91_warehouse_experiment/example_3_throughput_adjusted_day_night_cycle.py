@@ -16,6 +16,7 @@ import subprocess
 import time
 import yaml
 import create_deployment_yaml
+from warehouse.utils.capacity import CAPACITY_FILE, load_capacity_table
 from warehouse import burst_feeder, day_night_feeder
 from warehouse import kafka_init
 from warehouse.msg_to_csv import MessageToCSVProcessor
@@ -33,7 +34,7 @@ parser.add_argument("--smoketest", action="store_true", help="Run a short smoket
 args = parser.parse_args()  # Parse arguments
 
 kafka_wait_timeout = 600
-idle_before_start_1 = 120 # (seconds) Wait for application instances to receive their kafka assignments - otherwise might get stuck
+idle_before_start_1 = 120 # (seconds) Max wait for application instances to receive their kafka assignments - otherwise might get stuck
 idle_before_start_2 = 0.5 * 60  # (seconds) Additional wait after Kafka is verified working
 idle_after_end = 0.5 * 60  # (seconds) Catch the tail of the experiment metrics
 total_runtime_hours = 24
@@ -104,6 +105,8 @@ run_4_throughputs = {  # [resolution][num_workers] = max_throughput
         7: 78.4
     }
 }
+# Maximum sustainable rates measured by warehouse/capacity_search.py override the hand-copied values above
+run_4_throughputs = load_capacity_table(CAPACITY_FILE, 'warehouse', fallback=run_4_throughputs)
 
 def get_experiment_throughput_mbps(resolution, num_workers):
     """
@@ -173,6 +176,28 @@ def scale_and_wait_for_replicas(num_replicas, application_name):
     log(f"Application {application_name} has now {num_replicas} replicas running")
 
 
+def wait_for_ready(num_replicas, application_name, timeout_s):
+    # Pods turn ready once their consumer has received its kafka partitions (readinessProbe in the templates)
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        result = subprocess.run(
+            ["kubectl", "get", "pods", "-n", f"{namespace}", "-l", f"run={application_name}", "-o", "yaml"],
+            capture_output=True,
+            text=True
+        )
+        pods = yaml.safe_load(result.stdout)
+        ready_pods = [pod for pod in pods["items"] if any(
+            condition["type"] == "Ready" and condition["status"] == "True"
+            for condition in pod["status"].get("conditions", []))]
+        if len(ready_pods) >= num_replicas:
+            log(f"All {num_replicas} {application_name} pods have received their kafka assignments")
+            return True
+        log(f"Waiting for {len(ready_pods)}/{num_replicas} {application_name} pods to receive their kafka assignments...")
+        time.sleep(5)
+    log(f"Timed out waiting for {application_name} pods to become ready, starting anyway")
+    return False
+
+
 def wait_for_terminate(num_replicas, application_name):
     while True:
         result = subprocess.run(
@@ -239,8 +264,11 @@ for run in runs:
         # Making sure the topic is initialized with correct amount of partitions
         kafka_init.init_kafka(kafka_servers=kafka_servers, num_partitions=num_partitions, topic_name=topic, log_func=log)
         kafka_init.test_topic(kafka_servers=kafka_servers, topic_name=topic, log_func=log)
-    kafka_init.recreate_topic(kafka_servers=kafka_servers, num_partitions=workers, topic_name="grid_worker_input", log_func=log)
-    kafka_init.test_topic(kafka_servers=kafka_servers, topic_name="grid_worker_input", log_func=log)
+    if kafka_init.count_partitions(kafka_servers, "grid_worker_input") != workers:
+        kafka_init.recreate_topic(kafka_servers=kafka_servers, num_partitions=workers, topic_name="grid_worker_input", log_func=log)
+        kafka_init.test_topic(kafka_servers=kafka_servers, topic_name="grid_worker_input", log_func=log)
+    # Empty the topics (including the test messages) and move the consumer group offsets to the end
+    kafka_init.reset_topics(kafka_servers=kafka_servers, topic_names=["grid_worker_input", *topics], log_func=log)
 
     # Update yaml and deploy
     log("")
@@ -264,10 +292,11 @@ for run in runs:
     scale_and_wait_for_replicas(application_name=master_name, num_replicas=1)
 
     log("Application deployed.")
-    log(f"Waiting for {idle_before_start_1} seconds so applications have a chance to set up completely")
+    log(f"Waiting up to {idle_before_start_1} seconds for the applications to receive their kafka assignments")
     # Maybe related Kafka issue: https://github.com/akka/alpakka-kafka/issues/382
     # Our problem also seems to happen like: A) consumer pulls message B) other consumer connects C) Kafka reassigns -> message lost
-    time.sleep(idle_before_start_1)  # Wait for initialization (How to know how long to wait?)
+    wait_for_ready(workers, worker_name, timeout_s=idle_before_start_1)
+    wait_for_ready(1, master_name, timeout_s=idle_before_start_1)
     # Check that the applications are ready
     log("")
     log("Sending some data to check that at least one pod can process data.")
@@ -359,15 +388,6 @@ for run in runs:
 
     log(f"Zipping done\n")
 
-    log(f"Waiting for any delayed messages before the next experiment...")
-    master_validator = ValidationThread(kafka_servers=kafka_servers, kafka_topic="grid_master_validate")
-    master_validator.start()
-    leftover_msgs = master_validator.wait_for_msg_ids(msg_ids, timeout_s=10)
-    worker_validator = ValidationThread(kafka_servers=kafka_servers, kafka_topic="grid_worker_validate")
-    worker_validator.start()
-    leftover_msgs += worker_validator.wait_for_msg_ids(msg_ids, timeout_s=10)
-    log(f"Received {leftover_msgs} delayed messages.")
-
     log(f"Waiting for left-over pods to fully terminate...")
     wait_for_terminate(0, master_name)
     wait_for_terminate(0, worker_name)
@@ -0,0 +1,225 @@
+"""
+Synthetic lidar dataset generator.
+
+Writes HDF5 files in the same layout as the recorded datasets (see download_datasets.py), so resolution and
+fleet-size sweeps do not need external data:
+- sensors/robot_<n>: (frames, points, 3) float32 points in the local frame of the lidar, in meters
+- state/id: (frames, robots) actor IDs (the order changes between frames, like in the recordings)
+- state/location: (frames, robots, 3) float32 lidar locations in meters
+- state/rotation: (frames, robots, 3) float32 (pitch, yaw, roll) in degrees
+- metadata: JSON with the actor ID of each sensor and the generator parameters
+
+The warehouse is a box with walls, a floor, a ceiling and randomly placed obstacles (shelves, pallets).
+Robots drive along random waypoints in free space and every lidar ray is cast against all boxes at once.
+
+python3 generate_datasets.py --robots 1 2 4 6 8 16 --points 1000 5000 10000
+"""
+
+import argparse
+import json
+import os
+
+import h5py
+import numpy as np
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--robots", type=int, nargs="+", default=[1, 2, 4, 6], help="Robot counts to generate.")
+parser.add_argument("--points", type=int, nargs="+", default=[1000, 5000, 10000], help="Points per frame.")
+parser.add_argument("--frames", type=int, default=1000, help="Frames per dataset. Default: 1000.")
+parser.add_argument("--width", type=float, default=60.0, help="Warehouse width in meters. Default: 60.")
+parser.add_argument("--depth", type=float, default=40.0, help="Warehouse depth in meters. Default: 40.")
+parser.add_argument("--density", type=float, default=0.15,
+                    help="Fraction of the floor covered by obstacles. Default: 0.15.")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output_dir", type=str, default="datasets")
+
+LIDAR_HEIGHT = 0.8  # meters
+CEILING_HEIGHT = 6.0  # meters
+VERTICAL_FOV = 30.0  # degrees, centered on the horizon
+ROBOT_SPEED = 1.5  # meters per second
+FPS = 10
+RANGE_NOISE = 0.01  # meters (standard deviation)
+CLEARANCE = 1.0  # Minimum distance between obstacles and robot paths, in meters
+N_SECTORS = 16  # Rays are only tested against the boxes inside their azimuth sector
+
+
+def generate_trajectories(rng, n_robots, n_frames, width, depth):
+    """
+    Drive each robot through random waypoints at a constant speed.
+
+    Returns:
+        Tuple (locations, yaws) of shapes (frames, robots, 3) and (frames, robots), yaw in degrees.
+    """
+    step = ROBOT_SPEED / FPS
+    locations = np.empty((n_frames, n_robots, 3))
+    yaws = np.empty((n_frames, n_robots))
+    for robot in range(n_robots):
+        # Enough waypoints to cover the whole run, with at least 5 meters between consecutive ones
+        n_waypoints = max(4, int(n_frames * step / 5) + 4)
+        waypoints = rng.uniform([CLEARANCE, CLEARANCE], [width - CLEARANCE, depth - CLEARANCE], (n_waypoints, 2))
+        segment_lengths = np.linalg.norm(np.diff(waypoints, axis=0), axis=1)
+        distance = np.concatenate([[0], np.cumsum(segment_lengths)])
+        travelled = np.minimum(np.arange(n_frames) * step, distance[-1])
+        locations[:, robot, 0] = np.interp(travelled, distance, waypoints[:, 0])
+        locations[:, robot, 1] = np.interp(travelled, distance, waypoints[:, 1])
+        locations[:, robot, 2] = LIDAR_HEIGHT
+
+        segment = np.clip(np.searchsorted(distance, travelled, side='right') - 1, 0, len(segment_lengths) - 1)
+        heading = np.diff(waypoints, axis=0)[segment]
+        # The worker adds +90 degrees to the yaw (see local_to_world_space), undo it here
+        yaws[:, robot] = np.rad2deg(np.arctan2(heading[:, 1], heading[:, 0])) - 90
+    return locations, yaws
+
+
+def generate_boxes(rng, width, depth, density, paths):
+    """
+    Return (B, 2, 3) min/max corners of the warehouse shell and the obstacles.
+
+    Obstacles are rejected if they come closer than CLEARANCE to any robot path.
+    """
+    shell = np.array([
+        [[-1, -1, -1], [width + 1, depth + 1, 0]],  # Floor
+        [[-1, -1, CEILING_HEIGHT], [width + 1, depth + 1, CEILING_HEIGHT + 1]],  # Ceiling
+        [[-1, -1, 0], [0, depth + 1, CEILING_HEIGHT]],  # Walls
+        [[width, -1, 0], [width + 1, depth + 1, CEILING_HEIGHT]],
+        [[-1, -1, 0], [width + 1, 0, CEILING_HEIGHT]],
+        [[-1, depth, 0], [width + 1, depth + 1, CEILING_HEIGHT]],
+    ], dtype=np.float64)
+
+    target_area = density * width * depth
+    n_candidates = max(1, int(target_area / 2.0) * 4)  # Mean footprint ~2 m^2, oversample for rejections
+    sizes = rng.uniform([0.8, 0.8, 0.5], [3.0, 2.0, 3.5], (n_candidates, 3))
+    corners = rng.uniform([0, 0], [width, depth], (n_candidates, 2))
+    lo = np.column_stack([corners, np.zeros(n_candidates)])
+    hi = lo + sizes
+
+    # Distance from every path point to every candidate footprint
+    path_xy = paths.reshape(-1, 3)[::5, :2]
+    dx = np.maximum(0, np.maximum(lo[None, :, 0] - path_xy[:, None, 0], path_xy[:, None, 0] - hi[None, :, 0]))
+    dy = np.maximum(0, np.maximum(lo[None, :, 1] - path_xy[:, None, 1], path_xy[:, None, 1] - hi[None, :, 1]))
+    free = (np.hypot(dx, dy) > CLEARANCE).all(axis=0)
+
+    footprint = sizes[:, 0] * sizes[:, 1] * free
+    keep = free & (np.cumsum(footprint) <= target_area)
+    obstacles = np.stack([lo[keep], hi[keep]], axis=1)
+    return np.concatenate([shell, obstacles])
+
+
+def cast_rays(origin, directions, boxes):
+    """
+    Vectorized slab test of all rays against all boxes.
+
+    Returns:
+        (N,) distance to the nearest hit of each ray.
+    """
+    # Avoid zero components, so the slab test needs no special cases for axis-parallel rays
+    directions = np.where(np.abs(directions) < 1e-9, 1e-9, directions).astype(np.float32)
+    inverse = 1.0 / directions
+    lo = (boxes[:, 0, :] - origin).astype(np.float32)
+    hi = (boxes[:, 1, :] - origin).astype(np.float32)
+    t1 = lo[None, :, :] * inverse[:, None, :]
+    t2 = hi[None, :, :] * inverse[:, None, :]
+    t_near = np.minimum(t1, t2).max(axis=2)
+    t_far = np.maximum(t1, t2).min(axis=2)
+    hit = (t_near <= t_far) & (t_far > 0)
+    distance = np.where(hit, np.where(t_near > 0, t_near, t_far), np.inf)
+    return distance.min(axis=1).astype(np.float64)
+
+
+def sector_boxes(origin, boxes, n_sectors=N_SECTORS):
+    """
+    Return, for each azimuth sector around the origin, the indices of the boxes that overlap it.
+
+    Boxes that surround the origin (floor, ceiling) or span more than half a turn are kept in every sector.
+    """
+    corners = np.stack([boxes[:, [0, 0, 1, 1], 0], boxes[:, [0, 1, 0, 1], 1]], axis=2) - origin[:2]
+    angles = np.arctan2(corners[..., 1], corners[..., 0])
+    # Rotate the angles so that the box does not straddle the -pi/pi seam
+    center = np.arctan2(corners[..., 1].mean(axis=1), corners[..., 0].mean(axis=1))
+    relative = (angles - center[:, None] + np.pi) % (2 * np.pi) - np.pi
+    start, end = center + relative.min(axis=1), center + relative.max(axis=1)
+    inside = np.all((boxes[:, 0, :2] <= origin[:2]) & (origin[:2] <= boxes[:, 1, :2]), axis=1)
+    everywhere = inside | (end - start >= np.pi)
+
+    sector_width = 2 * np.pi / n_sectors
+    sector_start = -np.pi + np.arange(n_sectors) * sector_width
+    # Overlap test on the circle: shift every sector into the box's angular frame
+    offset = (sector_start[:, None] - start[None, :]) % (2 * np.pi)
+    overlaps = (offset <= end - start) | (offset >= 2 * np.pi - sector_width)
+    return [np.flatnonzero(overlaps[sector] | everywhere) for sector in range(n_sectors)]
+
+
+def generate_dataset(path, n_robots, points_per_frame, n_frames=1000, width=60.0, depth=40.0, density=0.15, seed=0):
+    rng = np.random.default_rng(seed)
+    locations, yaws = generate_trajectories(rng, n_robots, n_frames, width, depth)
+    boxes = generate_boxes(rng, width, depth, density, locations)
+    actor_ids = 100 + np.arange(n_robots)
+    sensors = [f"robot_{n + 1}" for n in range(n_robots)]
+
+    with h5py.File(path, "w") as dataset:
+        sensor_data = {
+            sensor: dataset.create_dataset(f"sensors/{sensor}", (n_frames, points_per_frame, 3), dtype=np.float32,
+                                           chunks=(1, points_per_frame, 3))
+            for sensor in sensors
+        }
+        ids = np.empty((n_frames, n_robots), dtype=np.int32)
+        state_location = np.empty((n_frames, n_robots, 3), dtype=np.float32)
+        state_rotation = np.zeros((n_frames, n_robots, 3), dtype=np.float32)
+
+        for frame in range(n_frames):
+            order = rng.permutation(n_robots)
+            ids[frame] = actor_ids[order]
+            state_location[frame] = locations[frame, order]
+            state_rotation[frame, :, 1] = yaws[frame, order]
+
+            for robot, sensor in enumerate(sensors):
+                azimuth = rng.uniform(-np.pi, np.pi, points_per_frame)
+                elevation = np.deg2rad(rng.uniform(-VERTICAL_FOV / 2, VERTICAL_FOV / 2, points_per_frame))
+                directions = np.column_stack([
+                    np.cos(elevation) * np.cos(azimuth),
+                    np.cos(elevation) * np.sin(azimuth),
+                    np.sin(elevation),
+                ])
+                origin = locations[frame, robot]
+                sector = np.minimum(((azimuth + np.pi) / (2 * np.pi) * N_SECTORS).astype(int), N_SECTORS - 1)
+                distance = np.empty(points_per_frame)
+                for index, box_indices in enumerate(sector_boxes(origin, boxes)):
+                    rays = sector == index
+                    distance[rays] = cast_rays(origin, directions[rays], boxes[box_indices])
+                distance += rng.normal(0, RANGE_NOISE, points_per_frame)
+                world_offsets = directions * distance[:, None]
+
+                # Inverse of local_to_world_space (rotation by yaw + 90 degrees)
+                yaw = np.deg2rad(yaws[frame, robot] + 90)
+                rotation = np.array([[np.cos(yaw), np.sin(yaw), 0],
+                                     [-np.sin(yaw), np.cos(yaw), 0],
+                                     [0, 0, 1]])
+                sensor_data[sensor][frame] = (world_offsets @ rotation.T).astype(np.float32)
+
+        dataset.create_dataset("state/id", data=ids)
+        dataset.create_dataset("state/location", data=state_location)
+        dataset.create_dataset("state/rotation", data=state_rotation)
+        metadata = {sensor: {"id": int(actor_id)} for sensor, actor_id in zip(sensors, actor_ids)}
+        metadata.update({
+            "n_frames": n_frames,
+            "synthetic": {
+                "robots": n_robots, "points_per_frame": points_per_frame, "width": width, "depth": depth,
+                "obstacle_density": density, "obstacles": len(boxes) - 6, "seed": seed,
+            },
+        })
+        dataset.create_dataset("metadata", data=json.dumps(metadata))
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    os.makedirs(py_args.output_dir, exist_ok=True)
+
+    for robots in py_args.robots:
+        for points in py_args.points:
+            file_name = os.path.join(py_args.output_dir, f"synthetic_robots-{robots}_points-{points}.hdf5")
+            if os.path.exists(file_name):
+                print(f"File {file_name} already exists. Skipping.")
+                continue
+            print(f"Generating {file_name}...")
+            generate_dataset(file_name, robots, points, n_frames=py_args.frames, width=py_args.width,
+                             depth=py_args.depth, density=py_args.density, seed=py_args.seed)
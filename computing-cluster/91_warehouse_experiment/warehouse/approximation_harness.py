@@ -0,0 +1,182 @@
+"""
+Accuracy-versus-cost harness for grid approximations.
+
+Runs a dataset through the full-fidelity worker+master pipeline and then through each speed-oriented variant.
+For every variant, reports the per-cell agreement and the IoU of occupied cells against the full pipeline,
+next to the worker time, input bytes and update bytes per frame and the master merge throughput.
+
+Frames are replayed on a simulated 10 Hz clock, so the decay of the timestamp grid does not depend on how fast
+each variant runs.
+
+python3 approximation_harness.py --dataset ../datasets/robots-4_points-5000.hdf5 --frames 200
+"""
+
+import argparse
+import csv
+import time
+import zlib
+
+import numpy as np
+
+from compare_grid_models import classify, compare_maps, merge_updates
+from utils.grid import OccupancyGrid
+from utils.grid_cell import CellState
+from utils.lidar_dataset_reader import load_to_memory
+from utils.log_odds_grid import LogOddsGrid
+from utils.worker_functions import local_to_world_space, process_point_cloud, process_point_cloud_log_odds, \
+    process_points, to_grid_space
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, default="../datasets/robots-4_points-5000.hdf5")
+parser.add_argument("--frames", type=int, default=200, help="Frames per sensor. Default: 200.")
+parser.add_argument("--output", type=str, default=None, help="Optional CSV file for the results.")
+
+FPS = 10  # Replay rate of the simulated clock
+QUANTIZATION_STEP_M = 0.01  # Quantized clouds are sent as int16 centimeters
+ZLIB_LEVEL = 1  # Fastest compression, the updates are sent in real time
+MIN_HEIGHT_MM, MAX_HEIGHT_MM = 20, 2000  # Same height filter as process_points
+
+
+def full(frame, now):
+    """ The production pipeline: every point, every ray. """
+    world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+    return frame.data.nbytes, process_point_cloud(world_space_lidar, frame.position, now)
+
+
+def stride_downsample(step):
+    """ Keep every step-th point of the cloud, as if the lidar had a lower resolution. """
+
+    def worker(frame, now):
+        data = frame.data[::step]
+        world_space_lidar = local_to_world_space(data, frame.position, frame.rotation)
+        return data.nbytes, process_point_cloud(world_space_lidar, frame.position, now)
+
+    return worker
+
+
+def cell_downsample(frame, now):
+    """ Keep one point per grid cell. Points in the same cell produce the same hit and nearly the same ray. """
+    world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+    in_range = (world_space_lidar[:, 2] >= MIN_HEIGHT_MM) & (world_space_lidar[:, 2] <= MAX_HEIGHT_MM)
+    cells = np.floor(world_space_lidar[in_range, :2] / OccupancyGrid.GRID_CELL_SIZE_MM).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    # Selecting the points needs the world coordinates, so the feeder still sends the full cloud
+    return frame.data.nbytes, process_point_cloud(world_space_lidar[in_range][first], frame.position, now)
+
+
+def quantized(frame, now):
+    """ The feeder sends int16 centimeters instead of float32 meters. """
+    data = np.round(frame.data / QUANTIZATION_STEP_M).astype(np.int16)
+    world_space_lidar = local_to_world_space(data.astype(np.float32) * QUANTIZATION_STEP_M,
+                                             frame.position, frame.rotation)
+    return data.nbytes, process_point_cloud(world_space_lidar, frame.position, now)
+
+
+def sparse_rays(step):
+    """ Mark every hit, but only trace every step-th ray for the empty cells. """
+
+    def worker(frame, now):
+        world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+        in_range = (world_space_lidar[:, 2] >= MIN_HEIGHT_MM) & (world_space_lidar[:, 2] <= MAX_HEIGHT_MM)
+        points = world_space_lidar[in_range]
+
+        update_grid = OccupancyGrid()
+        vehicle_cell = (
+            to_grid_space(frame.position[0], OccupancyGrid.GRID_CELL_SIZE_MM),
+            to_grid_space(frame.position[1], OccupancyGrid.GRID_CELL_SIZE_MM),
+        )
+        update_grid.get_cell(*vehicle_cell).make_observation(CellState.VEHICLE, now)
+
+        # Same order as full: every point marks its hit, then the empty cells of its ray (if it is traced). The
+        # first observation of a cell wins a tie, so a cell that is both hit and traversed ends up as in full
+        traced = process_points(frame.position * 1000, points[::step], OccupancyGrid.GRID_CELL_SIZE_MM)
+        hit_cells = np.floor(points[:, :2] / OccupancyGrid.GRID_CELL_SIZE_MM).astype(np.int64)
+        for index, cell in enumerate(hit_cells.tolist()):
+            update_grid.get_cell(*cell).make_observation(CellState.OCCUPIED, now)
+            if index % step == 0:
+                for empty_cell in traced[index // step][1]:
+                    update_grid.get_cell(*empty_cell).make_observation(CellState.EMPTY, now)
+        return frame.data.nbytes, update_grid
+
+    return worker
+
+
+def log_odds_rays(frame, now):
+    """ Flat-array ray casting with per-frame pre-aggregation into the log-odds grid. """
+    world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+    return frame.data.nbytes, process_point_cloud_log_odds(world_space_lidar, frame.position)
+
+
+# name: (worker function, master grid class, compress updates)
+VARIANTS = {
+    'full': (full, OccupancyGrid, False),
+    'downsample_2': (stride_downsample(2), OccupancyGrid, False),
+    'downsample_4': (stride_downsample(4), OccupancyGrid, False),
+    'cell_downsample': (cell_downsample, OccupancyGrid, False),
+    'quantized_1cm': (quantized, OccupancyGrid, False),
+    'zlib_updates': (full, OccupancyGrid, True),
+    'sparse_rays_4': (sparse_rays(4), OccupancyGrid, False),
+    'log_odds_rays': (log_odds_rays, LogOddsGrid, False),
+}
+
+
+def run_variant(all_sensor_data, frames_per_sensor, worker, grid_class, compress):
+    """ Run the worker and master side of one variant. Frames of all sensors are interleaved, like in a live feed. """
+    updates, input_bytes = [], []
+    worker_seconds = 0.0
+    n_frames = min(frames_per_sensor, min(len(sensor_frames) for sensor_frames in all_sensor_data))
+    for index in range(n_frames):
+        now = index / FPS
+        for sensor_frames in all_sensor_data:
+            t1 = time.perf_counter()
+            n_bytes, update_grid = worker(sensor_frames[index], now)
+            update = update_grid.to_bytes()
+            if compress:
+                update = zlib.compress(update, ZLIB_LEVEL)
+            worker_seconds += time.perf_counter() - t1
+            updates.append(update)
+            input_bytes.append(n_bytes)
+
+    t1 = time.perf_counter()
+    raw_updates = [zlib.decompress(update) for update in updates] if compress else updates
+    decompress_seconds = time.perf_counter() - t1
+    grid, merge_seconds, _, _ = merge_updates(grid_class, raw_updates)
+    return {
+        'grid': grid,
+        'end_time': (n_frames - 1) / FPS,
+        'worker_ms': worker_seconds / len(updates) * 1000,
+        'input_bytes': np.mean(input_bytes),
+        'update_bytes': np.mean([len(update) for update in updates]),
+        'merges_per_second': len(updates) / (merge_seconds + decompress_seconds),
+    }
+
+
+def run(dataset_path, frames_per_sensor=200, output_path=None):
+    all_sensor_data = load_to_memory(dataset_path)
+    results = {}
+    for worker, _, _ in VARIANTS.values():
+        worker(all_sensor_data[0][0], 0.0)  # Compile the numba functions before timing anything
+    for name, (worker, grid_class, compress) in VARIANTS.items():
+        results[name] = run_variant(all_sensor_data, frames_per_sensor, worker, grid_class, compress)
+
+    reference = classify(results['full']['grid'], results['full']['end_time'])
+    print(f"{'variant':>16} {'agreement':>10} {'IoU':>6} {'ms/frame':>9} {'in B/frame':>11} "
+          f"{'upd B/frame':>12} {'merges/s':>9}")
+    for name, result in results.items():
+        result['agreement'], result['iou'] = compare_maps(reference, classify(result['grid'], result['end_time']))
+        print(f"{name:>16} {result['agreement'] * 100:>9.2f}% {result['iou']:>6.3f} {result['worker_ms']:>9.2f} "
+              f"{result['input_bytes']:>11.0f} {result['update_bytes']:>12.0f} {result['merges_per_second']:>9.1f}")
+
+    if output_path is not None:
+        columns = ['agreement', 'iou', 'worker_ms', 'input_bytes', 'update_bytes', 'merges_per_second']
+        with open(output_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['variant'] + columns)
+            for name, result in results.items():
+                writer.writerow([name] + [result[column] for column in columns])
+    return results
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    run(py_args.dataset, py_args.frames, py_args.output)
@@ -4,9 +4,11 @@ import math
 import time
 from threading import Thread
 
-from .utils.kafka_utils import create_producer
-from .utils.lidar_dataset_reader import load_to_memory
+from .utils.claim_check import create_local_blob_store
+from .utils.frame_buffer import first_frame, load_frame_buffer
 from .utils.misc import resource_exists, log, create_lock
+from .utils.rate_scheduler import create_rate_scheduler
+from .utils.transport import create_kafka_transport
 
 """
 Burst feeder: Send specified number of sensor data as fast as possible.
@@ -35,7 +37,9 @@ parser.add_argument(
 def run(num_items=100, num_threads=4,
         # kafka_servers="130.233.193.117:10001",
         kafka_servers="localhost:10001",
-        dataset_path="../robots-4/points-per-frame-5000.hdf5"):
+        dataset_path="../robots-4/points-per-frame-5000.hdf5",
+        blob_dir=None,
+        transport=None):
     msg_count = itertools.count()
 
     # Ensure the HDF5 dataset exists
@@ -49,9 +53,16 @@ def run(num_items=100, num_threads=4,
     threads = []
     kafka_producers = []
 
+    # Payloads above the claim-check threshold are written to blob_dir, only their references go through Kafka
+    blob_store = create_local_blob_store(blob_dir) if blob_dir else None
+
+    # Kafka unless another transport (e.g. shared memory for a broker-free benchmark) is given
+    if transport is None:
+        transport = create_kafka_transport(kafka_servers)
+
     # Create Kafka producers for each thread
     for _ in range(num_threads):
-        kafka_producer = create_producer(kafka_servers=kafka_servers)
+        kafka_producer = transport.producer(blob_store=blob_store)
         kafka_producers.append(kafka_producer)
 
     # Verify Kafka connections
@@ -60,40 +71,39 @@ def run(num_items=100, num_threads=4,
             log(f'KAFKA PRODUCER NUMBER {i} NOT CONNECTED! ABORTING...')
             return next(msg_count)
 
-    # Load the dataset
-    all_sensor_data = load_to_memory(dataset_path)
-    num_sensors = len(all_sensor_data)
-    example_frame = all_sensor_data[0][0]
+    # Load the dataset. A packed dataset (utils/packed_dataset.py) is memory-mapped, an HDF5 dataset is serialized once
+    frame_buffer = load_frame_buffer(dataset_path, num_threads)
+    num_sensors = frame_buffer.n_sensors
+    example_frame = first_frame(frame_buffer)
     elements_per_frame = example_frame.data.size
     bytes_per_frame = example_frame.data.nbytes
 
     # Thread work loop
     def thread_work(nth_thread, alive_signal, items_to_send):
         sensor_index = nth_thread % num_sensors
-        sensor_frames = all_sensor_data[sensor_index]
+        sensor_frames = frame_buffer.sensor(sensor_index)
         index = 0
-        time_until_start = experiment_start - time.time()
-        log(f'THREAD {nth_thread} WILL SEND {items_to_send} ITEMS FROM SENSOR {sensor_index} AFTER {time_until_start} SECONDS')
+        log(f'THREAD {nth_thread} WILL SEND {items_to_send} ITEMS FROM SENSOR {sensor_index}')
 
-        while time.time() < experiment_start:
-            pass
+        # Wait for the other threads, then start together
+        pacer = scheduler.join(nth_thread)
 
         for item in range(items_to_send):
-            if not alive_signal.is_active():
+            if not pacer.wait(alive_signal):
                 log(f'THREAD {nth_thread} WAS KILLED AT {time.time()}')
                 return
-            frame = sensor_frames[index % len(sensor_frames)]
-            data_as_bytes = frame.to_bytes()
+            data_as_bytes = sensor_frames[index % len(sensor_frames)]
             item_id = next(msg_count)
             item_id_encoded = str(item_id).encode('utf-8')
             kafka_producers[nth_thread - 1].push_msg('grid_worker_input', data_as_bytes, key=item_id_encoded)
             index += 1
 
         ended = time.time()
-        log(f'THREAD {nth_thread} HAS FINISHED AT {ended} -- (took {ended - experiment_start}) s')
+        log(f'THREAD {nth_thread} HAS FINISHED AT {ended} -- (took {ended - scheduler.start}) s')
 
     try:
-        experiment_start = time.time() + 3
+        # No pacing, the scheduler only synchronizes the start and records the send times
+        scheduler = create_rate_scheduler(num_threads)
 
         log(f'CREATING PRODUCER THREAD POOL ({num_threads})')
 
@@ -106,11 +116,12 @@ def run(num_items=100, num_threads=4,
         # Wait for all threads to finish
         [[thread.join() for thread in threads]]
         end_time = time.time()
-        duration = end_time - experiment_start
+        duration = end_time - scheduler.start
         bps = (bytes_per_frame * num_items) / duration
         mbps = bps / (1024 * 1024)  # Conversion from bytes to megabytes
         log(f'EXPERIMENT DONE')
         log(f'SENT {num_items} ITEMS IN {duration} SECONDS ({mbps} MB/s)')
+        log(f'SEND SCHEDULE: {scheduler.summary()}')
 
     except KeyboardInterrupt:
         alive_lock.kill()
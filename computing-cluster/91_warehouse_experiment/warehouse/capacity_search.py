@@ -0,0 +1,220 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from threading import Thread
+
+from confluent_kafka.admin import AdminClient
+
+from . import local_pipeline, process_feeder
+from .kafka_init import consumer_lag
+from .utils.capacity import CAPACITY_FILE, evaluate_trial, search_capacity, update_capacity_table
+from .utils.misc import create_lock, log
+from .utils.transport import create_kafka_transport
+
+"""
+Capacity search: Find the highest rate a deployment of the workers and the master sustains, instead of copying it
+from the results of a past saturation run.
+
+Every trial sends at one rate with the process feeder and watches the deployment while it runs: the consumer lag of
+the input topics (sampled from the committed offsets) and the feeder-to-master latency of every frame (joined from the
+validation records). The rate is doubled until a trial fails, then bisected (utils/capacity.py). The maximum
+sustainable rate is stored per points per frame and workers in capacity.json, where the experiment runners read it.
+"""
+
+# python3 -m warehouse.capacity_search --workers 4 --points 5000 --slo_ms 1000
+# python3 -m warehouse.capacity_search --workers 2 --points 1000 --local --trial_seconds 10
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--workers", type=int, required=True, help="Workers of the deployment, a key of the table.")
+parser.add_argument("--points", type=int, required=True, help="Points per frame of the dataset, a key of the table.")
+parser.add_argument("--dataset", type=str, default=None,
+                    help="Default: datasets/robots-<workers>_points-<points>.hdf5, or the 6 robot dataset.")
+parser.add_argument("--kafka_servers", type=str, default="localhost:10001")
+parser.add_argument("--local", action="store_true",
+                    help="Measure --workers local workers and a master over shared memory instead of a deployment.")
+parser.add_argument("--grid_model", type=str, default="timestamp", choices=["timestamp", "log_odds", "voxel"],
+                    help="Grid model of the local workers. Default: timestamp.")
+parser.add_argument("--slo_ms", type=float, default=1000, help="p99 feeder-to-master latency limit. Default: 1000.")
+parser.add_argument("--trial_seconds", type=int, default=30, help="Seconds per trial. Default: 30.")
+parser.add_argument("--warmup", type=float, default=0.2, help="Skipped fraction of every trial. Default: 0.2.")
+parser.add_argument("--tolerance", type=float, default=0.05,
+                    help="Allowed rate shortfall and lag growth, as a fraction of the rate. Default: 0.05.")
+parser.add_argument("--start_rate", type=float, default=10, help="Rate of the first trial (frames/s). Default: 10.")
+parser.add_argument("--max_rate", type=float, default=5000, help="Highest rate to try (frames/s). Default: 5000.")
+parser.add_argument("--precision", type=float, default=0.05,
+                    help="Stop bisecting when the bracket is narrower than this fraction. Default: 0.05.")
+parser.add_argument("--max_trials", type=int, default=16, help="Default: 16.")
+parser.add_argument("--processes", type=int, default=4, help="Feeder processes. Default: 4.")
+parser.add_argument("--drain_seconds", type=float, default=60,
+                    help="Seconds to wait for the last frames of a trial before the next one. Default: 60.")
+parser.add_argument("--output", type=str, default=CAPACITY_FILE, help=f"Capacity table. Default: {CAPACITY_FILE}.")
+
+# The message ids of every trial start at a multiple of this, so the records of the trials do not mix
+MSG_IDS_PER_TRIAL = 10 ** 9
+
+INPUT_TOPICS = ['grid_worker_input', 'grid_master_input']
+LAG_INTERVAL = 1.0
+
+
+class create_qos_collector:
+    """
+    Send and completion times of every frame: the send time is the intended_time of the worker's validation record
+    (when the feeder's schedule had the frame due, so a lagging feeder does not hide its stalls from the SLO), the
+    completion time is the Kafka timestamp of the master's record.
+    """
+
+    def __init__(self, transport, timeout=60):
+        self.sent = {}
+        self.done = {}
+        self.thread_lock = create_lock()
+
+        # Every search reads the validation topics in its own consumer groups, next to the runners' collectors
+        assigned = [threading.Event(), threading.Event()]
+        self.threads = []
+        for topic, on_record, event in zip(['grid_worker_validate', 'grid_master_validate'],
+                                           [self.on_worker_record, self.on_master_record], assigned):
+            consumer = transport.consumer(topic, group_id=f'{topic}.capacity.{uuid.uuid4().hex}',
+                                          on_assigned=lambda *_, event=event: event.set())
+            thread = Thread(target=consumer.poll_next, args=(topic, self.thread_lock, on_record), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        for event in assigned:
+            if not event.wait(timeout):
+                log(f'QoS COLLECTOR NOT ASSIGNED AFTER {timeout} SECONDS, THE FIRST RECORDS MAY BE MISSED')
+
+    def on_worker_record(self, data_bytes, msg_key, time_received, time_sent):
+        record = json.loads(bytes(data_bytes).decode('utf-8'))
+        timestamps = record['timestamps']
+        self.sent[int(record['id'])] = timestamps.get('intended_time', timestamps['start_time']) / 1000
+
+    def on_master_record(self, data_bytes, msg_key, time_received, time_sent):
+        record = json.loads(bytes(data_bytes).decode('utf-8'))
+        self.done[int(record['id'])] = time_sent / 1000
+
+    def n_done(self, first_id):
+        """ Frames of the trial starting at message id first_id that reached the master. """
+        return sum(1 for msg_id in list(self.done) if first_id <= msg_id < first_id + MSG_IDS_PER_TRIAL)
+
+    def trial_times(self, first_id):
+        """ Send and completion times (NaN if not completed) of the frames of the trial starting at first_id. """
+        sent = {msg_id: t for msg_id, t in list(self.sent.items()) if first_id <= msg_id < first_id + MSG_IDS_PER_TRIAL}
+        return list(sent.values()), [self.done.get(msg_id, float('nan')) for msg_id in sent]
+
+    def close(self):
+        self.thread_lock.kill()
+        for thread in self.threads:
+            thread.join()
+
+
+def sample_lag(kafka_servers, samples, thread_lock):
+    """ Append (time, lag of the worker and master input topics) every LAG_INTERVAL seconds. """
+    admin_client = AdminClient({'bootstrap.servers': kafka_servers})
+    while thread_lock.is_active():
+        try:
+            lags = [consumer_lag(kafka_servers, topic, admin_client=admin_client) for topic in INPUT_TOPICS]
+            samples.append((time.time(), sum(lag or 0 for lag in lags)))
+        except Exception as error:
+            log(f'COULD NOT READ THE CONSUMER LAG: {error}')
+        time.sleep(LAG_INTERVAL)
+
+
+def run(workers, points, dataset_path=None, kafka_servers="localhost:10001", local=False, grid_model='timestamp',
+        slo_ms=1000.0, trial_seconds=30, warmup=0.2, tolerance=0.05, start_rate=10.0, max_rate=5000.0, precision=0.05,
+        max_trials=16, num_processes=4, drain_seconds=60.0, output=CAPACITY_FILE):
+    """
+    Search the maximum sustainable rate of the deployment and store it in the capacity table under [points][workers].
+    With local, --workers workers and a master run on this host over shared memory instead.
+    Returns the table entry, or None when not even start_rate was sustainable.
+    """
+    if dataset_path is None:
+        dataset_path = f'datasets/robots-{workers}_points-{points}.hdf5'
+        if not os.path.exists(dataset_path):
+            # Not all worker counts have a specific dataset
+            dataset_path = f'datasets/robots-6_points-{points}.hdf5'
+
+    # Local components are forked before this process starts any thread
+    pids = []
+    if local:
+        transport, pids = local_pipeline.start_components('shm', workers, grid_model)
+    else:
+        transport = create_kafka_transport(kafka_servers)
+
+    trial_count = itertools.count(1)
+    frame_bytes = [0]
+
+    def measure(rate):
+        first_id = next(trial_count) * MSG_IDS_PER_TRIAL
+
+        # The lag of a local transport is not readable, it is derived from the send and completion rates instead
+        lag_samples, lag_lock, lag_thread = None, create_lock(), None
+        if not local:
+            lag_samples = []
+            lag_thread = Thread(target=sample_lag, args=(kafka_servers, lag_samples, lag_lock), daemon=True)
+            lag_thread.start()
+
+        try:
+            # The QoS collector's consumers and the lag sampler's AdminClient run librdkafka threads, so with Kafka
+            # the feeder processes are forked from a spawned process. The shared-memory transport is inherited
+            feeder_run = process_feeder.run if local else process_feeder.run_spawned
+            results = feeder_run(target_rate=rate, num_processes=num_processes, duration_seconds=trial_seconds,
+                                 kafka_servers=kafka_servers, dataset_path=dataset_path, transport=transport,
+                                 start_delay=1, msg_id_offset=first_id)
+            if not results:
+                return {'rate': rate, 'sustainable': False, 'reason': 'the feeder failed'}
+            frame_bytes[0] = results['frame_bytes']
+
+            # Wait for the tail of the trial, which also lets the next trial start from empty topics
+            deadline = time.time() + drain_seconds
+            while collector.n_done(first_id) < results['sent'] and time.time() < deadline:
+                time.sleep(1)
+            if collector.n_done(first_id) < results['sent']:
+                log(f'{results["sent"] - collector.n_done(first_id)} FRAMES OF THE TRIAL STILL IN FLIGHT AFTER '
+                    f'{drain_seconds} SECONDS, THE NEXT TRIAL STARTS WITH A BACKLOG')
+        finally:
+            lag_lock.kill()
+            if lag_thread is not None:
+                lag_thread.join()
+
+        sent, done = collector.trial_times(first_id)
+        return evaluate_trial(rate, results['msgs_per_second'], results['sent'], sent, done, lag_samples,
+                              slo_ms=slo_ms, tolerance=tolerance, warmup=warmup)
+
+    collector = None
+    try:
+        collector = create_qos_collector(transport)
+        result = search_capacity(measure, start_rate, max_rate, precision=precision, max_trials=max_trials,
+                                 log_func=log)
+    finally:
+        if collector is not None:
+            collector.close()
+        if local:
+            local_pipeline.stop_components(transport, pids)
+
+    # Without a sustainable rate there is nothing to store, an entry of 0 would read as a measured capacity
+    if result['max_per_second'] is None:
+        log(f'NO SUSTAINABLE RATE WITH {workers} WORKERS AND {points} POINTS PER FRAME, NOTHING SAVED TO {output}')
+        return None
+
+    entry = update_capacity_table(
+        output, 'warehouse', points, workers, result,
+        mb_per_second=result['max_per_second'] * frame_bytes[0] / (1024 * 1024),
+        frame_bytes=frame_bytes[0],
+        slo={'latency_p99_ms': slo_ms, 'tolerance': tolerance, 'trial_seconds': trial_seconds, 'warmup': warmup},
+        dataset=dataset_path,
+        local=local,
+    )
+    log(f'MAXIMUM SUSTAINABLE RATE WITH {workers} WORKERS AND {points} POINTS PER FRAME: '
+        f'{entry["max_per_second"]:.1f} FRAMES/S ({entry["mb_per_second"]:.2f} MB/s), SAVED TO {output}')
+    return entry
+
+
+if __name__ == '__main__':
+    py_args = parser.parse_args()
+    run(py_args.workers, py_args.points, py_args.dataset, py_args.kafka_servers, py_args.local, py_args.grid_model,
+        py_args.slo_ms, py_args.trial_seconds, py_args.warmup, py_args.tolerance, py_args.start_rate,
+        py_args.max_rate, py_args.precision, py_args.max_trials, py_args.processes, py_args.drain_seconds,
+        py_args.output)
@@ -0,0 +1,107 @@
+"""
+Throughput of inline payloads versus claim checks at increasing payload sizes.
+
+For each payload size, the same number of messages is sent twice through a benchmark topic: once with the payload
+inside the Kafka message and once through a claim-check blob directory. The consumer reads every payload (CRC32), so
+both modes pay for moving the bytes. Inline payloads above the broker's message.max.bytes (1 MB by default) fail,
+which shows up as failed deliveries.
+
+python3 claim_check_benchmark.py --kafka_servers localhost:10001 --blob_dir /tmp/claim_check --sizes 65536 1048576 4194304
+"""
+
+import argparse
+import time
+import zlib
+from threading import Thread
+
+from confluent_kafka import KafkaException
+from confluent_kafka.admin import AdminClient, NewTopic
+
+from utils import kafka_utils
+from utils.claim_check import create_local_blob_store
+from utils.kafka_utils import create_batch_producer, create_consumer
+from utils.misc import create_lock, log
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--kafka_servers", type=str, default="localhost:10001")
+parser.add_argument("--topic", type=str, default="claim_check_benchmark")
+parser.add_argument("--blob_dir", type=str, default="/tmp/claim_check_benchmark",
+                    help="Blob directory, shared by the producer and the consumer.")
+parser.add_argument("--sizes", type=int, nargs="+", default=[16384, 65536, 262144, 1048576, 4194304],
+                    help="Payload sizes in bytes.")
+parser.add_argument("--messages", type=int, default=500, help="Messages per size and mode. Default: 500.")
+
+ASSIGNMENT_TIMEOUT_SECONDS = 60
+IDLE_TIMEOUT_SECONDS = 10  # Stop waiting when no message arrives for this long
+
+
+def ensure_topic(kafka_servers, topic, num_partitions=5):
+    admin_client = AdminClient({'bootstrap.servers': kafka_servers})
+    if topic not in admin_client.list_topics(timeout=10).topics:
+        for future in admin_client.create_topics([NewTopic(topic, num_partitions=num_partitions)]).values():
+            future.result()
+
+
+def run_mode(payload_size, blob_store, py_args):
+    """ Send and consume py_args.messages payloads. Returns (MB/s, messages/s, failed or rejected messages). """
+    consumer = create_consumer(py_args.topic, kafka_servers=py_args.kafka_servers, blob_store=blob_store)
+    thread_lock = create_lock()
+    received = []
+    expected = [py_args.messages]
+
+    def on_message(data_bytes, msg_key, time_received, time_sent):
+        zlib.crc32(data_bytes)  # Touch every byte, like a real consumer would
+        received.append(time.perf_counter())
+        if len(received) >= expected[0]:
+            thread_lock.kill()
+
+    thread = Thread(target=consumer.poll_next, args=(1, thread_lock, on_message))
+    thread.start()
+
+    # The consumer starts from the latest offsets, so wait for the assignment before producing
+    deadline = time.time() + ASSIGNMENT_TIMEOUT_SECONDS
+    while not consumer.kafka_client.assignment() and time.time() < deadline:
+        time.sleep(0.5)
+
+    # Claim checks for every payload, so both modes send the same sizes
+    producer = create_batch_producer(kafka_servers=py_args.kafka_servers, blob_store=blob_store, claim_threshold=0)
+    payload = bytes(payload_size)
+    rejected = 0
+    t1 = time.perf_counter()
+    for i in range(py_args.messages):
+        try:
+            producer.push_msg(py_args.topic, payload, key=str(i).encode('utf-8'))
+
+        # The producer refuses messages above its own message.max.bytes before they reach the broker
+        except KafkaException:
+            rejected += 1
+    producer.close()
+    expected[0] = producer.delivered
+
+    # Wait for the delivered messages, or give up when they stop arriving
+    while thread.is_alive():
+        thread.join(timeout=1)
+        last = received[-1] if received else t1
+        if time.perf_counter() - last > IDLE_TIMEOUT_SECONDS:
+            thread_lock.kill()
+    consumer.close()
+
+    failed = producer.failed + rejected
+    if not received:
+        return 0.0, 0.0, failed
+    seconds = received[-1] - t1
+    return len(received) * payload_size / seconds / 1e6, len(received) / seconds, failed
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    kafka_utils.VERBOSE = False  # Per-message logging would dominate the measurement
+    ensure_topic(py_args.kafka_servers, py_args.topic)
+    blob_store = create_local_blob_store(py_args.blob_dir, release_delay=0.0)
+
+    print(f"{'bytes':>10} {'mode':>12} {'MB/s':>8} {'msg/s':>8} {'failed':>7}")
+    for payload_size in py_args.sizes:
+        for mode, store in [('inline', None), ('claim_check', blob_store)]:
+            mb_per_second, messages_per_second, failed = run_mode(payload_size, store, py_args)
+            log(f"{payload_size} bytes, {mode}: {mb_per_second:.1f} MB/s")
+            print(f"{payload_size:>10} {mode:>12} {mb_per_second:>8.1f} {messages_per_second:>8.1f} {failed:>7}")
@@ -0,0 +1,94 @@
+"""
+Consumer throughput with eager per-message commits versus batched at-least-once commits.
+
+For each commit mode, a consumer subscribes to a benchmark topic, a batching producer sends the messages and the
+consumer handles them with an optional simulated processing time. Reports messages per second and commit latency.
+
+python3 commit_benchmark.py --kafka_servers localhost:10001 --messages 20000 --work_ms 0
+"""
+
+import argparse
+import time
+from threading import Thread
+
+from confluent_kafka import KafkaException
+from confluent_kafka.admin import AdminClient, NewTopic
+
+from utils import kafka_utils
+from utils.kafka_utils import create_batch_producer, create_consumer
+from utils.misc import create_lock, log
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--kafka_servers", type=str, default="localhost:10001")
+parser.add_argument("--topic", type=str, default="commit_benchmark")
+parser.add_argument("--messages", type=int, default=20000, help="Messages per commit mode. Default: 20000.")
+parser.add_argument("--message_bytes", type=int, default=1024, help="Payload size. Default: 1024.")
+parser.add_argument("--work_ms", type=float, default=0.0, help="Simulated processing time per message. Default: 0.")
+parser.add_argument("--commit_every", type=int, default=500, help="Batched mode: messages per commit. Default: 500.")
+parser.add_argument("--commit_interval", type=float, default=5.0, help="Batched mode: seconds per commit. Default: 5.")
+
+ASSIGNMENT_TIMEOUT_SECONDS = 60
+
+
+def ensure_topic(kafka_servers, topic, num_partitions=5):
+    admin_client = AdminClient({'bootstrap.servers': kafka_servers})
+    if topic not in admin_client.list_topics(timeout=10).topics:
+        for future in admin_client.create_topics([NewTopic(topic, num_partitions=num_partitions)]).values():
+            future.result()
+
+
+def run_mode(commit_mode, py_args):
+    """ Consume py_args.messages messages with the given commit mode and return (messages/s, commit stats). """
+    consumer = create_consumer(py_args.topic, kafka_servers=py_args.kafka_servers, commit_mode=commit_mode,
+                               commit_interval=py_args.commit_interval, commit_every=py_args.commit_every)
+    thread_lock = create_lock()
+    received = []
+
+    def on_message(data_bytes, msg_key, time_received, time_sent):
+        if py_args.work_ms > 0:
+            time.sleep(py_args.work_ms / 1000)
+        received.append(time.perf_counter())
+        if len(received) >= py_args.messages:
+            thread_lock.kill()
+
+    thread = Thread(target=consumer.poll_next, args=(1, thread_lock, on_message))
+    thread.start()
+
+    # The consumer starts from the latest offsets, so wait for the assignment before producing
+    deadline = time.time() + ASSIGNMENT_TIMEOUT_SECONDS
+    while not consumer.kafka_client.assignment() and time.time() < deadline:
+        time.sleep(0.5)
+
+    producer = create_batch_producer(kafka_servers=py_args.kafka_servers)
+    payload = bytes(py_args.message_bytes)
+    for i in range(py_args.messages):
+        producer.push_msg(py_args.topic, payload, key=str(i).encode('utf-8'))
+    producer.close()
+
+    thread.join()
+    stats = consumer.offsets.stats() if consumer.offsets is not None else None
+    if consumer.offsets is None:
+        try:
+            # Make sure the last asynchronous commits land, so the next mode does not re-read these messages
+            consumer.kafka_client.commit(asynchronous=False)
+        except KafkaException:
+            pass
+    consumer.close()
+    messages_per_second = (len(received) - 1) / (received[-1] - received[0])
+    return messages_per_second, stats
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    kafka_utils.VERBOSE = False  # Per-message logging would dominate the measurement
+    ensure_topic(py_args.kafka_servers, py_args.topic)
+
+    results = {}
+    for commit_mode in ['eager', 'batched']:
+        results[commit_mode] = run_mode(commit_mode, py_args)
+        log(f"{commit_mode}: {results[commit_mode][0]:.0f} messages/s")
+
+    for commit_mode, (messages_per_second, stats) in results.items():
+        print(f"{commit_mode:>8}: {messages_per_second:10.0f} messages/s"
+              + (f", commit latency {stats}" if stats else ", one asynchronous commit per message"))
+    print(f"Speedup of batched commits: {results['batched'][0] / results['eager'][0]:.2f}x")
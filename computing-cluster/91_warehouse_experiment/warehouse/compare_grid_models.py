@@ -0,0 +1,148 @@
+"""
+Compare the timestamp/exponential-decay grid against the log-odds grid and the 3D voxel map.
+
+Runs the same frames through both worker functions and merges the updates on a local master grid.
+Reports worker time, update size, merge throughput, master memory and how well the two maps agree.
+
+python3 compare_grid_models.py --dataset ../datasets/robots-4_points-1000.hdf5 --frames 200
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.grid import OccupancyGrid
+from utils.grid_cell import CellState
+from utils.lidar_dataset_reader import load_to_memory
+from utils.log_odds_grid import LogOddsGrid
+from utils.voxel_map import VoxelMap
+from utils.worker_functions import local_to_world_space, process_point_cloud, process_point_cloud_log_odds, \
+    process_point_cloud_voxels
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, default="../datasets/robots-4_points-1000.hdf5")
+parser.add_argument("--frames", type=int, default=200, help="Frames per sensor. Default: 200.")
+
+MODELS = {
+    'timestamp': (process_point_cloud, OccupancyGrid),
+    'log_odds': (process_point_cloud_log_odds, LogOddsGrid),
+    'voxel': (process_point_cloud_voxels, VoxelMap),
+}
+
+
+def produce_updates(all_sensor_data, frames_per_sensor, process_frame):
+    """ Run the worker side for every frame and return the serialized updates and worker time per frame. """
+    updates = []
+    worker_seconds = 0.0
+    for sensor_frames in all_sensor_data:
+        for frame in sensor_frames[:frames_per_sensor]:
+            t1 = time.perf_counter()
+            world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+            updates.append(process_frame(world_space_lidar, frame.position).to_bytes())
+            worker_seconds += time.perf_counter() - t1
+    return updates, worker_seconds / max(len(updates), 1)
+
+
+def apply_updates(grid_class, updates):
+    """ Merge the updates on a fresh master grid and return it. """
+    grid = grid_class()
+    for update in updates:
+        if grid_class is OccupancyGrid:
+            grid.update_from_bytes(update, check_timestamp=True)
+        else:
+            grid.update_from_bytes(update)
+    return grid
+
+
+def merge_updates(grid_class, updates):
+    """
+    Merge the updates on a fresh master grid. Returns (grid, merge seconds, traced bytes, peak traced bytes).
+
+    The merge is timed in an untraced pass, and the memory is measured in a second, traced pass. tracemalloc slows
+    down every allocation, so timing the traced pass would penalize the models that allocate more per update.
+    """
+    t1 = time.perf_counter()
+    grid = apply_updates(grid_class, updates)
+    merge_seconds = time.perf_counter() - t1
+
+    tracemalloc.start()
+    traced_grid = apply_updates(grid_class, updates)
+    traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced_grid
+    return grid, merge_seconds, traced_bytes, peak_bytes
+
+
+def classify(grid, now):
+    """ Map of (x, y) -> CellState, ignoring vehicles and unknown cells. """
+    return {
+        coords: state for coords, state, _ in grid.cell_states(now)
+        if state in (CellState.EMPTY, CellState.OCCUPIED)
+    }
+
+
+def cell_values(grid):
+    """ Map of (x, y) -> log-odds value of a LogOddsGrid. """
+    coords, values = grid.cells()
+    return dict(zip(map(tuple, coords.tolist()), values.tolist()))
+
+
+def compare_maps(reference, candidate):
+    """ Return (per-cell agreement, IoU of occupied cells) between two classified maps. """
+    cells = reference.keys() | candidate.keys()
+    agreement = sum(reference.get(c) == candidate.get(c) for c in cells) / max(len(cells), 1)
+    occupied_ref = {c for c, s in reference.items() if s == CellState.OCCUPIED}
+    occupied_cand = {c for c, s in candidate.items() if s == CellState.OCCUPIED}
+    union = occupied_ref | occupied_cand
+    iou = len(occupied_ref & occupied_cand) / len(union) if union else 1.0
+    return agreement, iou
+
+
+def run(dataset_path, frames_per_sensor=200):
+    all_sensor_data = load_to_memory(dataset_path)
+    results = {}
+    for name, (process_frame, grid_class) in MODELS.items():
+        updates, worker_seconds = produce_updates(all_sensor_data, frames_per_sensor, process_frame)
+        grid, merge_seconds, traced_bytes, peak_bytes = merge_updates(grid_class, updates)
+        results[name] = {
+            'updates': updates,
+            'grid': grid,
+            'worker_ms': worker_seconds * 1000,
+            'bytes_per_update': np.mean([len(u) for u in updates]),
+            'merges_per_second': len(updates) / merge_seconds,
+            'master_bytes': traced_bytes,
+            'master_peak_bytes': peak_bytes,
+        }
+
+    for name, result in results.items():
+        print(f"{name:>10}: worker {result['worker_ms']:.2f} ms/frame, "
+              f"update {result['bytes_per_update']:.0f} bytes, "
+              f"merge {result['merges_per_second']:.1f} updates/s, "
+              f"master memory {result['master_bytes'] / 1024:.1f} KiB "
+              f"(peak {result['master_peak_bytes'] / 1024:.1f} KiB)")
+
+    now = time.time()
+    reference = classify(results['timestamp']['grid'], now)
+    for name in ['log_odds', 'voxel']:
+        agreement, iou = compare_maps(reference, classify(results[name]['grid'], now))
+        print(f"Map agreement ({name} vs timestamp): {agreement * 100:.2f} % of cells, occupied IoU {iou:.3f}")
+
+    # Additive merges only depend on the message order where a cell hits the clamp limits
+    shuffled = list(results['log_odds']['updates'])
+    random.shuffle(shuffled)
+    reordered = apply_updates(LogOddsGrid, shuffled)
+    original_values, reordered_values = cell_values(results['log_odds']['grid']), cell_values(reordered)
+    differing = sum(original_values.get(c) != reordered_values.get(c)
+                    for c in original_values.keys() | reordered_values.keys())
+    state_agreement, _ = compare_maps(classify(results['log_odds']['grid'], now), classify(reordered, now))
+    print(f"Log-odds after shuffling the updates: {differing} cells differ (clamped), "
+          f"state agreement {state_agreement * 100:.2f} %")
+    return results
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    run(py_args.dataset, py_args.frames)
@@ -2,13 +2,15 @@ import argparse
 import itertools
 import math
 import time
-import numpy as np
 from threading import Thread
 from typing import List
 
-from .utils.kafka_utils import create_producer
-from .utils.lidar_dataset_reader import load_to_memory
+from .utils.claim_check import create_local_blob_store
+from .utils.frame_buffer import first_frame, load_frame_buffer
 from .utils.misc import resource_exists, log, create_lock
+from .utils.rate_scheduler import create_rate_scheduler
+from .utils.transport import create_kafka_transport
+from .utils.workload_profiles import day_night, parse_profile
 
 """
 Day-night Feeder: Streams sensor data at a controlled rate over a specified duration using parallel threads.
@@ -34,6 +36,25 @@ parser.add_argument(
     default=4,
     help="Number of threads to use for data transmission (default: 4)."
 )
+parser.add_argument(
+    "--poisson",
+    action="store_true",
+    help="Exponential gaps between the sends (Poisson arrivals) instead of fixed gaps."
+)
+parser.add_argument(
+    "--producer_mode",
+    type=str,
+    default="default",
+    choices=["default", "batch"],
+    help="Producer of every thread, see PRODUCER_MODE. 'batch' batches and compresses the sends (default: default)."
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    help="Workload profile instead of the day-night cycle, e.g. \"ramp(0.1, 1) + spike(300, 0.5, 30)\" "
+         "(see utils/workload_profiles.py). Scales of --max_mbps."
+)
 
 
 def compute_feeding_scale(time_elapsed_seconds: float, max_duration_seconds: int, n_cycles: int) -> float:
@@ -49,16 +70,7 @@ def compute_feeding_scale(time_elapsed_seconds: float, max_duration_seconds: int
     Returns:
         float: Scaling factor to control transmission speed.
     """
-    default_cycle = [
-                        0.03, 0.06, 0.09, 0.12, 0.266, 0.412,
-                        0.558, 0.704, 0.85, 0.7625, 0.675, 0.587,
-                        0.5, 0.59, 0.68, 0.77, 0.86, 0.97,
-                        0.813, 0.656, 0.5, 0.343, 0.186, 0.03
-                    ] * n_cycles
-
-    # Interpolate to find the scale value for the elapsed time
-    original_time_points = np.linspace(0, max_duration_seconds, len(default_cycle))
-    return float(np.interp(time_elapsed_seconds, original_time_points, default_cycle))
+    return float(day_night(n_cycles)(time_elapsed_seconds, max_duration_seconds))
 
 
 def run(
@@ -68,7 +80,12 @@ def run(
         num_threads: int = 4,
         duration_seconds: int = 600,
         kafka_servers: str = "localhost:10001",
-        dataset_path: str = "../robots-4/points-per-frame-5000.hdf5"
+        dataset_path: str = "../robots-4/points-per-frame-5000.hdf5",
+        blob_dir: str = None,
+        transport=None,
+        poisson: bool = False,
+        profile=None,
+        producer_mode: str = 'default'
 ) -> int:
     """
     Runs the burst feeder experiment, streaming data to Kafka topics using multiple threads.
@@ -80,6 +97,13 @@ def run(
         duration_seconds (int): Experiment duration in seconds.
         kafka_servers (str): Kafka server connection string.
         dataset_path (str): Path to the HDF5 dataset to stream.
+        blob_dir (str): Optional claim-check directory shared with the workers, for payloads too large for Kafka.
+        transport: Optional transport from utils.transport (e.g. shared memory). Default: Kafka at kafka_servers.
+        poisson (bool): Exponential gaps between the sends (Poisson arrivals) with the same mean rate.
+        profile: Workload profile (utils/workload_profiles.py) or its expression, scales of target_mbps.
+            Default: the day-night cycle, n_cycles times.
+        producer_mode (str): 'default', or 'batch' for the batching producer (utils/kafka_utils.py), which is flushed
+            when the threads are done.
 
     Returns:
         int: Number of messages sent (used primarily for tracking/debugging).
@@ -99,9 +123,16 @@ def run(
     threads = []
     kafka_producers = []
 
+    # Payloads above the claim-check threshold are written to blob_dir, only their references go through Kafka
+    blob_store = create_local_blob_store(blob_dir) if blob_dir else None
+
+    # Kafka unless another transport (e.g. shared memory for a broker-free benchmark) is given
+    if transport is None:
+        transport = create_kafka_transport(kafka_servers)
+
     # Initialize Kafka producers for each thread
     for _ in range(num_threads):
-        kafka_producer = create_producer(kafka_servers=kafka_servers)
+        kafka_producer = transport.producer(mode=producer_mode, blob_store=blob_store)
         kafka_producers.append(kafka_producer)
 
     # Verify all Kafka connections are active
@@ -110,10 +141,10 @@ def run(
             log(f"Kafka producer #{i} not connected. Aborting.")
             return next(msg_count)
 
-    # Load the dataset into memory
-    all_sensor_data = load_to_memory(dataset_path)
-    num_sensors = len(all_sensor_data)
-    example_frame = all_sensor_data[0][0]
+    # Load the dataset. A packed dataset (utils/packed_dataset.py) is memory-mapped, an HDF5 dataset is serialized once
+    frame_buffer = load_frame_buffer(dataset_path, num_threads)
+    num_sensors = frame_buffer.n_sensors
+    example_frame = first_frame(frame_buffer)
 
     # Calculate frame and event properties
     bytes_per_frame = example_frame.data.nbytes
@@ -133,49 +164,45 @@ def run(
             items_to_send (int): Number of items the thread is responsible for sending.
         """
         sensor_index = nth_thread % num_sensors
-        sensor_frames = all_sensor_data[sensor_index]
+        sensor_frames = frame_buffer.sensor(sensor_index)
         index = 0
-        experiment_end = experiment_start + duration_seconds
 
         # Log thread start details
         log(f"Thread {nth_thread} sending data from sensor {sensor_index}.")
 
-        # Wait for experiment start
-        while time.time() < experiment_start:
-            pass
-
-        # Main transmission loop
-        while time.time() < experiment_end:
-            if not alive_signal.is_active():
-                log(f"Thread {nth_thread} terminated.")
-                return
+        # Wait for the other threads, then start together
+        pacer = scheduler.join(nth_thread)
 
-            seconds_since_start = time.time() - experiment_start
-            current_scale = compute_feeding_scale(seconds_since_start, duration_seconds, n_cycles)
-            adjusted_time_between_events = time_between_events / current_scale  # Scale down msg throughput by increasing wait time
-
-            start_time = time.time()  # Record start time of the event transmission
+        # Main transmission loop, until the experiment duration has passed
+        while pacer.wait(alive_signal):
 
             # Send the frame and increment indices
-            frame = sensor_frames[index % len(sensor_frames)]
             kafka_producers[nth_thread - 1].push_msg(
                 'grid_worker_input',
-                frame.to_bytes(),
-                key=str(next(msg_count) + msg_id_offset).encode('utf-8')
+                sensor_frames[index % len(sensor_frames)],
+                key=str(next(msg_count) + msg_id_offset).encode('utf-8'),
+                intended=pacer.due  # The scheduled send time, so the consumers also see how late the send was
             )
             index += 1
 
-            # Calculate and respect the adjusted wait time before sending the next frame
-            elapsed_time = time.time() - start_time
-            remaining_time = adjusted_time_between_events - elapsed_time
-            if remaining_time > 0:
-                time.sleep(remaining_time)
-
+        if not alive_signal.is_active():
+            log(f"Thread {nth_thread} terminated.")
+            return
         log(f"Thread {nth_thread} completed.")
 
+    # The profile is evaluated once per second of the run, a send only looks its second up
+    if profile is None:
+        profile = day_night(n_cycles)
+    elif isinstance(profile, str):
+        profile = parse_profile(profile)
+    schedule = profile.compile(duration_seconds)
+    log(f"Workload profile {profile}: {schedule.summary()}")
+
     try:
-        # Start the experiment after a short delay
-        experiment_start = time.time() + 3
+        # The threads start together, a short delay after the last one is ready
+        # The steps without load are pauses with a fixed end, only the gaps between the sends are Poisson
+        scheduler = create_rate_scheduler(num_threads, schedule.interval_function(time_between_events), poisson=poisson,
+                                          duration=duration_seconds, pause=schedule.pause_function())
         log(f"Starting {num_threads} producer threads.")
 
         # Launch threads
@@ -184,12 +211,14 @@ def run(
             threads.append(thread)
             thread.start()
 
-        # Wait for all threads to finish
+        # Wait for all threads to finish, then for the messages still queued in the producers
         for thread in threads:
             thread.join()
+        for producer in kafka_producers:
+            producer.close()
 
         # Log experiment summary
-        duration = time.time() - experiment_start
+        duration = time.time() - scheduler.start
 
         # Peek msg_count without changing it
         total_items = next(msg_count)
@@ -199,6 +228,7 @@ def run(
         total_mb_sent = total_bytes_sent / (1024 * 1024)
         actual_mbps = total_mb_sent / duration
         log(f"Experiment completed. {total_items} items sent in {duration:.2f} seconds (~{actual_mbps:.2f} MB/s).")
+        log(f"Send schedule: {scheduler.summary()}")
 
     except KeyboardInterrupt:
         # Handle manual termination
@@ -214,5 +244,8 @@ if __name__ == "__main__":
     run(
         target_mbps=py_args.max_mbps,
         num_threads=py_args.num_threads,
-        duration_seconds=py_args.duration
+        duration_seconds=py_args.duration,
+        poisson=py_args.poisson,
+        profile=py_args.profile,
+        producer_mode=py_args.producer_mode
     )
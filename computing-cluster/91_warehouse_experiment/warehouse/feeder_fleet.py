@@ -0,0 +1,289 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from threading import Event, Lock, Thread
+
+from . import process_feeder
+from .utils.misc import create_lock, log
+from .utils.transport import create_kafka_transport
+from .utils.workload_profiles import parse_profile
+
+"""
+Feeder fleet: one coordinator and feeder agents on several hosts, so the offered load is not capped by one machine.
+
+The coordinator and the agents talk over two Kafka topics:
+  feeder_control (coordinator -> agents): 'discover', 'plan' and 'shutdown' messages. Every agent consumes it in its
+                 own consumer group, so every agent receives every message.
+  feeder_reports (agents -> coordinator): 'hello' when an agent is ready, and 'report' with the achieved rates.
+
+A plan gives every agent its share of the rate schedule, a message id range and a common start time. The agents run
+warehouse.process_feeder with their share and report back, and the coordinator adds the reports up. The start time is
+wall-clock time, so the hosts' clocks must be synchronized (NTP). The late start shows up in the send lateness.
+"""
+
+# python3 -m warehouse.feeder_fleet agent --dataset datasets/robots-4_points-1000.hdf5 --processes 4
+# python3 -m warehouse.feeder_fleet coordinator --agents 3 --rate 3000 --duration 60
+# python3 -m warehouse.feeder_fleet local --agents 2 --rate 1000 --dataset datasets/robots-4_points-1000.hdf5
+
+CONTROL_TOPIC = 'feeder_control'
+REPORT_TOPIC = 'feeder_reports'
+
+# EVERY AGENT SENDS ITS MESSAGES WITH IDS FROM ITS OWN RANGE, SO THE IDS ARE UNIQUE ACROSS THE FLEET
+MSG_IDS_PER_AGENT = 10 ** 9
+
+parser = argparse.ArgumentParser()
+parser.add_argument("role", choices=["agent", "coordinator", "local"],
+                    help="agent: wait for plans. coordinator: plan a run. local: both, with agents as local processes.")
+parser.add_argument("--kafka_servers", type=str, default="localhost:10001")
+parser.add_argument("--dataset", type=str, default="datasets/robots-4_points-5000.hdf5", help="Dataset of an agent.")
+parser.add_argument("--processes", type=int, default=1, help="Feeder processes of an agent. Default: 1.")
+parser.add_argument("--agent_id", type=str, default=None, help="Default: hostname and process id.")
+parser.add_argument("--agents", type=int, default=1, help="Agents the coordinator waits for. Default: 1.")
+parser.add_argument("--rate", type=float, default=1000, help="Global target rate in messages per second.")
+parser.add_argument("--schedule", type=str, default=None,
+                    help="Global rate schedule as JSON [[seconds since the start, rate], ...], instead of --rate.")
+parser.add_argument("--profile", type=str, default=None,
+                    help="Workload profile as scales of --rate (utils/workload_profiles.py), instead of --schedule.")
+parser.add_argument("--duration", type=int, default=60, help="Seconds to send. Default: 60.")
+parser.add_argument("--lead", type=float, default=10, help="Seconds between the plan and the start. Default: 10.")
+parser.add_argument("--poisson", action="store_true", help="Exponential gaps between the sends.")
+
+
+def encode(message):
+    return json.dumps(message).encode('utf-8')
+
+
+###################################################################################################
+###################################################################################################
+
+def run_agent(kafka_servers="localhost:10001", dataset_path="datasets/robots-4_points-5000.hdf5", processes=1,
+              agent_id=None, transport=None, control_topic=CONTROL_TOPIC, report_topic=REPORT_TOPIC):
+    """ Announce this agent, run every plan that includes it, and report the results until a shutdown arrives. """
+    agent_id = agent_id or f'{socket.gethostname()}-{os.getpid()}'
+    if transport is None:
+        transport = create_kafka_transport(kafka_servers)
+    reporter = transport.producer()
+    alive_lock = create_lock()
+    runs = []
+
+    def hello():
+        reporter.push_msg(report_topic, encode({'type': 'hello', 'agent': agent_id, 'processes': processes}),
+                          key=agent_id.encode('utf-8'))
+
+    def run_plan(plan, share):
+        log(f'AGENT {agent_id}: RUN {plan["run_id"]} STARTS AT {plan["start_at"]} ({share})')
+        options = dict(target_rate=share['rate'], num_processes=processes, duration_seconds=plan['duration'],
+                       dataset_path=dataset_path, poisson=plan.get('poisson', False), transport=transport,
+                       start_at=plan['start_at'], msg_id_offset=share['msg_id_offset'])
+
+        # The reporter and the control consumer run librdkafka threads, so with Kafka the feeder processes are not
+        # forked from here. The local transports have no client threads and must be inherited by a fork
+        if transport.name == 'kafka':
+            results = process_feeder.run_spawned(**options)
+        else:
+            results = process_feeder.run(**options)
+        report = {'type': 'report', 'run_id': plan['run_id'], 'agent': agent_id, 'results': results}
+        reporter.push_msg(report_topic, encode(report), key=agent_id.encode('utf-8'))
+
+    def on_message(data_bytes, msg_key, time_received, time_sent):
+        message = json.loads(bytes(data_bytes).decode('utf-8'))
+
+        # A coordinator that started after this agent asks who is there
+        if message['type'] == 'discover':
+            hello()
+
+        # A restarted agent with a fixed id can read a plan again, the plans that are already over are skipped
+        elif message['type'] == 'plan' and agent_id in message['agents']:
+            if message['start_at'] + message['duration'] < time.time():
+                log(f'AGENT {agent_id}: RUN {message["run_id"]} IS ALREADY OVER, SKIPPING')
+                return
+
+            # The run blocks until it is done, so it gets its own thread and the control topic is still read
+            thread = Thread(target=run_plan, args=(message, message['agents'][agent_id]))
+            thread.start()
+            runs.append(thread)
+
+        elif message['type'] == 'shutdown':
+            alive_lock.kill()
+
+    # Every agent is its own consumer group, so every agent receives every control message
+    control = transport.consumer(control_topic, group_id=f'{control_topic}.{agent_id}',
+                                 on_assigned=lambda partitions: hello())
+    log(f'AGENT {agent_id} READY ({processes} PROCESSES, {dataset_path})')
+    try:
+        control.poll_next(agent_id, alive_lock, on_message)
+    except KeyboardInterrupt:
+        alive_lock.kill()
+    for thread in runs:
+        thread.join()
+    control.close()
+    reporter.close()
+
+
+###################################################################################################
+###################################################################################################
+
+class create_coordinator:
+    """ Collects the hellos and reports of the agents from the report topic. """
+
+    def __init__(self, transport, control_topic=CONTROL_TOPIC, report_topic=REPORT_TOPIC):
+        self.transport = transport
+        self.control_topic = control_topic
+        self.producer = transport.producer()
+        self.lock = Lock()
+        self.agents = {}
+        self.reports = {}
+
+        # The report consumer must be assigned before the discover message, or early hellos are missed
+        assigned = Event()
+        self.alive_lock = create_lock()
+        self.consumer = transport.consumer(report_topic, group_id=f'{report_topic}.{uuid.uuid4().hex}',
+                                           on_assigned=lambda partitions: assigned.set())
+        self.thread = Thread(target=self.consumer.poll_next, args=('coordinator', self.alive_lock, self.on_report))
+        self.thread.start()
+        assigned.wait()
+
+    def on_report(self, data_bytes, msg_key, time_received, time_sent):
+        message = json.loads(bytes(data_bytes).decode('utf-8'))
+        with self.lock:
+            if message['type'] == 'hello':
+                self.agents[message['agent']] = message
+            elif message['type'] == 'report':
+                self.reports.setdefault(message['run_id'], {})[message['agent']] = message['results']
+
+    def send(self, message):
+        self.producer.push_msg(self.control_topic, encode(message))
+
+    # WAIT UNTIL n_agents HAVE ANNOUNCED THEMSELVES, RETURNS THE AGENTS FOUND
+    def discover(self, n_agents, timeout=60):
+        self.send({'type': 'discover'})
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if len(self.agents) >= n_agents:
+                    break
+            time.sleep(0.2)
+        with self.lock:
+            return dict(self.agents)
+
+    # SPLIT THE GLOBAL SCHEDULE BY THE PROCESSES OF EVERY AGENT, SEND THE PLAN AND WAIT FOR THE REPORTS
+    def run(self, agents, schedule, duration_seconds, lead_seconds=10, poisson=False):
+        total_processes = sum(agent['processes'] for agent in agents.values())
+        shares = {}
+        for index, (agent_id, agent) in enumerate(sorted(agents.items())):
+            fraction = agent['processes'] / total_processes
+            shares[agent_id] = {
+                'rate': [[step_start, rate * fraction] for step_start, rate in schedule],
+                'msg_id_offset': index * MSG_IDS_PER_AGENT,
+            }
+
+        run_id = uuid.uuid4().hex
+        start_at = time.time() + lead_seconds
+        self.send({'type': 'plan', 'run_id': run_id, 'start_at': start_at, 'duration': duration_seconds,
+                   'poisson': poisson, 'agents': shares})
+        log(f'RUN {run_id}: {len(shares)} AGENTS START AT {start_at} FOR {duration_seconds} SECONDS')
+
+        # The agents flush their producers before they report
+        deadline = start_at + duration_seconds + 120
+        while time.time() < deadline:
+            with self.lock:
+                if len(self.reports.get(run_id, {})) >= len(shares):
+                    break
+            time.sleep(0.5)
+        with self.lock:
+            reports = dict(self.reports.get(run_id, {}))
+        return summarize(run_id, schedule, shares, reports)
+
+    def shutdown_agents(self):
+        self.send({'type': 'shutdown'})
+
+    def close(self):
+        self.alive_lock.kill()
+        self.thread.join()
+        self.consumer.close()
+        self.producer.close()
+
+
+def summarize(run_id, schedule, shares, reports):
+    """ Add up the achieved rates of the agents. The slowest agent decides how long the run took. """
+    done = [results for results in reports.values() if results]
+    seconds = max((results['seconds'] for results in done), default=0.0)
+    sent = sum(results['sent'] for results in done)
+    mb = sum(results['mb_per_second'] * results['seconds'] for results in done)
+    summary = {
+        'run_id': run_id,
+        'agents': len(shares),
+        'reported': len(done),
+        'target_per_second': schedule,
+        'sent': sent,
+        'msgs_per_second': sent / seconds if seconds > 0 else 0.0,
+        'mb_per_second': mb / seconds if seconds > 0 else 0.0,
+        'lateness_p99_ms': max((results['lateness_p99_ms'] for results in done), default=0.0),
+        'per_agent': {agent_id: {'msgs_per_second': results.get('msgs_per_second', 0.0),
+                                 'mb_per_second': results.get('mb_per_second', 0.0)}
+                      for agent_id, results in reports.items()},
+    }
+    missing = sorted(set(shares) - set(agent for agent, results in reports.items() if results))
+    if missing:
+        log(f'RUN {run_id}: NO RESULTS FROM {missing}')
+    log(f'FLEET RESULTS: {summary}')
+    return summary
+
+
+def run_coordinator(n_agents, schedule, duration_seconds, kafka_servers="localhost:10001", lead_seconds=10,
+                    poisson=False, transport=None, shutdown=False):
+    """ Discover the agents, run one plan over all of them and return the fleet results. """
+    coordinator = create_coordinator(transport or create_kafka_transport(kafka_servers))
+    try:
+        agents = coordinator.discover(n_agents)
+        if len(agents) < n_agents:
+            log(f'ONLY {len(agents)} OF {n_agents} AGENTS ANNOUNCED THEMSELVES')
+        if not agents:
+            return {}
+        return coordinator.run(agents, schedule, duration_seconds, lead_seconds, poisson)
+    finally:
+        if shutdown:
+            coordinator.shutdown_agents()
+        coordinator.close()
+
+
+###################################################################################################
+###################################################################################################
+
+def run_local(n_agents, schedule, duration_seconds, kafka_servers="localhost:10001",
+              dataset_path="datasets/robots-4_points-5000.hdf5", processes=1, lead_seconds=10, poisson=False):
+    """ Test mode: the agents are processes on this host, the coordinator shuts them down after the run. """
+    context = multiprocessing.get_context('fork')
+    agents = []
+    for nth in range(n_agents):
+        agent = context.Process(target=run_agent, args=(kafka_servers, dataset_path, processes, f'local-{nth}'))
+        agent.start()
+        agents.append(agent)
+    try:
+        return run_coordinator(n_agents, schedule, duration_seconds, kafka_servers, lead_seconds, poisson,
+                               shutdown=True)
+    finally:
+        for agent in agents:
+            agent.join(timeout=60)
+            if agent.is_alive():
+                agent.terminate()
+
+
+if __name__ == '__main__':
+    py_args = parser.parse_args()
+    rate_schedule = json.loads(py_args.schedule) if py_args.schedule else [[0, py_args.rate]]
+    if py_args.profile:
+        rate_schedule = parse_profile(py_args.profile).compile(py_args.duration).steps(py_args.rate)
+
+    if py_args.role == 'agent':
+        run_agent(py_args.kafka_servers, py_args.dataset, py_args.processes, py_args.agent_id)
+    elif py_args.role == 'coordinator':
+        run_coordinator(py_args.agents, rate_schedule, py_args.duration, py_args.kafka_servers, py_args.lead,
+                        py_args.poisson)
+    else:
+        run_local(py_args.agents, rate_schedule, py_args.duration, py_args.kafka_servers, py_args.dataset,
+                  py_args.processes, py_args.lead, py_args.poisson)
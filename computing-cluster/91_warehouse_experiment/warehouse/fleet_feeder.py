@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import math
+import time
+
+import numpy as np
+
+from .utils.kafka_utils import create_producer
+from .utils.lidar_dataset_reader import load_to_memory
+from .utils.misc import resource_exists, log, create_lock
+
+"""
+Fleet feeder: Simulates thousands of independent robots with asyncio.
+
+Every virtual robot replays the frames of one recorded sensor. The robots are placed in copies (tiles) of the
+recorded warehouse: each tile is rotated by a random angle and offset next to the others, and the poses of its robots
+are transformed accordingly. The point clouds are in the local frame of the lidar, so only the pose changes.
+Every robot sends at its own rate, on absolute deadlines, and the achieved rate is reported per robot.
+"""
+
+# python3 -m warehouse.fleet_feeder --robots 2000 --fps 0.5 --duration 600
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-r", "--robots",
+    type=int,
+    default=1000,
+    help="Number of virtual robots (default: 1000)."
+)
+parser.add_argument(
+    "-f", "--fps",
+    type=float,
+    default=0.5,
+    help="Mean frames per second sent by each robot (default: 0.5)."
+)
+parser.add_argument(
+    "-s", "--fps_spread",
+    type=float,
+    default=0.5,
+    help="Per-robot rates are drawn uniformly from fps * (1 +- fps_spread) (default: 0.5)."
+)
+parser.add_argument(
+    "-d", "--duration",
+    type=int,
+    default=600,
+    help="Experiment duration in seconds (default: 10 minutes)."
+)
+parser.add_argument(
+    "-p", "--num_producers",
+    type=int,
+    default=4,
+    help="Number of Kafka producers shared by the robots (default: 4)."
+)
+parser.add_argument(
+    "--report",
+    type=str,
+    default=None,
+    help="Optional CSV file for the per-robot target and achieved rates."
+)
+
+TILE_SPACING_M = 10.0  # Gap between the copies of the recorded warehouse, in meters
+BUFFER_FULL_WAIT_SECONDS = 0.01
+
+
+class VirtualRobot:
+    """
+    One simulated robot: a recorded sensor replayed with a rigid transform of its poses.
+
+    Args:
+        robot_id (int): Index of the robot in the fleet.
+        frames (list): Serialized point clouds of the recorded sensor.
+        positions (np.ndarray): (frames, 3) recorded sensor locations in meters.
+        rotations (np.ndarray): (frames, 3) recorded sensor rotations in degrees (yaw at index 1).
+        angle (float): Rotation of the tile around the recorded warehouse center, in degrees.
+        center (np.ndarray): (3,) rotation center in meters.
+        offset (np.ndarray): (3,) translation of the tile in meters.
+        first_frame (int): Frame index to start the replay from.
+        fps (float): Target frames per second.
+        phase (float): Seconds from the start to the first frame, so the robots do not all send at the same moment.
+    """
+
+    def __init__(self, robot_id, frames, positions, rotations, angle, center, offset, first_frame, fps, phase=0.0):
+        theta = np.deg2rad(angle)
+        rotation_matrix = np.array(((np.cos(theta), -np.sin(theta), 0),
+                                    (np.sin(theta), np.cos(theta), 0),
+                                    (0, 0, 1)))
+        self.robot_id = robot_id
+        self.frames = frames
+        self.positions = ((positions - center) @ rotation_matrix.T + center + offset).astype(np.float32)
+        self.rotations = rotations.copy()
+        self.rotations[:, 1] += angle
+        self.first_frame = first_frame
+        self.fps = fps
+        self.phase = phase
+        self.sent = 0
+        self.max_lateness = 0.0  # Seconds between a deadline and the actual send
+
+    def message(self, index):
+        """ Serialize the nth frame of the replay, in the same format as LidarFrame.to_bytes. """
+        frame = (self.first_frame + index) % len(self.frames)
+        return b''.join([self.frames[frame], self.rotations[frame].tobytes(), self.positions[frame].tobytes()])
+
+
+def create_fleet(all_sensor_data, n_robots, fps, fps_spread, seed=0):
+    """
+    Place n_robots virtual robots in rotated and offset copies of the recorded warehouse.
+
+    Every tile holds one copy of each recorded sensor, so the robots of a tile observe a consistent warehouse.
+    """
+    rng = np.random.default_rng(seed)
+    num_sensors = len(all_sensor_data)
+    frames = [[frame.data.tobytes() for frame in sensor_frames] for sensor_frames in all_sensor_data]
+    positions = [np.array([frame.position for frame in sensor_frames]) for sensor_frames in all_sensor_data]
+    rotations = [np.array([frame.rotation for frame in sensor_frames]) for sensor_frames in all_sensor_data]
+
+    all_positions = np.concatenate(positions)
+    lo, hi = all_positions.min(axis=0), all_positions.max(axis=0)
+    center = (lo + hi) / 2
+    # Tiles are rotated freely, so the pitch between them must fit the diagonal of the recorded area
+    pitch = np.linalg.norm((hi - lo)[:2]) + TILE_SPACING_M
+    n_tiles = math.ceil(n_robots / num_sensors)
+    columns = math.ceil(math.sqrt(n_tiles))
+    angles = rng.uniform(0, 360, n_tiles)
+    first_frames = rng.integers(0, min(len(f) for f in frames), n_tiles)
+
+    fleet = []
+    for robot_id in range(n_robots):
+        tile, sensor = divmod(robot_id, num_sensors)
+        offset = np.array([tile % columns, tile // columns, 0]) * pitch
+        robot_fps = fps * rng.uniform(1 - fps_spread, 1 + fps_spread)
+        fleet.append(VirtualRobot(robot_id, frames[sensor], positions[sensor], rotations[sensor],
+                                  angles[tile], center, offset, first_frames[tile], robot_fps,
+                                  rng.uniform(0, 1 / robot_fps)))
+    return fleet
+
+
+def run(
+        msg_id_offset: int = 0,
+        n_robots: int = 1000,
+        fps: float = 0.5,
+        fps_spread: float = 0.5,
+        num_producers: int = 4,
+        duration_seconds: int = 600,
+        kafka_servers: str = "localhost:10001",
+        dataset_path: str = "../robots-4/points-per-frame-5000.hdf5",
+        report_path: str = None
+) -> int:
+    """
+    Streams the frames of a virtual robot fleet to Kafka, each robot at its own rate.
+
+    Args:
+        msg_id_offset (int): Offset for the message keys, so several feeds can run in one experiment.
+        n_robots (int): Number of virtual robots.
+        fps (float): Mean frames per second per robot.
+        fps_spread (float): Relative spread of the per-robot rates.
+        num_producers (int): Number of Kafka producers shared by the robots.
+        duration_seconds (int): Experiment duration in seconds.
+        kafka_servers (str): Kafka server connection string.
+        dataset_path (str): Path to the HDF5 dataset to replay.
+        report_path (str): Optional CSV file for the per-robot rates.
+
+    Returns:
+        int: Number of messages sent.
+    """
+    msg_count = itertools.count()
+
+    if not resource_exists(dataset_path):
+        log(f"Dataset not found at {dataset_path}. Aborting.")
+        return next(msg_count)
+
+    alive_lock = create_lock()
+
+    kafka_producers = [create_producer(kafka_servers=kafka_servers) for _ in range(num_producers)]
+    for i, producer in enumerate(kafka_producers):
+        if not producer.connected():
+            log(f"Kafka producer #{i} not connected. Aborting.")
+            return next(msg_count)
+
+    all_sensor_data = load_to_memory(dataset_path)
+    fleet = create_fleet(all_sensor_data, n_robots, fps, fps_spread)
+    bytes_per_frame = all_sensor_data[0][0].data.nbytes
+    target_mbps = sum(robot.fps for robot in fleet) * bytes_per_frame / (1024 * 1024)
+    log(f"Simulating {n_robots} robots from {len(all_sensor_data)} recorded sensors "
+        f"(target {target_mbps:.2f} MB/s with {num_producers} producers).")
+
+    async def send(producer, message, intended):
+        # The id is drawn once, so a retried message keeps its key and the returned count matches the messages sent
+        key = str(next(msg_count) + msg_id_offset).encode('utf-8')
+        # With poll_timeout=0 the local queue can fill up, give librdkafka time to drain it instead of blocking
+        while True:
+            try:
+                producer.push_msg('grid_worker_input', message, key=key, poll_timeout=0, intended=intended)
+                return
+            except BufferError:
+                producer.kafka_client.poll(0)
+                await asyncio.sleep(BUFFER_FULL_WAIT_SECONDS)
+
+    async def robot_work(robot, producer, loop_start, loop_end):
+        # Random phase (seeded, from create_fleet), so the robots do not all send at the same moment
+        deadline = loop_start + robot.phase
+        loop = asyncio.get_running_loop()
+        while deadline < loop_end and alive_lock.is_active():
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            if loop.time() >= loop_end:
+                break
+            robot.max_lateness = max(robot.max_lateness, loop.time() - deadline)
+            # The deadline in wall-clock time is the intended send time of the frame
+            await send(producer, robot.message(robot.sent), experiment_start + (deadline - loop_start))
+            robot.sent += 1
+            # Absolute deadlines: a late send does not push back the following ones
+            deadline += 1 / robot.fps
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop_start = loop.time() + (experiment_start - time.time())
+        loop_end = loop_start + duration_seconds
+        await asyncio.gather(*[
+            robot_work(robot, kafka_producers[robot.robot_id % num_producers], loop_start, loop_end)
+            for robot in fleet
+        ])
+
+    try:
+        experiment_start = time.time() + 3
+        asyncio.run(main())
+        for producer in kafka_producers:
+            producer.kafka_client.flush()
+
+        duration = min(time.time() - experiment_start, duration_seconds)
+        achieved = np.array([robot.sent / duration for robot in fleet])
+        target = np.array([robot.fps for robot in fleet])
+        ratio = achieved / target
+        lateness = np.array([robot.max_lateness for robot in fleet])
+        total_items = sum(robot.sent for robot in fleet)
+        actual_mbps = total_items * bytes_per_frame / (1024 * 1024) / duration
+        log(f"Experiment completed. {total_items} items sent in {duration:.2f} seconds "
+            f"(~{actual_mbps:.2f} MB/s, target {target_mbps:.2f} MB/s).")
+        log(f"Achieved / target rate per robot: mean {ratio.mean() * 100:.1f} %, "
+            f"p5 {np.percentile(ratio, 5) * 100:.1f} %, min {ratio.min() * 100:.1f} %, "
+            f"{np.count_nonzero(ratio < 0.95)} robots below 95 %.")
+        log(f"Max send lateness per robot: p50 {np.median(lateness) * 1000:.1f} ms, "
+            f"p95 {np.percentile(lateness, 95) * 1000:.1f} ms, max {lateness.max() * 1000:.1f} ms.")
+
+        if report_path is not None:
+            with open(report_path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['robot_id', 'target_fps', 'achieved_fps', 'frames_sent', 'max_lateness_s'])
+                for robot, robot_achieved in zip(fleet, achieved):
+                    writer.writerow([robot.robot_id, robot.fps, robot_achieved, robot.sent, robot.max_lateness])
+
+    except KeyboardInterrupt:
+        alive_lock.kill()
+        log("Experiment terminated by user.")
+
+    return next(msg_count)
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    run(
+        n_robots=py_args.robots,
+        fps=py_args.fps,
+        fps_spread=py_args.fps_spread,
+        num_producers=py_args.num_producers,
+        duration_seconds=py_args.duration,
+        report_path=py_args.report
+    )
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from threading import Thread
+
+import numpy as np
+
+from . import burst_feeder
+from .utils.latency_stats import create_latency_tracker
+from .utils.misc import create_lock, log
+from .utils.transport import create_memory_transport, create_shm_transport
+
+# The consumers are scripts that import utils as a top-level package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import master_consumer  # noqa: E402
+import worker_consumer  # noqa: E402
+
+"""
+Local pipeline: the burst feeder, the workers and the master on one host, without a Kafka broker.
+
+The components exchange messages through a local transport: shared-memory ring buffers between forked processes
+(--transport shm) or queues between threads of this process (--transport memory). The feeder sends --num_items frames
+as fast as it can, and the pipeline waits for the master's validation record of every frame. The throughput is the
+compute ceiling of the application on this host, without broker and network costs. Frames per second and the
+feeder-to-master latency are reported.
+"""
+
+# python3 -m warehouse.local_pipeline --dataset datasets/robots-4_points-5000.hdf5 --num_items 1000 --workers 2
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, default="datasets/robots-4_points-5000.hdf5")
+parser.add_argument("--transport", type=str, default="shm", choices=["shm", "memory"])
+parser.add_argument("--num_items", type=int, default=1000, help="Frames to send. Default: 1000.")
+parser.add_argument("--num_threads", type=int, default=4, help="Feeder threads. Default: 4.")
+parser.add_argument("--workers", type=int, default=2, help="Worker processes (or threads). Default: 2.")
+parser.add_argument("--grid_model", type=str, default="timestamp", choices=["timestamp", "log_odds", "voxel"])
+parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for the results. Default: 300.")
+
+TOPICS = ['grid_worker_input', 'grid_master_input', 'grid_worker_validate', 'grid_master_validate']
+
+
+def collect(transport, topic, expected, records, thread_lock):
+    """ Store the validation records of a topic by message id, until every expected id has arrived. """
+    consumer = transport.consumer(topic)
+
+    def on_message(data_bytes, msg_key, time_received, time_sent):
+        record = json.loads(bytes(data_bytes).decode('utf-8'))
+        records[record['id']] = record
+        if len(records) >= expected[0]:
+            thread_lock.kill()
+
+    consumer.poll_next(topic, thread_lock, on_message)
+
+
+def start_components(transport_name='shm', workers=2, grid_model='timestamp'):
+    """
+    Start the workers and the master on a local transport and return (transport, pids).
+    Call it before this process starts any thread: shared-memory components are forked.
+    """
+    os.environ.update({'GRID_MODEL': grid_model, 'VALIDATE_RESULTS': 'TRUE', 'VISUALIZE': 'FALSE', 'VERBOSE': 'FALSE'})
+    components = [worker_consumer.run] * workers + [master_consumer.run]
+
+    pids = []
+    if transport_name == 'shm':
+        transport = create_shm_transport(TOPICS)
+        for component in components:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    component(transport)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+    else:
+        transport = create_memory_transport()
+        for component in components:
+            Thread(target=component, args=(transport,), daemon=True).start()
+    return transport, pids
+
+
+def stop_components(transport, pids):
+    """ Stop the forked components and release the transport. """
+    for pid in pids:
+        os.kill(pid, signal.SIGINT)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    transport.close()
+
+
+def run(dataset_path, transport_name='shm', num_items=1000, num_threads=4, workers=2, grid_model='timestamp',
+        timeout=300):
+    # Start the consumers first, shared-memory components are forked before this process starts any thread
+    transport, pids = start_components(transport_name, workers, grid_model)
+
+    # The consumers log their own progress, so only the results of the master and the workers are collected here
+    expected = [num_items]
+    master_records, worker_records = {}, {}
+    collectors = []
+    for topic, records in [('grid_master_validate', master_records), ('grid_worker_validate', worker_records)]:
+        thread_lock = create_lock()
+        thread = Thread(target=collect, args=(transport, topic, expected, records, thread_lock), daemon=True)
+        thread.start()
+        collectors.append((thread, thread_lock))
+
+    try:
+        expected[0] = burst_feeder.run(num_items=num_items, num_threads=num_threads, dataset_path=dataset_path,
+                                       transport=transport)
+        deadline = time.time() + timeout
+        for thread, thread_lock in collectors:
+            thread.join(timeout=max(0.0, deadline - time.time()))
+            thread_lock.kill()
+    finally:
+        stop_components(transport, pids)
+
+    # Latency from the feeder to the master, uncorrected (from the send) and corrected (from the feeder's schedule),
+    # throughput over the whole run
+    # The worker forwards the feeder's send and intended time, so the master's records span the whole pipeline
+    done = list(master_records)
+    if not done:
+        log(f'NO RESULTS RECEIVED ({expected[0]} SENT)')
+        return {}
+    latencies = create_latency_tracker()
+    for msg_id in done:
+        latencies.add(master_records[msg_id]['timestamps'])
+    sent = np.array([master_records[msg_id]['timestamps']['start_time'] for msg_id in done], dtype=np.float64)
+    received = np.array([master_records[msg_id]['timestamps']['end_time'] for msg_id in done], dtype=np.float64)
+    seconds = (received.max() - sent.min()) / 1000
+    summary = latencies.summary()
+    results = {
+        'transport': transport_name,
+        'workers': workers,
+        'sent': expected[0],
+        'completed': len(done),
+        'frames_per_second': float(len(done) / seconds) if seconds > 0 else float('nan'),
+        'latency_p50_ms': summary['uncorrected']['p50_ms'],
+        'latency_p99_ms': summary['uncorrected']['p99_ms'],
+        'corrected_latency_p50_ms': summary['corrected']['p50_ms'],
+        'corrected_latency_p99_ms': summary['corrected']['p99_ms'],
+    }
+    log(f'LOCAL PIPELINE RESULTS: {results}')
+    log(latencies.report())
+    return results
+
+
+if __name__ == '__main__':
+    py_args = parser.parse_args()
+    run(py_args.dataset, py_args.transport, py_args.num_items, py_args.num_threads, py_args.workers,
+        py_args.grid_model, py_args.timeout)
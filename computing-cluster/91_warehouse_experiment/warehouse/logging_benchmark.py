@@ -0,0 +1,78 @@
+"""
+Caller-side cost of the logging modes, as seen by a per-message hot path.
+
+Each mode logs the same per-message line (an id, a queue time and a size) many times from one call site, and the time
+spent inside every call is measured. 'log' is utils.misc.log, the other modes are utils.misc.create_async_logger. The
+output and the logging file handler go to --output (default /dev/null), so the terminal does not dominate, but the
+writes still happen. 'flushed' is the time until the background thread has printed everything, i.e. how long the
+output lags behind.
+
+python3 logging_benchmark.py --calls 100000 --output /dev/null
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+
+from utils.misc import create_async_logger, log
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--calls", type=int, default=100000, help="Log calls per mode. Default: 100000.")
+parser.add_argument("--output", type=str, default="/dev/null", help="Where the log lines are written.")
+
+MODES = {
+    'log': None,
+    'sync': dict(mode='sync'),
+    'async': dict(mode='async', max_queue=1000000),
+    'async 1/100': dict(mode='async', sample_every=100),
+    'async 10/s': dict(mode='async', max_per_second=10),
+    'off': dict(mode='off'),
+}
+
+
+def measure(mode, calls):
+    """ Returns (nanoseconds per call for every call, seconds until the output was flushed). """
+    if MODES[mode] is None:
+        def call(i):
+            log(f"Message {i} received! Queue_time: {12.5} ms, size {65536} bytes.")
+    else:
+        logger = create_async_logger(**MODES[mode])
+
+        def call(i):
+            logger("Message received", id=i, queue_ms=12.5, bytes=65536)
+
+    durations = np.empty(calls, dtype=np.int64)
+    t1 = time.perf_counter()
+    for i in range(calls):
+        start = time.perf_counter_ns()
+        call(i)
+        durations[i] = time.perf_counter_ns() - start
+    if MODES[mode] is not None:
+        logger.flush()
+    return durations, time.perf_counter() - t1
+
+
+def run(calls=100000, output='/dev/null'):
+    logging.basicConfig(filename=output, level=logging.DEBUG)  # The consumers also log to a file
+    results = {}
+    stdout = sys.stdout
+    with open(output, 'w') as sink:
+        for mode in MODES:
+            sys.stdout = sink
+            try:
+                durations, flushed = measure(mode, calls)
+            finally:
+                sys.stdout = stdout
+            results[mode] = durations
+            print(f"{mode:>12}: mean {durations.mean() / 1000:7.2f} us, p50 {np.percentile(durations, 50) / 1000:7.2f} us, "
+                  f"p99 {np.percentile(durations, 99) / 1000:7.2f} us, max {durations.max() / 1000:9.1f} us, "
+                  f"flushed after {flushed:6.2f} s")
+    return results
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    run(py_args.calls, py_args.output)
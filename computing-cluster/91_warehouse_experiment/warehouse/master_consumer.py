@@ -7,33 +7,63 @@ import matplotlib.pyplot as plt
 
 from utils.grid_visualize import GridVisualizer
 from utils.grid import OccupancyGrid
-from utils.kafka_utils import create_consumer, create_producer
-from utils.misc import custom_serializer, log, create_lock
+from utils.log_odds_grid import LogOddsGrid
+from utils.voxel_map import VoxelMap
+from utils.kafka_utils import create_metrics_exporter
+from utils.misc import custom_serializer, hot_log, log, create_lock, mark_ready, mark_unready
+from utils.transport import create_kafka_transport
 
 errors = 0
 
+# Cell models selectable with GRID_MODEL (the workers must use the same model)
+GRID_MODELS = {
+    'timestamp': OccupancyGrid,
+    'log_odds': LogOddsGrid,
+    'voxel': VoxelMap,
+}
 
-def run():
+
+def run(transport=None):
+    """ transport: where messages come from and go to, Kafka (KAFKA_SERVERS) by default. """
     args = {
         'validate_results': os.environ.get('VALIDATE_RESULTS', 'TRUE') == 'TRUE',
         'kafka_input': os.environ.get('KAFKA_INPUT_TOPIC', 'grid_master_input'),
         'kafka_validate': os.environ.get('KAFKA_VALIDATE_TOPIC', 'grid_master_validate'),
         'kafka_servers': os.environ.get('KAFKA_SERVERS', 'localhost:10001,localhost:10002,localhost:10003'),
         'VERBOSE': os.environ.get('VERBOSE', 'FALSE') == 'TRUE',
+        'producer_mode': os.environ.get('PRODUCER_MODE', 'default'),  # 'batch' for the batching producer
+        'commit_mode': os.environ.get('COMMIT_MODE', 'eager'),  # 'batched' commits processed offsets in batches
+        'assignment': os.environ.get('ASSIGNMENT', 'eager'),  # 'cooperative' rebalances without pausing the group
+        'instance_id': os.environ.get('POD_NAME'),  # Static group membership, set from the pod name
+        'metrics_port': int(os.environ.get('METRICS_PORT', '0')),  # Prometheus lag/throughput endpoint, 0 disables
+        'log_mode': os.environ.get('LOG_MODE', 'async'),  # Per-message logs: 'async', 'sync' or 'off'
+        'log_sample_every': int(os.environ.get('LOG_SAMPLE_EVERY', '1')),  # Log 1 in N per call site
+        'log_max_per_second': float(os.environ.get('LOG_MAX_PER_SECOND', '0')),  # Per call site, 0 is unlimited
         'visualize': os.environ.get('VISUALIZE', 'TRUE') == 'TRUE',
+        'grid_model': os.environ.get('GRID_MODEL', 'timestamp'),
+        'batch_size': int(os.environ.get('BATCH_SIZE', '1')),  # Messages per consume() call, 1 polls one by one
     }
 
     logging.basicConfig(filename='gird_master_log.log', level=logging.DEBUG)
+    hot_log.configure(args['log_mode'], args['log_sample_every'], args['log_max_per_second'])
     log(args)
 
-    kafka_consumer = create_consumer(args['kafka_input'], kafka_servers=args['kafka_servers'])
-    kafka_producer = create_producer(kafka_servers=args['kafka_servers'])
+    if transport is None:
+        transport = create_kafka_transport(args['kafka_servers'])
+    kafka_consumer = transport.consumer(args['kafka_input'], commit_mode=args['commit_mode'],
+                                        assignment=args['assignment'], instance_id=args['instance_id'],
+                                        on_assigned=lambda partitions: mark_ready(), on_unassigned=mark_unready)
+    kafka_producer = transport.producer(args['producer_mode'])
 
     # Check that Kafka is working
     if not kafka_producer.connected() or not kafka_consumer.connected():
         log(f'Could not connect Kafka producer or consumer!')
         return
 
+    # Export the queue depth and throughput of the consumer
+    if args['metrics_port'] > 0:
+        create_metrics_exporter(kafka_consumer, port=args['metrics_port'])
+
     # Track which machine (pod) is doing the processing
     hostname = socket.gethostname()
     ip_addr = socket.gethostbyname(hostname)
@@ -43,20 +73,23 @@ def run():
     thread_lock = create_lock()
 
     # Setup application
-    grid = OccupancyGrid()
+    grid = GRID_MODELS[args['grid_model']]()
     visualizer = GridVisualizer()
 
-    def process_event(data_bytes, msg_key, time_received, time_sent):
+    def process_event(data_bytes, msg_key, time_received, time_sent, time_intended, time_origin):
         global errors
         nonlocal idle_timer
-        queue_time = time_received - time_sent  # How long was the message waiting in queue?
+        queue_time = time_received - time_sent  # How long was the message waiting in queue (since the worker sent it)?
         msg_id = msg_key.decode('utf-8')
 
         if args['VERBOSE']:
-            log(f"Message {msg_id} received! Queue_time: {queue_time} ms, size {len(data_bytes)} bytes.")
+            hot_log("Message received", id=msg_id, queue_ms=queue_time, bytes=len(data_bytes))
         t_idle = (time.time() - idle_timer) * 1000
         t1 = time.time()
-        grid.update_from_bytes(data_bytes, check_timestamp=True)
+        if isinstance(grid, OccupancyGrid):
+            grid.update_from_bytes(data_bytes, check_timestamp=True)
+        else:
+            grid.update_from_bytes(data_bytes)  # Additive merge, message order does not matter
         t_inf = (time.time() - t1) * 1000
 
         # Postprocessing
@@ -76,24 +109,81 @@ def run():
                     'inf': t_inf,
                     'post': 0.0,  # No postprocessing
                     'queue': queue_time,
-                    'start_time': time_sent,
+                    'queue_corrected': queue_time + time_origin - time_intended,  # Plus the feeder's lateness
+                    'start_time': time_origin,  # Send time of the feeder, forwarded by the worker
+                    'intended_time': time_intended,  # Intended send time of the feeder, forwarded by the worker
                     'end_time': time_received
                 },
                 'id': msg_id,
                 'errors': errors,
                 'source': ip_addr,
+                'batch_size': 1,
             }))
         # log("Errors:", errors)
 
+    def process_batch(batch, time_received):
+        global errors
+        nonlocal idle_timer
+
+        if args['VERBOSE']:
+            hot_log("Batch received", size=len(batch))
+        t_idle = (time.time() - idle_timer) * 1000
+        t1 = time.time()
+        if isinstance(grid, OccupancyGrid):
+            for data_bytes, _, _, _, _ in batch:
+                grid.update_from_bytes(data_bytes, check_timestamp=True)
+        else:
+            grid.update_from_bytes_batch([data_bytes for data_bytes, _, _, _, _ in batch])  # One vectorized merge
+        t_inf = (time.time() - t1) * 1000
+
+        # Postprocessing: visualize at most once per batch
+        msg_ids = [msg_key.decode('utf-8') for _, msg_key, _, _, _ in batch]
+        visualized_ids = [msg_id for msg_id in msg_ids if int(msg_id) % 10 == 0]
+        if args['visualize'] and visualized_ids:
+            visualizer.visualize_grid(grid, animate=False)
+            os.makedirs("visualizations", exist_ok=True)
+            plt.savefig(f"visualizations/grid_update_{visualized_ids[-1]}.png")
+            log(f"Saved visualization for message {visualized_ids[-1]}")
+        idle_timer = time.time()  # Do not count pushing results to idle timer
+
+        # Every message gets a record with the timings of its whole batch
+        if args['validate_results']:
+            for msg_id, (_, _, time_sent, time_intended, time_origin) in zip(msg_ids, batch):
+                kafka_producer.push_msg(args['kafka_validate'], custom_serializer({
+                    'timestamps': {
+                        'idle': t_idle,  # Time spent waiting for next batch
+                        'pre': 0.0,  # No preprocessing
+                        'inf': t_inf,
+                        'post': 0.0,  # No postprocessing
+                        'queue': time_received - time_sent,
+                        'queue_corrected': time_received - time_sent + time_origin - time_intended,
+                        'start_time': time_origin,
+                        'intended_time': time_intended,
+                        'end_time': time_received
+                    },
+                    'id': msg_id,
+                    'errors': errors,
+                    'source': ip_addr,
+                    'batch_size': len(batch),
+                }))
+
     # Create & start worker threads
     try:
-        kafka_consumer.poll_next(1, thread_lock, process_event)
+        if args['batch_size'] > 1:
+            kafka_consumer.poll_batch(1, thread_lock, process_batch, batch_size=args['batch_size'], intended=True,
+                                      origin=True)
+        else:
+            kafka_consumer.poll_next(1, thread_lock, process_event, intended=True, origin=True)
     except KeyboardInterrupt:
         thread_lock.kill()
         log('Worker manually killed.', True)
     except Exception as e:
         log(f'Exception: {e}', True)
         log(e)
+    finally:
+        kafka_producer.close()  # Deliver the queued results before exiting
+        kafka_consumer.close()  # Commit the processed offsets before leaving the group
 
 
-run()
+if __name__ == "__main__":
+    run()
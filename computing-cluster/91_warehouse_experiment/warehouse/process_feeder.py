@@ -0,0 +1,281 @@
+import argparse
+import csv
+import multiprocessing
+import queue
+import time
+from threading import BrokenBarrierError
+
+from .utils.claim_check import create_local_blob_store
+from .utils.frame_buffer import create_shared_frame_buffer, first_frame, load_frame_buffer
+from .utils.misc import resource_exists, log
+from .utils.packed_dataset import is_packed_dataset
+from .utils.rate_scheduler import create_rate_scheduler
+from .utils.transport import create_kafka_transport
+from .utils.workload_profiles import parse_profile, step_rate
+
+"""
+Process feeder: Send at a global target rate from several processes instead of threads.
+
+The threaded feeders share one interpreter, so serialization and the produce path of all threads contend for the GIL.
+Here every process has its own interpreter and Kafka producer and sends 1/n of the target rate from one copy of the
+dataset: an HDF5 dataset is serialized once into shared memory, a packed dataset is mapped by every process from the
+page cache. The processes start together at a common timestamp, and the achieved msgs/s and MB/s are reported per
+process count.
+"""
+
+# python3 -m warehouse.process_feeder --processes 1 2 4 8 --rate 0 --duration 30 --output process_feeder.csv
+
+# The message ids of every run of a sweep start at a multiple of this, so the QoS records of the runs do not mix
+MSG_IDS_PER_RUN = 10 ** 9
+
+# Parse Python arguments
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-p",
+    "--processes",
+    type=int,
+    nargs="+",
+    default=[1, 2, 4],
+    help="Process counts to run, one after the other. Default: 1 2 4."
+)
+parser.add_argument(
+    "-r",
+    "--rate",
+    type=float,
+    default=0,
+    help="Global target rate in messages per second, split across the processes. 0 sends as fast as possible."
+)
+parser.add_argument(
+    "-d",
+    "--duration",
+    type=int,
+    default=30,
+    help="Seconds per process count. Default: 30."
+)
+parser.add_argument("--dataset", type=str, default="datasets/robots-4_points-5000.hdf5")
+parser.add_argument("--kafka_servers", type=str, default="localhost:10001")
+parser.add_argument("--poisson", action="store_true", help="Exponential gaps between the sends of each process.")
+parser.add_argument("--producer_mode", type=str, default="batch", choices=["default", "batch"],
+                    help="Producer of every process, see PRODUCER_MODE. Default: batch.")
+parser.add_argument("--output", type=str, default=None, help="CSV file for the results of every process count.")
+parser.add_argument("--profile", type=str, default=None,
+                    help="Workload profile over the duration, as scales of --rate (see utils/workload_profiles.py).")
+
+
+def process_work(nth_process, num_processes, frame_buffer, transport, producer_mode, blob_store, target_rate,
+                 duration_seconds, poisson, msg_id_offset, ready, go, shared_start, results):
+    """ Send 1/num_processes of the target rate from the sensor of this process, then report the counts. """
+    num_sensors = frame_buffer.n_sensors
+    sensor_frames = frame_buffer.sensor(nth_process % num_sensors)
+    producer = transport.producer(mode=producer_mode, blob_store=blob_store)
+
+    # A process that cannot send breaks the barrier, so the others do not wait for it
+    if not producer.connected():
+        log(f'PROCESS {nth_process}: KAFKA PRODUCER NOT CONNECTED! ABORTING...')
+        ready.abort()
+        return
+
+    # Wait for the other processes, then start together at the timestamp set by the parent
+    try:
+        ready.wait()
+    except BrokenBarrierError:
+        return
+    go.wait()
+    if isinstance(target_rate, (list, tuple)):
+        # [seconds since the start, rate] steps that hold until the next step, e.g. from a workload profile
+        step_starts = [step[0] for step in target_rate]
+        step_rates = [step[1] for step in target_rate]
+
+        def interval(seconds_since_start):
+            rate = step_rate(step_starts, step_rates, seconds_since_start)
+            return num_processes / rate if rate > 0 else 0.0
+
+        # A step without load is a pause: the sends resume at the next step with load, at a fixed time that the
+        # Poisson gaps do not move
+        def pause(seconds_since_start):
+            if step_rate(step_starts, step_rates, seconds_since_start) > 0:
+                return None
+            later = [step_start for step_start, rate in target_rate if step_start > seconds_since_start and rate > 0]
+            return later[0] if later else duration_seconds
+    else:
+        interval = num_processes / target_rate if target_rate > 0 else None
+        pause = None
+    scheduler = create_rate_scheduler(1, interval, poisson=poisson, duration=duration_seconds, seed=nth_process,
+                                      start_at=shared_start.value, pause=pause)
+    pacer = scheduler.join(nth_process)
+
+    index = nth_process * 7919  # The processes of one sensor start from different frames
+    sent, sent_bytes = 0, 0
+    while pacer.wait():
+        payload = sensor_frames[index % len(sensor_frames)]
+
+        # Message ids are unique across the processes: process n sends n - 1, n - 1 + num_processes, ...
+        msg_id = msg_id_offset + sent * num_processes + nth_process - 1
+        producer.push_msg('grid_worker_input', payload, key=str(msg_id).encode('utf-8'), intended=pacer.due)
+        sent += 1
+        sent_bytes += len(payload)
+        index += 1
+
+    undelivered = producer.close()
+    summary = scheduler.summary()
+    summary.update({'process': nth_process, 'bytes': sent_bytes, 'undelivered': undelivered or 0})
+    results.put(summary)
+
+
+def run(target_rate=0, num_processes=4, duration_seconds=30,
+        kafka_servers="localhost:10001",
+        dataset_path="../robots-4/points-per-frame-5000.hdf5",
+        blob_dir=None,
+        poisson=False,
+        producer_mode='batch',
+        transport=None,
+        start_delay=3,
+        start_at=None,
+        msg_id_offset=0):
+    """
+    Send for duration_seconds from num_processes processes and return the achieved rates (msgs/s and MB/s).
+    target_rate is in messages per second, or a list of [seconds since the start, rate] steps (a rate of 0 pauses).
+    The processes start start_delay seconds after they are ready, or at the absolute timestamp start_at.
+    The transport must work across forked processes: Kafka (default) or utils.transport.create_shm_transport.
+    """
+    if not resource_exists(dataset_path):
+        return {}
+
+    # Payloads above the claim-check threshold are written to blob_dir, only their references go through Kafka
+    blob_store = create_local_blob_store(blob_dir) if blob_dir else None
+
+    # Kafka unless another transport is given. The producers are created in the processes, after the fork
+    if transport is None:
+        transport = create_kafka_transport(kafka_servers)
+
+    # One copy of the dataset for every process: packed datasets are already shared through the page cache
+    frame_buffer = load_frame_buffer(dataset_path, num_processes)
+    if not is_packed_dataset(dataset_path):
+        frame_buffer = create_shared_frame_buffer(frame_buffer)
+    bytes_per_frame = first_frame(frame_buffer).data.nbytes
+
+    # The processes inherit the dataset, the transport and the synchronization primitives
+    context = multiprocessing.get_context('fork')
+    ready = context.Barrier(num_processes + 1)
+    go = context.Event()
+    shared_start = context.Value('d', 0.0)
+    results = context.Queue()
+
+    processes = []
+    try:
+        log(f'CREATING FEEDER PROCESS POOL ({num_processes})')
+        for nth in range(num_processes):
+            process = context.Process(target=process_work, args=(
+                nth + 1, num_processes, frame_buffer, transport, producer_mode, blob_store, target_rate,
+                duration_seconds, poisson, msg_id_offset, ready, go, shared_start, results))
+            process.start()
+            processes.append(process)
+
+        # Every process has its producer, so the common start can be set
+        try:
+            ready.wait()
+        except BrokenBarrierError:
+            log('A FEEDER PROCESS FAILED TO START, ABORTING...')
+            return {}
+        if start_at is None:
+            start_at = time.time() + start_delay
+        elif start_at < time.time():
+            log(f'THE START TIME PASSED {time.time() - start_at:.2f} SECONDS AGO, THE FIRST SENDS WILL BE LATE')
+        shared_start.value = start_at
+        go.set()
+
+        # Every process reports once, after its last send and the flush of its producer
+        try:
+            timeout = max(0.0, start_at - time.time()) + duration_seconds + 60
+            reports = [results.get(timeout=timeout) for _ in range(num_processes)]
+        except queue.Empty:
+            log('A FEEDER PROCESS DID NOT REPORT, ABORTING...')
+            return {}
+        for process in processes:
+            process.join()
+
+    except KeyboardInterrupt:
+        log('FEEDER PROCESSES MANUALLY KILLED..', True)
+        return {}
+
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        if not is_packed_dataset(dataset_path):
+            frame_buffer.close()
+
+    # The slowest process decides how long the run took
+    sent = sum(report['sent'] for report in reports)
+    sent_bytes = sum(report['bytes'] for report in reports)
+    seconds = max(report.get('seconds', 0.0) for report in reports)
+    results = {
+        'processes': num_processes,
+        'target_per_second': target_rate,
+        'sent': sent,
+        'seconds': seconds,
+        'msgs_per_second': sent / seconds if seconds > 0 else 0.0,
+        'mb_per_second': sent_bytes / (1024 * 1024) / seconds if seconds > 0 else 0.0,
+        'frame_bytes': bytes_per_frame,
+        'lateness_p99_ms': max((report.get('lateness_p99_ms', 0.0) for report in reports), default=0.0),
+        'undelivered': sum(report['undelivered'] for report in reports),
+    }
+    log(f'PROCESS FEEDER RESULTS: {results}')
+    return results
+
+
+def spawned_run(results, options):
+    """ Entry point of the process started by run_spawned(). """
+    results.put(run(**options))
+
+
+def run_spawned(**options):
+    """
+    run() in a spawned process, for callers whose Kafka clients already run librdkafka threads, which a fork would copy
+    in an undefined state. The spawned interpreter forks the feeder processes before it creates any client.
+    The transport is pickled: Kafka works, the local transports can only be inherited by a fork and need run().
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    feeder = context.Process(target=spawned_run, args=(results, options))
+    feeder.start()
+    start_at = options.get('start_at')
+    start = max(0.0, start_at - time.time()) if start_at is not None else options.get('start_delay', 3)
+    try:
+        return results.get(timeout=start + options.get('duration_seconds', 30) + 120)
+    except queue.Empty:
+        log('THE SPAWNED FEEDER DID NOT REPORT')
+        return {}
+    finally:
+        feeder.join(timeout=10)
+        if feeder.is_alive():
+            feeder.terminate()
+
+
+def run_sweep(process_counts, output=None, msg_id_offset=0, **options):
+    """ Run the feeder once per process count and print the achieved rates against the process count. """
+    all_results = [run(num_processes=num_processes, msg_id_offset=msg_id_offset + nth * MSG_IDS_PER_RUN, **options)
+                   for nth, num_processes in enumerate(process_counts)]
+    all_results = [results for results in all_results if results]
+
+    log(f'{"PROCESSES":>10} {"MSGS/S":>10} {"MB/S":>10} {"P99 LATE (ms)":>14}')
+    for results in all_results:
+        log(f'{results["processes"]:>10} {results["msgs_per_second"]:>10.1f} {results["mb_per_second"]:>10.2f} '
+            f'{results["lateness_p99_ms"]:>14.1f}')
+
+    if output and all_results:
+        with open(output, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(all_results[0]))
+            writer.writeheader()
+            writer.writerows(all_results)
+    return all_results
+
+
+if __name__ == '__main__':
+    py_args = parser.parse_args()
+    rate = py_args.rate
+    if py_args.profile:
+        rate = parse_profile(py_args.profile).compile(py_args.duration).steps(py_args.rate)
+    run_sweep(py_args.processes, output=py_args.output, target_rate=rate, duration_seconds=py_args.duration,
+              kafka_servers=py_args.kafka_servers, dataset_path=py_args.dataset, poisson=py_args.poisson,
+              producer_mode=py_args.producer_mode)
@@ -0,0 +1,124 @@
+"""
+Worker throughput of the one-process consumer versus the multi-process consumer runtime.
+
+Replays dataset frames, serialized like the feeder sends them, through the worker computation: once in a single
+loop, as the one-process consumer does, and then through process pools of increasing size. The messages are routed
+like poll_processes routes the messages of a worker pod that owns a single partition: by message key (ORDER_BY=key),
+or all to one process (ORDER_BY=partition). Reports messages per second and per core, and checks that the offset
+manager never stored an offset past an unfinished message. No Kafka is needed, so the numbers show the ceiling of
+the runtime itself.
+
+python3 runtime_benchmark.py --dataset ../datasets/robots-4_points-5000.hdf5 --frames 100 --processes 1 2 4
+"""
+
+import argparse
+import os
+import time
+
+from utils.consumer_runtime import create_process_pool
+from utils.kafka_utils import create_offset_manager
+from utils.lidar_dataset_reader import load_to_memory
+from utils.lidar_frame import LidarFrame
+from utils.worker_functions import local_to_world_space, process_point_cloud, process_point_cloud_log_odds, \
+    process_point_cloud_voxels
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, default="../datasets/robots-4_points-5000.hdf5")
+parser.add_argument("--frames", type=int, default=100, help="Frames per sensor. Default: 100.")
+parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="Pool sizes. Default: 1 2 4.")
+parser.add_argument("--grid_model", type=str, default="timestamp", choices=["timestamp", "log_odds", "voxel"])
+parser.add_argument("--max_in_flight", type=int, default=None, help="Default: 4 per process.")
+parser.add_argument("--order_by", type=str, default="key", choices=["key", "partition"],
+                    help="Routing of the single partition, see ORDER_BY. Default: key.")
+
+GRID_MODELS = {
+    'timestamp': process_point_cloud,
+    'log_odds': process_point_cloud_log_odds,
+    'voxel': process_point_cloud_voxels,
+}
+
+
+def make_handler(process_frame):
+    """ The part of worker_consumer.py that runs in the pool processes. """
+
+    def handler(data_bytes, msg_key):
+        frame = LidarFrame.from_bytes(data_bytes)
+        world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+        update_bytes = process_frame(world_space_lidar, frame.position).to_bytes()
+        return msg_key, len(update_bytes)
+
+    return handler
+
+
+def load_messages(dataset_path, frames_per_sensor):
+    """
+    Interleave the frames of all sensors, like in a live feed. Returns a list of (bytes, key): the n-th message is at
+    offset n of the partition and has the message id n as its key, like the feeders send it.
+    """
+    all_sensor_data = load_to_memory(dataset_path)
+    n_frames = min(frames_per_sensor, min(len(sensor_frames) for sensor_frames in all_sensor_data))
+    frames = [sensor_frames[index] for index in range(n_frames) for sensor_frames in all_sensor_data]
+    return [(frame.to_bytes(), str(msg_id).encode('utf-8')) for msg_id, frame in enumerate(frames)]
+
+
+def run_single(handler, messages):
+    t1 = time.perf_counter()
+    for message in messages:
+        handler(*message)
+    return len(messages) / (time.perf_counter() - t1)
+
+
+def run_pool(handler, messages, num_processes, max_in_flight=None, order_by='key'):
+    """ Returns (messages/s, True if no offset was stored past an unfinished message and all were committed). """
+    offsets = create_offset_manager(None, commit_every=float('inf'), commit_interval=float('inf'))
+    unfinished = set()
+    safe = True
+
+    def on_result(meta, result):
+        nonlocal safe
+        offset = meta
+        unfinished.remove(offset)
+        offsets.store_offset('benchmark', 0, offset)
+        stored, _ = offsets.stored.get(('benchmark', 0), (0, 0))
+        safe = safe and not any(pending < stored for pending in unfinished)
+
+    pool = create_process_pool(handler, num_processes, max_in_flight, on_result)
+    try:
+        t1 = time.perf_counter()
+        for offset, message in enumerate(messages):
+            offsets.begin('benchmark', 0, offset)
+            unfinished.add(offset)
+            pool.submit(message[1] if order_by == 'key' else 0, message, meta=offset)
+        pool.drain()
+        messages_per_second = len(messages) / (time.perf_counter() - t1)
+    finally:
+        pool.close()
+    committed = offsets.stored.get(('benchmark', 0), (0, 0))[0] == len(messages)
+    return messages_per_second, safe and committed and pool.errors == 0
+
+
+def run(dataset_path, frames_per_sensor=100, process_counts=(1, 2, 4), grid_model='timestamp', max_in_flight=None,
+        order_by='key'):
+    messages = load_messages(dataset_path, frames_per_sensor)
+    handler = make_handler(GRID_MODELS[grid_model])
+    handler(*messages[0])  # Compile the numba functions before forking, so no process pays for it
+
+    cores = os.cpu_count()
+    single = run_single(handler, messages)
+    print(f"{len(messages)} messages on one partition, routed by {order_by}, {cores} cores")
+    print(f"{'runtime':>12} {'messages/s':>11} {'per core':>9} {'speedup':>8} {'offsets':>9}")
+    print(f"{'single':>12} {single:>11.1f} {single:>9.1f} {1.0:>8.2f} {'ok':>9}")
+    results = {'single': single}
+    for num_processes in process_counts:
+        messages_per_second, offsets_ok = run_pool(handler, messages, num_processes, max_in_flight, order_by)
+        results[num_processes] = messages_per_second
+        per_core = messages_per_second / min(num_processes, cores)
+        print(f"{f'{num_processes} procs':>12} {messages_per_second:>11.1f} {per_core:>9.1f} "
+              f"{messages_per_second / single:>8.2f} {'ok' if offsets_ok else 'WRONG':>9}")
+    return results
+
+
+if __name__ == "__main__":
+    py_args = parser.parse_args()
+    run(py_args.dataset, py_args.frames, py_args.processes, py_args.grid_model, py_args.max_in_flight,
+        py_args.order_by)
@@ -0,0 +1,216 @@
+import argparse
+import itertools
+import time
+from threading import Thread
+
+from .utils.arrival_trace import load_trace
+from .utils.claim_check import create_local_blob_store
+from .utils.frame_buffer import first_frame, load_frame_buffer
+from .utils.misc import resource_exists, log, create_lock
+from .utils.rate_scheduler import create_rate_scheduler
+from .utils.transport import create_kafka_transport
+
+"""
+Trace Feeder: Replays the arrival times of a recorded workload instead of a synthetic rate curve.
+"""
+
+# python3 -m warehouse.utils.arrival_trace qos_outputs/<run>/worker_*.csv --output traces/run.csv
+# python3 -m warehouse.trace_feeder --trace traces/run.csv --speed 2 --num_threads 4
+
+# Initialize argument parser to get runtime configuration
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--trace",
+    type=str,
+    required=True,
+    help="Arrival trace (CSV or Parquet) with a timestamp column, and optional key and size columns."
+)
+parser.add_argument(
+    "-s", "--speed",
+    type=float,
+    default=1.0,
+    help="Replay speed: 2 sends the trace in half the time at twice the rate (default: 1)."
+)
+parser.add_argument(
+    "-d", "--duration",
+    type=int,
+    default=None,
+    help="Stop after this many seconds (default: the whole trace)."
+)
+parser.add_argument(
+    "-t", "--num_threads",
+    type=int,
+    default=4,
+    help="Number of threads to use for data transmission (default: 4)."
+)
+parser.add_argument("--dataset", type=str, default="datasets/robots-4_points-5000.hdf5")
+parser.add_argument(
+    "--trace_keys",
+    action="store_true",
+    help="Send with the keys of the trace (same partitions as the recorded run) instead of new message ids."
+)
+parser.add_argument(
+    "--trace_sizes",
+    action="store_true",
+    help="Send zero-filled payloads of the trace sizes instead of frames (transport tests, workers cannot decode them)."
+)
+
+
+def run(
+        trace_path: str,
+        speed: float = 1.0,
+        msg_id_offset: int = 0,
+        num_threads: int = 4,
+        duration_seconds: int = None,
+        kafka_servers: str = "localhost:10001",
+        dataset_path: str = "../robots-4/points-per-frame-5000.hdf5",
+        blob_dir: str = None,
+        transport=None,
+        trace_keys: bool = False,
+        trace_sizes: bool = False
+) -> int:
+    """
+    Replays an arrival trace, streaming data to Kafka topics using multiple threads.
+
+    Args:
+        trace_path (str): Arrival trace (utils/arrival_trace.py), e.g. derived from the QoS outputs of a past run.
+        speed (float): Replay speed, the gaps between the arrivals are divided by it.
+        msg_id_offset (int): First message ID, when trace_keys is off.
+        num_threads (int): Number of threads for parallel data transmission, arrival i is sent by thread i % n.
+        duration_seconds (int): Optional limit in seconds, the whole trace is replayed by default.
+        kafka_servers (str): Kafka server connection string.
+        dataset_path (str): Path to the HDF5 (or packed) dataset to stream.
+        blob_dir (str): Optional claim-check directory shared with the workers, for payloads too large for Kafka.
+        transport: Optional transport from utils.transport (e.g. shared memory). Default: Kafka at kafka_servers.
+        trace_keys (bool): Use the keys of the trace as message keys, if the trace has them.
+        trace_sizes (bool): Send zero-filled payloads of the trace sizes, if the trace has them.
+
+    Returns:
+        int: Number of messages sent.
+    """
+    # Generate unique IDs for each message
+    msg_count = itertools.count()
+
+    # Ensure the trace and the HDF5 dataset exist
+    if not resource_exists(trace_path) or not resource_exists(dataset_path):
+        log(f"Trace {trace_path} or dataset {dataset_path} not found. Aborting.")
+        return 0
+
+    trace = load_trace(trace_path).scaled(speed)
+    if trace_keys and trace.keys is None:
+        log(f"Trace {trace_path} has no keys, sending new message ids.")
+        trace_keys = False
+    if trace_sizes and trace.sizes is None:
+        log(f"Trace {trace_path} has no sizes, sending frames.")
+        trace_sizes = False
+    log(f"Replaying {len(trace)} arrivals over {trace.duration:.1f} seconds (~{trace.mean_rate:.1f} msgs/s).")
+
+    # Create a lock for thread control
+    alive_lock = create_lock()
+
+    # List to track threads and Kafka producers
+    threads = []
+    kafka_producers = []
+
+    # Payloads above the claim-check threshold are written to blob_dir, only their references go through Kafka
+    blob_store = create_local_blob_store(blob_dir) if blob_dir else None
+
+    # Kafka unless another transport (e.g. shared memory for a broker-free benchmark) is given
+    if transport is None:
+        transport = create_kafka_transport(kafka_servers)
+
+    # Initialize Kafka producers for each thread
+    for _ in range(num_threads):
+        kafka_producer = transport.producer(blob_store=blob_store)
+        kafka_producers.append(kafka_producer)
+
+    # Verify all Kafka connections are active
+    for i, producer in enumerate(kafka_producers):
+        if not producer.connected():
+            log(f"Kafka producer #{i} not connected. Aborting.")
+            return 0
+
+    # Load the dataset. A packed dataset (utils/packed_dataset.py) is memory-mapped, an HDF5 dataset is serialized once
+    frame_buffer = load_frame_buffer(dataset_path, num_threads)
+    num_sensors = frame_buffer.n_sensors
+    bytes_per_frame = first_frame(frame_buffer).data.nbytes
+
+    # Sized payloads are read-only slices of one zero-filled buffer, like the frames
+    zeros = memoryview(bytes(int(trace.sizes.max()))) if trace_sizes else None
+    sent_bytes = [0] * num_threads
+
+    # Thread worker function
+    def thread_work(nth_thread: int, alive_signal: create_lock) -> None:
+        """
+        Sends the arrivals nth_thread - 1, nth_thread - 1 + num_threads, ... of the trace at their recorded offsets.
+
+        Args:
+            nth_thread (int): Index of the current thread.
+            alive_signal (create_lock): Signal to manage thread lifecycle.
+        """
+        sensor_index = nth_thread % num_sensors
+        sensor_frames = frame_buffer.sensor(sensor_index)
+        producer = kafka_producers[nth_thread - 1]
+        log(f"Thread {nth_thread} sending data from sensor {sensor_index}.")
+
+        # Wait for the other threads, then start together
+        pacer = scheduler.join(nth_thread)
+
+        for index, arrival in enumerate(range(nth_thread - 1, len(trace), num_threads)):
+            if not pacer.wait_until(trace.offsets[arrival], alive_signal):
+                break
+            payload = zeros[:trace.sizes[arrival]] if trace_sizes else sensor_frames[index % len(sensor_frames)]
+            key = trace.keys[arrival] if trace_keys else str(next(msg_count) + msg_id_offset)
+            producer.push_msg('grid_worker_input', payload, key=key.encode('utf-8'), intended=pacer.due)
+            sent_bytes[nth_thread - 1] += len(payload)
+
+        if not alive_signal.is_active():
+            log(f"Thread {nth_thread} terminated.")
+            return
+        log(f"Thread {nth_thread} completed.")
+
+    try:
+        # The threads start together, a short delay after the last one is ready
+        scheduler = create_rate_scheduler(num_threads, duration=duration_seconds)
+        log(f"Starting {num_threads} producer threads.")
+
+        # Launch threads
+        for nth in range(num_threads):
+            thread = Thread(target=thread_work, args=(nth + 1, alive_lock))
+            threads.append(thread)
+            thread.start()
+
+        # Wait for all threads to finish
+        for thread in threads:
+            thread.join()
+
+        # Log experiment summary
+        duration = time.time() - scheduler.start
+        summary = scheduler.summary()
+        actual_mbps = sum(sent_bytes) / (1024 * 1024) / duration
+        log(f"Experiment completed. {summary['sent']} items sent in {duration:.2f} seconds (~{actual_mbps:.2f} MB/s, "
+            f"{bytes_per_frame} bytes per frame).")
+        log(f"Send schedule: {summary}")
+        return summary['sent']
+
+    except KeyboardInterrupt:
+        # Handle manual termination
+        alive_lock.kill()
+        log("Experiment terminated by user.")
+        for thread in threads:
+            thread.join()
+        return scheduler.summary()['sent']
+
+
+if __name__ == "__main__":
+    # Parse arguments and start the feeder
+    py_args = parser.parse_args()
+    run(
+        trace_path=py_args.trace,
+        speed=py_args.speed,
+        num_threads=py_args.num_threads,
+        duration_seconds=py_args.duration,
+        dataset_path=py_args.dataset,
+        trace_keys=py_args.trace_keys,
+        trace_sizes=py_args.trace_sizes
+    )
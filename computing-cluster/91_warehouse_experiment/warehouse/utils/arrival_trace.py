@@ -0,0 +1,158 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+# ARRIVAL TRACES: WHEN EVERY MESSAGE OF A RECORDED WORKLOAD WAS SENT, FOR REPLAYING REAL TRAFFIC SHAPES
+#   A TRACE IS A CSV OR PARQUET FILE WITH ONE ROW PER MESSAGE
+#     timestamp    SECONDS, ABSOLUTE OR RELATIVE: ONLY THE GAPS MATTER, THE REPLAY STARTS AT THE FIRST ARRIVAL
+#     key          OPTIONAL, THE MESSAGE KEY (E.G. THE RECORDED MESSAGE ID, WHICH ALSO DECIDES THE PARTITION)
+#     size         OPTIONAL, THE PAYLOAD SIZE IN BYTES
+#   THE QoS OUTPUTS OF THE EXPERIMENTS (master_*.csv, worker_*.csv, YOLO RESULT CSVs) RECORD THE KAFKA TIMESTAMP OF
+#   EVERY MESSAGE AS start_time (ms), SO derive_trace() TURNS A PAST RUN INTO A TRACE
+#   PARQUET NEEDS pyarrow (OR fastparquet) NEXT TO pandas
+
+TIMESTAMP_COLUMN = 'timestamp'
+KEY_COLUMN = 'key'
+SIZE_COLUMN = 'size'
+
+def is_parquet(path):
+    return path.endswith('.parquet') or path.endswith('.pq')
+
+def read_table(path):
+    return pd.read_parquet(path) if is_parquet(path) else pd.read_csv(path)
+
+def write_table(frame, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if is_parquet(path):
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+###################################################################################################
+###################################################################################################
+
+class create_arrival_trace:
+
+    # offsets: SECONDS SINCE THE FIRST ARRIVAL, SORTED. keys, sizes: PER ARRIVAL, OR None
+    def __init__(self, offsets, keys=None, sizes=None):
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+        self.keys = keys
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def duration(self):
+        return float(self.offsets[-1]) if len(self.offsets) else 0.0
+
+    # MEAN ARRIVALS PER SECOND OF THE WHOLE TRACE
+    @property
+    def mean_rate(self):
+        return len(self.offsets) / self.duration if self.duration > 0 else 0.0
+
+    # speed 2 REPLAYS THE TRACE IN HALF THE TIME, AT TWICE THE RATE, WITH THE SAME SHAPE
+    def scaled(self, speed):
+        return create_arrival_trace(self.offsets / speed, self.keys, self.sizes)
+
+    # ARRIVALS PER window SECONDS, E.G. TO COMPARE THE SHAPE OF A TRACE WITH THE RATE A RUN ACHIEVED
+    def rate_histogram(self, window=1.0):
+        n_windows = int(self.duration // window) + 1
+        counts = np.bincount((self.offsets // window).astype(np.int64), minlength=n_windows)
+        return counts / window
+
+# READ A TRACE WRITTEN BY derive_trace() OR BY HAND
+def load_trace(path):
+    frame = read_table(path)
+    if TIMESTAMP_COLUMN not in frame.columns:
+        raise ValueError(f'TRACE {path} HAS NO {TIMESTAMP_COLUMN} COLUMN (COLUMNS: {list(frame.columns)})')
+    frame = frame.dropna(subset=[TIMESTAMP_COLUMN]).sort_values(TIMESTAMP_COLUMN, kind='stable')
+    if frame.empty:
+        raise ValueError(f'TRACE {path} HAS NO ARRIVALS')
+
+    timestamps = frame[TIMESTAMP_COLUMN].to_numpy(dtype=np.float64)
+    keys = frame[KEY_COLUMN].astype(str).tolist() if KEY_COLUMN in frame.columns else None
+
+    # A SIZE COLUMN WITH GAPS (E.G. ROWS OF A QoS FILE WITHOUT SIZES) IS IGNORED RATHER THAN GUESSED
+    sizes = None
+    if SIZE_COLUMN in frame.columns and frame[SIZE_COLUMN].notna().all():
+        sizes = frame[SIZE_COLUMN].to_numpy(dtype=np.int64)
+    return create_arrival_trace(timestamps - timestamps[0], keys, sizes)
+
+###################################################################################################
+###################################################################################################
+
+# TURN QoS OUTPUTS INTO A TRACE
+#   sources: CSV/PARQUET FILES, DIRECTORIES (ALL *.csv IN THEM) OR GLOB PATTERNS, E.G. 'qos_outputs/run/worker_*.csv'
+#   column: THE SEND TIME OF EVERY MESSAGE. unit: 'ms', 's' OR 'auto' (EPOCH MILLISECONDS ARE ABOVE 1e11)
+#   key_column: ROWS WITH THE SAME KEY ARE ONE MESSAGE (THE MASTER AND THE WORKER BOTH RECORD EVERY MESSAGE)
+#   size_column: OPTIONAL PAYLOAD SIZES TO KEEP
+def derive_trace(sources, output_path, column='start_time', unit='auto', key_column='id', size_column=None):
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, '*.csv'))))
+        else:
+            paths.extend(sorted(glob.glob(source)) or [source])
+    if not paths:
+        raise ValueError(f'NO QoS FILES FOUND IN {sources}')
+
+    # FILES WITHOUT THE COLUMN (E.G. hpa.csv IN THE SAME DIRECTORY) ARE SKIPPED
+    frames = []
+    for path in paths:
+        frame = read_table(path)
+        if column in frame.columns:
+            frames.append(frame)
+    if not frames:
+        raise ValueError(f'NONE OF {paths} HAS A {column} COLUMN')
+    frame = pd.concat(frames, ignore_index=True)
+    frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    frame = frame.dropna(subset=[column]).sort_values(column, kind='stable')
+    if frame.empty:
+        raise ValueError(f'NO NUMERIC {column} VALUES IN {paths}')
+
+    # THE EARLIEST RECORD OF A MESSAGE IS ITS SEND BY THE FEEDER, THE MASTER RECORDS THE LATER SEND OF THE WORKER
+    if key_column and key_column in frame.columns:
+        frame = frame.drop_duplicates(subset=[key_column], keep='first')
+
+    # THE OFFSETS FROM THE FIRST RECORD ARE TAKEN IN THE UNIT OF THE COLUMN (EXACT FOR INTEGER EPOCH ms) AND ONLY THEN
+    # CONVERTED TO SECONDS, DIVIDING THE EPOCH TIMESTAMPS FIRST WOULD ROUND AWAY PART OF THEIR PRECISION
+    timestamps = frame[column].to_numpy()
+    if unit == 'auto':
+        unit = 'ms' if timestamps.max() > 1e11 else 's'
+    offsets = (timestamps - timestamps[0]).astype(np.float64)
+    if unit == 'ms':
+        offsets = offsets / 1000
+
+    trace = pd.DataFrame({TIMESTAMP_COLUMN: offsets})
+    if key_column and key_column in frame.columns:
+        trace[KEY_COLUMN] = frame[key_column].astype(str).to_numpy()
+    if size_column and size_column in frame.columns:
+        trace[SIZE_COLUMN] = frame[size_column].to_numpy()
+    write_table(trace, output_path)
+    return len(trace)
+
+###################################################################################################
+###################################################################################################
+
+# python3 -m warehouse.utils.arrival_trace qos_outputs/<run>/worker_*.csv --output traces/run.csv
+# python3 -m warehouse.utils.arrival_trace ../90_openvino_yolo_experiment/<yolo csv folder> --output traces/yolo.parquet
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='+', help='QoS CSV/Parquet files, directories or glob patterns.')
+    parser.add_argument('--output', required=True, help='Trace to write, .csv or .parquet.')
+    parser.add_argument('--column', default='start_time', help='Send time of every message. Default: start_time.')
+    parser.add_argument('--unit', default='auto', choices=['auto', 'ms', 's'])
+    parser.add_argument('--key_column', default='id', help='Message id column, duplicates are dropped. Default: id.')
+    parser.add_argument('--size_column', default=None, help='Optional payload size column to keep.')
+    py_args = parser.parse_args()
+
+    n_arrivals = derive_trace(py_args.sources, py_args.output, py_args.column, py_args.unit, py_args.key_column,
+                              py_args.size_column)
+    trace = load_trace(py_args.output)
+    print(f'WROTE {n_arrivals} ARRIVALS OVER {trace.duration:.1f} SECONDS ({trace.mean_rate:.1f}/s) '
+          f'TO {py_args.output}')
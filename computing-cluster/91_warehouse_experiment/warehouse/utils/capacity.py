@@ -0,0 +1,157 @@
+import datetime
+import json
+import os
+
+import numpy as np
+
+# CAPACITY SEARCH: THE HIGHEST OFFERED RATE A DEPLOYMENT SUSTAINS, FOUND IN A CLOSED LOOP INSTEAD OF COPIED BY HAND
+#   A TRIAL OFFERS ONE RATE FOR A WHILE. IT IS SUSTAINABLE WHEN
+#     THE FEEDER ACHIEVED THE RATE           (OTHERWISE THE FEEDER, NOT THE DEPLOYMENT, WAS MEASURED)
+#     THE CONSUMER LAG DID NOT GROW          (THE CONSUMERS KEEP UP, NOTHING PILES UP IN THE TOPIC)
+#     THE p99 END-TO-END LATENCY MEETS THE SLO
+#   search_capacity() RAMPS THE RATE UP (x growth PER TRIAL) UNTIL A TRIAL FAILS, THEN BISECTS BETWEEN THE LAST
+#   SUSTAINABLE AND THE FIRST FAILED RATE. WHEN ALREADY start_rate FAILS THERE IS NO BRACKET AND NO RESULT
+#   THE RESULTS GO INTO A JSON CAPACITY TABLE THE EXPERIMENT RUNNERS LOAD (load_capacity_table)
+#     {"warehouse": {"<points per frame>": {"<workers>": ENTRY}}, "yolo": {"<model>": {"<resolution>": ENTRY}}}
+#     ENTRY: {"max_per_second": ..., "slo": {...}, "trials": [...], "measured_at": ...}
+#     A YOLO ENTRY ALSO HAS "consumers", THE NUMBER OF CONSUMER REPLICAS IT WAS MEASURED WITH
+
+CAPACITY_FILE = 'capacity.json'
+
+###################################################################################################
+###################################################################################################
+
+# JUDGE ONE TRIAL
+#   achieved: THE RATE THE FEEDER ACHIEVED (/s), n_sent: THE NUMBER OF MESSAGES IT SENT
+#   sent, done: SEND AND COMPLETION TIMES (s) OF THE MESSAGES THAT LEFT A QoS RECORD, done IS NaN FOR THE UNFINISHED
+#     MESSAGES WITHOUT ANY RECORD (n_sent - len(sent)) COUNT AS INFINITELY LATE
+#   lag_samples: (TIME, CONSUMER LAG) PAIRS DURING THE TRIAL, OR None WHEN THE TRANSPORT HAS NO LAG TO READ
+#   warmup: FRACTION OF THE TRIAL THAT IS SKIPPED, WHILE THE CONSUMERS WARM UP
+def evaluate_trial(rate, achieved, n_sent, sent, done, lag_samples=None, slo_ms=1000.0, tolerance=0.05, warmup=0.2):
+    sent = np.asarray(sent, dtype=np.float64)
+    done = np.asarray(done, dtype=np.float64)
+    if len(sent) < 2:
+        return {'rate': rate, 'achieved_per_second': achieved, 'sustainable': False, 'reason': 'no QoS records'}
+
+    # THE STEADY PART OF THE TRIAL
+    first, last = sent.min(), sent.max()
+    window_start = first + warmup * (last - first)
+    steady = sent >= window_start
+    seconds = max(last - window_start, 1e-9)
+
+    latency_ms = np.where(np.isnan(done[steady]), np.inf, (done[steady] - sent[steady]) * 1000)
+    latency_ms = np.concatenate([latency_ms, np.full(max(n_sent - len(sent), 0), np.inf)])
+    completion_rate = ((done >= window_start) & (done <= last)).sum() / seconds
+
+    # LAG GROWTH FROM THE CONSUMER OFFSETS, OR FROM THE GAP BETWEEN THE SEND AND THE COMPLETION RATE
+    lag_growth = achieved - completion_rate
+    if lag_samples:
+        samples = np.asarray([sample for sample in lag_samples if window_start <= sample[0] <= last])
+        if len(samples) >= 2:
+            lag_growth = float(np.polyfit(samples[:, 0], samples[:, 1], 1)[0])
+
+    trial = {
+        'rate': rate,
+        'achieved_per_second': float(achieved),
+        'completion_per_second': float(completion_rate),
+        'lag_growth_per_second': float(lag_growth),
+        'completed': float(np.isfinite(done).sum() / max(n_sent, 1)),
+        'latency_p50_ms': float(np.percentile(latency_ms, 50)),
+        'latency_p99_ms': float(np.percentile(latency_ms, 99)),
+    }
+    if achieved < (1 - tolerance) * rate:
+        trial['reason'] = 'the feeder could not offer the rate'
+    elif lag_growth > tolerance * rate:
+        trial['reason'] = 'consumer lag grows'
+    elif not trial['latency_p99_ms'] <= slo_ms:
+        trial['reason'] = 'p99 latency above the SLO'
+    trial['sustainable'] = 'reason' not in trial
+    return trial
+
+# RAMP, THEN BISECT. measure(rate) RUNS ONE TRIAL AND RETURNS evaluate_trial()
+#   precision: STOP WHEN THE BRACKET IS NARROWER THAN THIS FRACTION OF ITS UPPER END
+#   max_per_second IS None WHEN NO TRIAL WAS SUSTAINABLE: THE SEARCH DOES NOT BISECT BELOW start_rate (TOWARDS 0),
+#   THE CAPACITY IS THEN UNKNOWN, NOT 0. RETRY WITH A LOWER start_rate
+def search_capacity(measure, start_rate=10.0, max_rate=10000.0, growth=2.0, precision=0.05, max_trials=20,
+                    log_func=print):
+    trials = []
+
+    def trial(rate):
+        result = measure(rate)
+        trials.append(result)
+        log_func(f'TRIAL {len(trials)}: {rate:.1f}/s -> '
+                 f'{"SUSTAINABLE" if result["sustainable"] else "NOT SUSTAINABLE (" + result["reason"] + ")"} '
+                 f'{ {key: round(value, 2) for key, value in result.items() if isinstance(value, float)} }')
+        return result['sustainable']
+
+    # RAMP UNTIL THE FIRST FAILURE
+    low, high = 0.0, None
+    rate = start_rate
+    while len(trials) < max_trials:
+        if not trial(rate):
+            high = rate
+            break
+        low = rate
+        if rate >= max_rate:
+            break
+        rate = min(rate * growth, max_rate)
+
+    # BISECT THE BRACKET, ONLY ABOVE A SUSTAINABLE RATE
+    if low < start_rate:
+        log_func(f'NO SUSTAINABLE RATE: ALREADY THE START RATE ({start_rate:.1f}/s) FAILED')
+        return {'max_per_second': None, 'first_failed_per_second': high, 'trials': trials}
+    while high is not None and len(trials) < max_trials and (high - low) > precision * high:
+        rate = (low + high) / 2
+        if trial(rate):
+            low = rate
+        else:
+            high = rate
+
+    return {
+        'max_per_second': low,
+        'first_failed_per_second': high,
+        'trials': trials,
+    }
+
+###################################################################################################
+###################################################################################################
+
+def read_capacity_file(path=CAPACITY_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+# STORE ONE RESULT UNDER capacity[experiment][key_1][key_2]. THE FILE IS REPLACED ATOMICALLY, SO A RUNNER NEVER
+# READS A HALF-WRITTEN TABLE
+def update_capacity_table(path, experiment, key_1, key_2, result, **details):
+    capacity = read_capacity_file(path)
+    entry = dict(result, **details, measured_at=datetime.datetime.now().isoformat(timespec='seconds'))
+    capacity.setdefault(experiment, {}).setdefault(str(key_1), {})[str(key_2)] = entry
+    with open(path + '.tmp', 'w') as file:
+        json.dump(capacity, file, indent=2)
+    os.replace(path + '.tmp', path)
+    return entry
+
+def as_key(key):
+    try:
+        return int(key)
+    except ValueError:
+        return key
+
+# capacity[experiment] AS {key_1: {key_2: max_per_second}}, MERGED OVER fallback (E.G. THE HAND-COPIED TABLE)
+# NUMERIC KEYS BECOME INTS, LIKE THE KEYS OF THE TABLES IN THE RUNNERS
+# ENTRIES MEASURED ON LOCAL COMPONENTS (--local) DO NOT DESCRIBE A DEPLOYMENT, AND ENTRIES WITHOUT A POSITIVE RATE ARE
+# FAILED SEARCHES. BOTH ARE SKIPPED, SO THEY NEVER OVERRIDE A FALLBACK VALUE
+# consumers: THE NUMBER OF CONSUMER REPLICAS OF THE RUNNER. ENTRIES MEASURED WITH ANOTHER (OR AN UNKNOWN) NUMBER ARE
+#   SKIPPED TOO, THE CAPACITY SCALES WITH THE REPLICAS. None KEEPS ALL ENTRIES
+def load_capacity_table(path=CAPACITY_FILE, experiment='warehouse', fallback=None, consumers=None):
+    table = {key_1: dict(values) for key_1, values in (fallback or {}).items()}
+    for key_1, values in read_capacity_file(path).get(experiment, {}).items():
+        for key_2, entry in values.items():
+            if entry.get('local') or not (entry.get('max_per_second') or 0) > 0:
+                continue
+            if consumers is not None and entry.get('consumers') != consumers:
+                continue
+            table.setdefault(as_key(key_1), {})[as_key(key_2)] = entry['max_per_second']
+    return table
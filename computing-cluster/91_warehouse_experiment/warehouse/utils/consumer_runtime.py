@@ -0,0 +1,197 @@
+import multiprocessing
+import queue
+import time
+import zlib
+
+from .kafka_utils import intended_time
+from .misc import log
+
+
+def _worker_loop(handler, tasks, results, retries):
+    """
+    Run handler on every task until the None sentinel arrives. A failed task is retried up to retries times,
+    in place so the order of its route is kept, then its last error is returned instead of raised.
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        meta, args = task
+        for attempt in range(retries + 1):
+            try:
+                results.put((meta, handler(*args), None))
+                break
+            except Exception as error:
+                if attempt == retries:
+                    results.put((meta, None, repr(error)))
+
+
+class create_process_pool:
+    """
+    Pool of worker processes with routed, ordered dispatch and a bound on the messages in flight.
+
+    Tasks with the same route (partition or key) always go to the same process, so their relative order is kept.
+    A full pool makes submit() wait for results, which pushes back on the poller instead of buffering the topic.
+    Processes are forked, so the handler can be a closure. Create the pool before any Kafka client,
+    because librdkafka threads do not survive a fork.
+
+    Args:
+        handler: Function run in the worker processes. Its arguments and return value must be picklable.
+        num_processes: Number of worker processes.
+        max_in_flight: Maximum number of submitted but unfinished tasks. Default: 4 per process.
+        on_result: Called in the parent as on_result(meta, result) for every successful task, in completion order.
+        retries: Number of times a failed task is run again before it is given up.
+        on_error: Called in the parent as on_error(meta, error) for every task given up, so its caller can finish it.
+    """
+
+    def __init__(self, handler, num_processes, max_in_flight=None, on_result=None, retries=2, on_error=None):
+        context = multiprocessing.get_context('fork')
+        self.task_queues = [context.Queue() for _ in range(num_processes)]
+        self.results = context.Queue()
+        self.processes = [
+            context.Process(target=_worker_loop, args=(handler, tasks, self.results, retries), daemon=True)
+            for tasks in self.task_queues
+        ]
+        for process in self.processes:
+            process.start()
+        self.max_in_flight = max_in_flight or 4 * num_processes
+        self.in_flight = 0
+        self.on_result = on_result
+        self.on_error = on_error
+        self.errors = 0
+
+    def route(self, route_key) -> int:
+        """ Map a partition number or message key to a process index. """
+        if isinstance(route_key, int):
+            return route_key % len(self.processes)
+        return zlib.crc32(route_key or b'') % len(self.processes)  # Stable across processes, unlike hash()
+
+    def submit(self, route_key, args, meta=None) -> None:
+        """ Queue a task for the process of route_key, first waiting for results while the pool is full. """
+        while self.in_flight >= self.max_in_flight:
+            self.collect(timeout=1)
+        self.task_queues[self.route(route_key)].put((meta, args))
+        self.in_flight += 1
+
+    def collect(self, timeout=0.0) -> int:
+        """ Handle finished tasks, waiting up to timeout seconds for the first one. Returns the number handled. """
+        handled = 0
+        while self.in_flight > 0:
+            try:
+                meta, result, error = self.results.get(timeout=timeout if handled == 0 else 0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError('A worker process died, its tasks will never finish')
+                break
+            self.in_flight -= 1
+            handled += 1
+            if error is not None:
+                self.errors += 1
+                log(f'WORKER PROCESS ERROR: {error}')
+                if self.on_error is not None:
+                    self.on_error(meta, error)
+            elif self.on_result is not None:
+                self.on_result(meta, result)
+        return handled
+
+    def drain(self) -> None:
+        """ Wait until every submitted task has finished. """
+        while self.in_flight > 0:
+            self.collect(timeout=1)
+
+    def close(self) -> None:
+        """ Finish the submitted tasks and stop the processes. """
+        self.drain()
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join()
+
+
+def poll_processes(consumer, pool, thread_lock, on_result=None, order_by='key', poll_timeout=0.1, intended=False):
+    """
+    Consume a topic with a process pool instead of a single thread.
+
+    The pool handler is called as handler(value, key, time_received_ms, time_sent_ms), like on_message in
+    create_consumer.poll_next, with time_intended_ms as a fifth argument when intended is set. Its return value
+    is passed to on_result(result) in this thread, where Kafka clients can be used.
+
+    A worker pod usually owns a single partition, so routing by partition would hand every message to one process.
+    By default, messages are routed by key and the messages of a partition finish out of order. In batched commit mode,
+    the offset manager then commits a partition only up to its lowest unfinished message, so a rebalance or a crash
+    never skips a message that was still in a process. A message whose handler still fails after the pool's retries
+    is logged and finished without a result, so the commits of its partition move past it instead of stopping there.
+    In-flight messages are finished before revoked partitions are committed.
+
+    Args:
+        consumer: A create_consumer instance.
+        pool: A create_process_pool instance.
+        thread_lock: create_lock that stops the loop when killed.
+        on_result: Called with the handler's return value for every message.
+        order_by: 'key' keeps the order within each message key and spreads a partition over the processes.
+            'partition' keeps the order within each partition, but a partition only uses one process.
+        poll_timeout: Seconds to wait for a message, between handling finished results.
+        intended: Pass the intended send time of every message (the intended_ms header) to the handler.
+    """
+    log(f'NOW POLLING INTO {len(pool.processes)} PROCESSES (ORDER BY {order_by.upper()})')
+
+    def handle_result(meta, result):
+        topic, partition, offset, submitted = meta
+        if on_result is not None:
+            on_result(result)
+        consumer.record_processed(1, time.perf_counter() - submitted)  # Includes the wait in the process queue
+        if consumer.offsets is not None:
+            consumer.offsets.store_offset(topic, partition, offset)
+
+    def handle_error(meta, error):
+        topic, partition, offset, _ = meta
+        if consumer.offsets is not None:
+            consumer.offsets.store_offset(topic, partition, offset)
+
+    pool.on_result = handle_result
+    pool.on_error = handle_error
+    consumer.before_revoke = lambda partitions: pool.drain()
+
+    while thread_lock.is_active():
+        try:
+            pool.collect()
+            msg = consumer.kafka_client.poll(poll_timeout)
+
+            if msg is None:
+                if consumer.offsets is not None:
+                    consumer.offsets.maybe_commit()
+                continue
+
+            if msg.error():
+                print('FAULTY EVENT RECEIVED', msg.error())
+                continue
+
+            # COMMIT THE EVENT TO PREVENT OTHERS FROM TAKING IT
+            if consumer.offsets is None:
+                consumer.kafka_client.commit(msg, asynchronous=True)
+
+            # Memory maps cannot be sent to another process, so claim-checked blobs are copied once
+            value, ref = consumer.check_out(msg)
+            if ref is not None:
+                value = bytes(value)
+                consumer.release_blobs([ref])
+
+            route_key = msg.partition() if order_by == 'partition' else msg.key()
+            args = (value, msg.key(), int(time.time() * 1000), msg.timestamp()[1])
+            if intended:
+                args += (intended_time(msg, args[3]),)
+            if consumer.offsets is not None:
+                consumer.offsets.begin(msg.topic(), msg.partition(), msg.offset())
+            pool.submit(route_key, args, meta=(msg.topic(), msg.partition(), msg.offset(), time.perf_counter()))
+            if consumer.offsets is not None:
+                consumer.offsets.maybe_commit()
+
+        except RuntimeError:
+            raise
+        except Exception as error:
+            import traceback
+            log(f'CONSUMER ERROR: {error}\n{traceback.format_exc()}')
+            continue
+
+    pool.drain()
+    log('POLLING STOPPED')
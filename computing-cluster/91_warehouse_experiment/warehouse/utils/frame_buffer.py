@@ -0,0 +1,125 @@
+import os
+from multiprocessing import shared_memory
+from typing import Iterable, List
+
+import numpy as np
+
+from .lidar_dataset_reader import load_to_memory
+from .lidar_frame import LidarFrame
+from .packed_dataset import create_packed_dataset, is_packed_dataset
+
+# PRE-SERIALIZED FRAMES FOR THE FEEDERS
+#   EVERY FRAME OF THE SELECTED SENSORS IS SERIALIZED ONCE (LidarFrame.to_bytes()) INTO ONE CONTIGUOUS BUFFER
+#   A SEND THEN ONLY PICKS A MEMORYVIEW SLICE OF THAT BUFFER, SO THE FEEDER DOES NO COPYING OR JOINING PER MESSAGE
+#   THE BUFFER IS AN IMMUTABLE bytes OBJECT, SO ITS SLICES ARE READ-ONLY AND CAN BE HANDED TO Producer.produce()
+
+###################################################################################################
+###################################################################################################
+
+class create_frame_buffer:
+
+    # all_sensor_data: FRAMES PER SENSOR, AS RETURNED BY load_to_memory()
+    # sensors: INDICES OF THE SENSORS TO SERIALIZE, OR None FOR ALL OF THEM
+    def __init__(self, all_sensor_data: List[List[LidarFrame]], sensors: Iterable[int] = None):
+        if sensors is None:
+            sensors = range(len(all_sensor_data))
+        self.n_sensors = len(all_sensor_data)
+        self.sensors = sorted(set(sensors))
+
+        # ONE PASS OVER THE FRAMES: THE BUFFER IS JOINED FROM THE SERIALIZED FRAMES, SENSOR BY SENSOR
+        chunks = []
+        sizes = []
+        for sensor_index in self.sensors:
+            for frame in all_sensor_data[sensor_index]:
+                chunk = frame.to_bytes()
+                chunks.append(chunk)
+                sizes.append(len(chunk))
+        self.buffer = b''.join(chunks)
+        del chunks
+
+        # OFFSET INDEX: FRAME i OF THE BUFFER IS buffer[offsets[i]:offsets[i + 1]]
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+
+        # self.frames[sensor]: POSITION OF THE SENSOR'S FIRST FRAME IN THE INDEX, AND ITS NUMBER OF FRAMES
+        self.frames = {}
+        first = 0
+        for sensor_index in self.sensors:
+            n_frames = len(all_sensor_data[sensor_index])
+            self.frames[sensor_index] = (first, n_frames)
+            first += n_frames
+        self.views = slice_views(memoryview(self.buffer), self.offsets.tolist(), self.frames)
+
+    # THE SERIALIZED FRAMES OF ONE SENSOR, IN DATASET ORDER
+    def sensor(self, sensor_index) -> List[memoryview]:
+        return self.views[sensor_index]
+
+    def frame(self, sensor_index, frame_index) -> memoryview:
+        return self.views[sensor_index][frame_index]
+
+    @property
+    def nbytes(self):
+        return len(self.buffer)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+# THE SAME FRAMES IN A SHARED-MEMORY SEGMENT, FOR FEEDER PROCESSES FORKED AFTER IT WAS CREATED
+# THE PROCESSES SEND FROM ONE COPY OF THE DATASET INSTEAD OF EACH LOADING AND SERIALIZING THEIR OWN
+class create_shared_frame_buffer:
+    def __init__(self, frame_buffer: create_frame_buffer):
+        self.n_sensors = frame_buffer.n_sensors
+        self.sensors = frame_buffer.sensors
+        self.frames = frame_buffer.frames
+        self.offsets = frame_buffer.offsets.tolist()
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, frame_buffer.nbytes))
+        self.memory.buf[:frame_buffer.nbytes] = frame_buffer.buffer
+        self.owner = os.getpid()
+
+        # READ-ONLY VIEWS, LIKE THE SLICES OF create_frame_buffer
+        self.views = slice_views(self.memory.buf.toreadonly(), self.offsets, self.frames)
+
+    def sensor(self, sensor_index) -> List[memoryview]:
+        return self.views[sensor_index]
+
+    def frame(self, sensor_index, frame_index) -> memoryview:
+        return self.views[sensor_index][frame_index]
+
+    @property
+    def nbytes(self):
+        return self.offsets[-1]
+
+    # THE PROCESS THAT CREATED THE SEGMENT ALSO REMOVES IT
+    def close(self):
+        for views in self.views.values():
+            for view in views:
+                view.release()
+        self.views = {}
+        self.memory.close()
+        if os.getpid() == self.owner:
+            self.memory.unlink()
+
+# CUT THE SLICES OF EVERY SENSOR UP FRONT, A SEND ONLY INDEXES A LIST
+def slice_views(view, offsets, frames):
+    return {
+        sensor_index: [view[offsets[i]:offsets[i + 1]] for i in range(first, first + n_frames)]
+        for sensor_index, (first, n_frames) in frames.items()
+    }
+
+###################################################################################################
+###################################################################################################
+
+# THE FRAMES FEEDER THREAD n SENDS FROM SENSOR n % n_sensors (n = 1, 2, ...)
+#   A PACKED DATASET IS ALREADY SERIALIZED, SO ITS RECORDS ARE SENT STRAIGHT FROM THE MEMORY MAP
+#   AN HDF5 DATASET IS LOADED AND ONLY THE SENSORS OF THE THREADS ARE SERIALIZED
+def load_frame_buffer(dataset_path, num_threads):
+    if is_packed_dataset(dataset_path):
+        return create_packed_dataset(dataset_path)
+    all_sensor_data = load_to_memory(dataset_path)
+    num_sensors = len(all_sensor_data)
+    return create_frame_buffer(all_sensor_data, [nth % num_sensors for nth in range(1, num_threads + 1)])
+
+# THE FIRST FRAME THE FIRST THREAD SENDS, E.G. FOR THE SIZE OF A FRAME
+def first_frame(frame_buffer) -> LidarFrame:
+    return LidarFrame.from_bytes(frame_buffer.frame(1 % frame_buffer.n_sensors, 0))
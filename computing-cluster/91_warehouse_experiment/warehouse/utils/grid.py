@@ -13,6 +13,12 @@ class OccupancyGrid:
         """Access a specific grid cell by coordinates."""
         return self._cells[(x, y)]
 
+    def cell_states(self, current_time: float):
+        """Yield ((x, y), state, certainty) for every observed cell."""
+        for coords, cell in self._cells.items():
+            state, certainty = cell.current_state(current_time)
+            yield coords, state, certainty
+
     def to_bytes(self) -> bytes:
         """ Convert the grid to bytes, so it can be sent over the network. """
         return pickle.dumps(dict(self._cells))
@@ -25,9 +25,11 @@ class GridVisualizer:
         self.fig = None
         self.ax = None
 
-    def visualize_grid(self, grid: OccupancyGrid, animate=True) -> None:
+    def visualize_grid(self, grid, animate=True) -> None:
         """
         Visualize the occupancy grid using matplotlib, updating the same figure.
+
+        Works with any grid that provides cell_states() (OccupancyGrid, LogOddsGrid).
         """
         if self.fig == None:
             self.fig, self.ax = plt.subplots(figsize=(8, 8))
@@ -41,8 +43,7 @@ class GridVisualizer:
         y_coords = []
         colors = []
 
-        for (x, y), cell in grid._cells.items():
-            state, certainty = cell.current_state(time.time())
+        for (x, y), state, certainty in grid.cell_states(time.time()):
             color = STATE_COLORS[state]
             colors.append((*color[:3], certainty))  # Add transparency based on certainty
             x_coords.append(x)
@@ -0,0 +1,49 @@
+import numpy as np
+
+# CORRECTED AND UNCORRECTED LATENCY OF QoS RECORDS
+#   UNCORRECTED: end_time - start_time, FROM THE KAFKA TIMESTAMP OF THE MESSAGE (WHEN IT WAS ACTUALLY SENT)
+#   CORRECTED:   end_time - intended_time, FROM THE FEEDER'S SCHEDULE (WHEN IT WAS DUE)
+#   A FEEDER THAT FALLS BEHIND SENDS ITS HELD-BACK MESSAGES LATE. THE UNCORRECTED LATENCY STARTS COUNTING ONLY THEN
+#   AND HIDES THE WAIT (COORDINATED OMISSION), THE CORRECTED ONE DOES NOT. THE GAP BETWEEN THEM IS THE TIME THE
+#   MESSAGES SPENT WAITING FOR THE FEEDER OR ITS PRODUCER
+#   RECORDS WITHOUT intended_time (E.G. FROM THE BURST FEEDER, OR OLDER CONSUMERS) COUNT AS SENT ON TIME
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+class create_latency_tracker:
+    def __init__(self, percentiles=PERCENTILES):
+        self.percentiles = percentiles
+        self.uncorrected = []
+        self.corrected = []
+
+    # ADD THE timestamps OF ONE QoS RECORD (ms)
+    def add(self, timestamps):
+        if 'start_time' not in timestamps or 'end_time' not in timestamps:
+            return
+        end_time = timestamps['end_time']
+        self.uncorrected.append(end_time - timestamps['start_time'])
+        self.corrected.append(end_time - timestamps.get('intended_time', timestamps['start_time']))
+
+    def __len__(self):
+        return len(self.uncorrected)
+
+    # {'n': ..., 'uncorrected': {'p50_ms': ...}, 'corrected': {'p50_ms': ...}}
+    def summary(self):
+        summary = {'n': len(self)}
+        for name, latencies in [('uncorrected', self.uncorrected), ('corrected', self.corrected)]:
+            latencies = np.asarray(latencies, dtype=np.float64)
+            summary[name] = {
+                f'p{percentile:g}_ms': float(np.percentile(latencies, percentile)) if len(latencies) else float('nan')
+                for percentile in self.percentiles
+            }
+        return summary
+
+    # THE PERCENTILES SIDE BY SIDE, ONE LINE PER KIND
+    def report(self):
+        summary = self.summary()
+        columns = [f'p{percentile:g}' for percentile in self.percentiles]
+        lines = [f'LATENCY OF {summary["n"]} MESSAGES (ms)'.ljust(36) + ''.join(column.rjust(10) for column in columns)]
+        for name, description in [('uncorrected', 'from the send time'), ('corrected', 'from the intended time')]:
+            values = summary[name].values()
+            lines.append(f'  {name} ({description})'.ljust(36) + ''.join(f'{value:10.1f}' for value in values))
+        return '\n'.join(lines)
@@ -1,4 +1,6 @@
+import hashlib
 import json
+import os
 from typing import List
 
 import h5py
@@ -6,27 +8,107 @@ import numpy as np
 
 from .lidar_frame import LidarFrame
 
+# ARRAYS OF A SENSOR IN THE CACHE, AS RETURNED BY read_sensor_arrays
+CACHED_ARRAYS = ("data", "rotation", "position")
 
-def load_to_memory(dataset_path: str) -> List[List[LidarFrame]]:
-    """ Return a list of Frames for each sensor. """
+# THE FINGERPRINT OF A DATASET HASHES ITS SIZE, ITS MODIFICATION TIME AND ITS FIRST AND LAST MEGABYTE,
+# SO A CACHED LOAD DOES NOT HAVE TO READ THE WHOLE FILE JUST TO FIND ITS CACHE
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+def dataset_fingerprint(dataset_path: str) -> str:
+    """ Return a hex digest that changes whenever the HDF5 file is replaced or modified. """
+    stat = os.stat(dataset_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    with open(dataset_path, "rb") as file:
+        digest.update(file.read(FINGERPRINT_BYTES))
+        file.seek(max(0, stat.st_size - FINGERPRINT_BYTES))
+        digest.update(file.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def read_sensor_arrays(dataset_path: str):
+    """ Return (data, rotations, positions) per sensor, read with one bulk read per HDF5 dataset. """
     with h5py.File(dataset_path, "r") as dataset:
-        sensors = dataset["sensors"].keys()
         metadata = json.loads(dataset["metadata"][()])
-        all_sensor_frames: List[List[LidarFrame]] = []
+        ids = dataset["state/id"][()]
+        rotations = dataset["state/rotation"][()]
+        locations = dataset["state/location"][()]
+
+        all_sensor_arrays = {}
+        for sensor in dataset["sensors"].keys():
+            sensor_data = dataset["sensors"][sensor][()]
+            n_frames = len(sensor_data)
+
+            # Row of the sensor's actor in every frame, like list(ids[frame]).index(actor_id) but for all frames at once
+            matches = ids[:n_frames] == metadata[sensor]["id"]
+            if not matches.any(axis=1).all():
+                raise ValueError(f"Actor {metadata[sensor]['id']} of sensor {sensor} is missing from some frames")
+            actor_index = matches.argmax(axis=1)
+
+            frame_index = np.arange(n_frames)
+            all_sensor_arrays[sensor] = (
+                sensor_data,
+                rotations[frame_index, actor_index],
+                locations[frame_index, actor_index],
+            )
+    return all_sensor_arrays
+
+
+def load_sensor_arrays(dataset_path: str, cache_dir: str = None):
+    """
+    Return read_sensor_arrays(dataset_path), from an npy cache per sensor when one exists for this file.
+    The cache is in cache_dir (default: .dataset_cache next to the dataset), in a directory named by the fingerprint.
+    Cached arrays are memory-mapped read-only, so a cached load takes milliseconds and pages the frames in on first use.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(dataset_path)), ".dataset_cache")
+    fingerprint_dir = os.path.join(cache_dir, dataset_fingerprint(dataset_path))
+    manifest_path = os.path.join(fingerprint_dir, "sensors.json")
+
+    # The manifest is written last, so a cache without one is incomplete and is rebuilt
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            sensors = json.load(file)
+        all_sensor_arrays = {}
         for sensor in sensors:
-            frames: List[LidarFrame] = []
-            n_frames = len(dataset["sensors"][sensor])
-            actor_id = metadata[sensor]["id"]
-            total_bytes = 0
-            for frame in range(n_frames):
-                actor_index = list(dataset["state/id"][frame]).index(actor_id)
-                rotation = dataset["state/rotation"][frame][actor_index]
-                location = dataset["state/location"][frame][actor_index]
-                sensor_data = dataset[f"sensors/{sensor}"][frame]
-                total_bytes += sensor_data.nbytes
-                frames.append(LidarFrame(sensor_data, rotation, location))
-            print(f"Sensor {sensor}: {total_bytes / (1024 * 1024):.2f} MB")
-            all_sensor_frames.append(frames)
+            all_sensor_arrays[sensor] = tuple(
+                np.load(os.path.join(fingerprint_dir, f"{sensor}.{name}.npy"), mmap_mode="r") for name in CACHED_ARRAYS
+            )
+        return all_sensor_arrays
+
+    all_sensor_arrays = read_sensor_arrays(dataset_path)
+    try:
+        os.makedirs(fingerprint_dir, exist_ok=True)
+        for sensor, arrays in all_sensor_arrays.items():
+            for name, array in zip(CACHED_ARRAYS, arrays):
+                # Written under a temporary name, so a concurrent load never reads a half-written file
+                temporary_path = os.path.join(fingerprint_dir, f"{sensor}.{name}.{os.getpid()}.tmp.npy")
+                np.save(temporary_path, array)
+                os.replace(temporary_path, os.path.join(fingerprint_dir, f"{sensor}.{name}.npy"))
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(list(all_sensor_arrays), file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    # A read-only dataset directory only costs the cache, not the load
+    except OSError as error:
+        print(f"Dataset cache not written to {fingerprint_dir}: {error}")
+    return all_sensor_arrays
+
+
+def load_to_memory(dataset_path: str, cache_dir: str = None, use_cache: bool = True) -> List[List[LidarFrame]]:
+    """ Return a list of Frames for each sensor. """
+    if use_cache:
+        all_sensor_arrays = load_sensor_arrays(dataset_path, cache_dir)
+    else:
+        all_sensor_arrays = read_sensor_arrays(dataset_path)
+
+    # The frames are views into the per-sensor arrays, nothing is copied per frame
+    all_sensor_frames: List[List[LidarFrame]] = []
+    for sensor, (sensor_data, rotations, positions) in all_sensor_arrays.items():
+        frames = [LidarFrame(sensor_data[i], rotations[i], positions[i]) for i in range(len(sensor_data))]
+        print(f"Sensor {sensor}: {sensor_data.nbytes / (1024 * 1024):.2f} MB")
+        all_sensor_frames.append(frames)
     return all_sensor_frames
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+import math
+import struct
+
+import numpy as np
+
+from .grid import OccupancyGrid
+from .grid_cell import CellState
+
+# Log-odds are stored as small integers: one unit equals LOG_ODDS_SCALE logits
+LOG_ODDS_SCALE = 0.05
+LOG_ODDS_OCCUPIED = 17  # ~ +0.85 logits for a hit
+LOG_ODDS_EMPTY = -8  # ~ -0.40 logits for a pass-through
+LOG_ODDS_CLAMP = 100  # Clamp to +-5 logits, so the map can still react to changes
+LOG_ODDS_THRESHOLD = 10  # |value| below this is reported as UNKNOWN
+
+_HEADER = struct.Struct('<I')  # Number of cells in the serialized update
+
+
+def frame_deltas(hit_cells: np.ndarray, empty_cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pre-aggregate the observations of one frame into one log-odds delta per cell.
+
+    Every cell is updated at most once per frame. Cells that were hit are occupied,
+    even if another ray passed through them.
+
+    Args:
+        hit_cells: (N, 2) array of grid coordinates where a ray ended.
+        empty_cells: (M, 2) array of grid coordinates that a ray passed through.
+
+    Returns:
+        Tuple (coords, deltas) with unique (K, 2) int32 coordinates and (K,) int8 deltas.
+    """
+    hit_cells = np.asarray(hit_cells, dtype=np.int64).reshape(-1, 2)
+    empty_cells = np.asarray(empty_cells, dtype=np.int64).reshape(-1, 2)
+    all_cells = np.concatenate([empty_cells, hit_cells])
+    if len(all_cells) == 0:
+        return np.empty((0, 2), dtype=np.int32), np.empty(0, dtype=np.int8)
+
+    # Mark the cells into a dense scratch array covering the bounding box of the frame
+    lo = all_cells.min(axis=0)
+    shape = all_cells.max(axis=0) - lo + 1
+    scratch = np.zeros(shape, dtype=np.int8)
+    scratch[empty_cells[:, 0] - lo[0], empty_cells[:, 1] - lo[1]] = LOG_ODDS_EMPTY
+    scratch[hit_cells[:, 0] - lo[0], hit_cells[:, 1] - lo[1]] = LOG_ODDS_OCCUPIED
+
+    xs, ys = np.nonzero(scratch)
+    coords = np.stack([xs + lo[0], ys + lo[1]], axis=1).astype(np.int32)
+    return coords, scratch[xs, ys]
+
+
+class LogOddsGrid:
+    """
+    Occupancy grid that stores clamped log-odds in a dense int8 array.
+
+    Unlike OccupancyGrid, updates are additive. Workers can pre-aggregate their observations
+    and the master merges an update with one vectorized addition. The sum does not depend on
+    the message order; only cells that reach the clamp limits can end up with slightly different
+    values, which in practice does not change their state.
+    """
+    GRID_CELL_SIZE_MM: int = OccupancyGrid.GRID_CELL_SIZE_MM
+    GROWTH_MARGIN: int = 32  # Extra cells allocated around the map when it grows
+
+    def __init__(self) -> None:
+        """Initialize an empty grid."""
+        self._origin = np.zeros(2, dtype=np.int64)  # Grid coordinates of self._values[0, 0]
+        self._values = np.zeros((0, 0), dtype=np.int8)
+
+    def __len__(self) -> int:
+        """Number of cells with any evidence."""
+        return int(np.count_nonzero(self._values))
+
+    @property
+    def nbytes(self) -> int:
+        return self._values.nbytes
+
+    def _ensure_bounds(self, lo: np.ndarray, hi: np.ndarray) -> None:
+        """Grow the dense array so that it covers the coordinates lo..hi (inclusive)."""
+        old_lo = self._origin
+        old_hi = self._origin + np.array(self._values.shape) - 1
+        if self._values.size > 0 and np.all(lo >= old_lo) and np.all(hi <= old_hi):
+            return
+
+        if self._values.size == 0:
+            new_lo = lo - self.GROWTH_MARGIN
+            new_hi = hi + self.GROWTH_MARGIN
+        else:
+            new_lo = np.where(lo < old_lo, lo - self.GROWTH_MARGIN, old_lo)
+            new_hi = np.where(hi > old_hi, hi + self.GROWTH_MARGIN, old_hi)
+
+        values = np.zeros(new_hi - new_lo + 1, dtype=np.int8)
+        if self._values.size > 0:
+            ox, oy = old_lo - new_lo
+            values[ox:ox + self._values.shape[0], oy:oy + self._values.shape[1]] = self._values
+        self._origin = new_lo
+        self._values = values
+
+    def merge(self, coords: np.ndarray, deltas: np.ndarray) -> None:
+        """
+        Add log-odds deltas to the grid and clamp the result.
+
+        Duplicate coordinates are summed before the addition, so several pre-aggregated
+        updates can be concatenated and merged at once.
+
+        Args:
+            coords: (N, 2) array of grid coordinates.
+            deltas: (N,) array of log-odds deltas.
+        """
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+        if len(coords) == 0:
+            return
+        self._ensure_bounds(coords.min(axis=0), coords.max(axis=0))
+
+        width = self._values.shape[1]
+        flat = (coords[:, 0] - self._origin[0]) * width + (coords[:, 1] - self._origin[1])
+        flat_lo = flat.min()
+        sums = np.bincount(flat - flat_lo, weights=deltas).astype(np.int32)
+        touched = np.flatnonzero(sums) + flat_lo
+
+        values = self._values.reshape(-1)
+        merged = values[touched].astype(np.int32) + sums[touched - flat_lo]
+        values[touched] = np.clip(merged, -LOG_ODDS_CLAMP, LOG_ODDS_CLAMP)
+
+    def get_value(self, x: int, y: int) -> int:
+        """Access the log-odds of a specific grid cell by coordinates."""
+        ix, iy = x - self._origin[0], y - self._origin[1]
+        if 0 <= ix < self._values.shape[0] and 0 <= iy < self._values.shape[1]:
+            return int(self._values[ix, iy])
+        return 0
+
+    def cells(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return (coords, values) of all cells with any evidence."""
+        xs, ys = np.nonzero(self._values)
+        coords = np.stack([xs + self._origin[0], ys + self._origin[1]], axis=1).astype(np.int32)
+        return coords, self._values[xs, ys]
+
+    def cell_states(self, current_time: float = None):
+        """
+        Yield ((x, y), state, certainty) for every cell with any evidence.
+
+        The log-odds do not decay, so current_time is only accepted for compatibility with OccupancyGrid.
+        """
+        coords, values = self.cells()
+        for (x, y), value in zip(coords.tolist(), values.tolist()):
+            probability = 1.0 / (1.0 + math.exp(-value * LOG_ODDS_SCALE))
+            if value >= LOG_ODDS_THRESHOLD:
+                yield (x, y), CellState.OCCUPIED, probability
+            elif value <= -LOG_ODDS_THRESHOLD:
+                yield (x, y), CellState.EMPTY, 1.0 - probability
+            else:
+                yield (x, y), CellState.UNKNOWN, 1.0
+
+    def to_bytes(self) -> bytes:
+        """ Convert the non-zero cells to bytes, so they can be sent over the network. """
+        coords, values = self.cells()
+        return b''.join([
+            _HEADER.pack(len(values)),
+            coords.tobytes(),
+            values.tobytes(),
+        ])
+
+    @staticmethod
+    def decode(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+        """ Parse bytes created by to_bytes() into (coords, deltas) without copying. """
+        (n_cells,) = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        coords = np.frombuffer(data, dtype=np.int32, count=n_cells * 2, offset=offset).reshape(n_cells, 2)
+        offset += coords.nbytes
+        deltas = np.frombuffer(data, dtype=np.int8, count=n_cells, offset=offset)
+        return coords, deltas
+
+    def update_from_bytes(self, data: bytes) -> None:
+        """ Update the grid from bytes received over the network. """
+        self.merge(*self.decode(data))
+
+    def update_from_bytes_batch(self, data_list: list) -> None:
+        """ Merge several updates with a single vectorized addition. """
+        decoded = [self.decode(data) for data in data_list]
+        if not decoded:
+            return
+        self.merge(np.concatenate([coords for coords, _ in decoded]),
+                   np.concatenate([deltas for _, deltas in decoded]))
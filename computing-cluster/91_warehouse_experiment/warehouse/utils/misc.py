@@ -2,6 +2,7 @@ import  datetime
 import numpy as np
 import matplotlib.pyplot as plt
 import json, time, math, os, logging
+import atexit, queue, sys, threading
 from datetime import datetime
 
 def get_formatted_time():
@@ -48,6 +49,137 @@ def log(msg, with_break=False):
 
     logging.info(f'[{timestamp}]\t {msg}')
 
+# LOGGER FOR HOT PATHS (E.G. ONCE PER MESSAGE): THE CALLER ONLY QUEUES THE RECORD, A BACKGROUND THREAD FORMATS AND PRINTS IT
+# EVERY CALL SITE IS SAMPLED (1 IN sample_every) AND RATE LIMITED (max_per_second) ON ITS OWN, SKIPPED RECORDS ARE COUNTED
+# mode: 'async' (DEFAULT), 'sync' (FORMAT AND PRINT IN THE CALLER, LIKE log) OR 'off'
+class create_async_logger:
+    def __init__(self, mode='async', sample_every=1, max_per_second=0, max_queue=10000):
+        self.configure(mode, sample_every, max_per_second)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.sites = {}
+        self.dropped = 0
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+        # A FORKED CHILD (E.G. A POOL PROCESS) DOES NOT INHERIT THE WRITER THREAD, SO IT STARTS ITS OWN
+        os.register_at_fork(after_in_child=self.reset)
+
+    # CHANGE THE MODE OR LIMITS, E.G. FROM ENVIRONMENT VARIABLES AT STARTUP
+    def configure(self, mode=None, sample_every=None, max_per_second=None):
+        if mode is not None:
+            assert mode in ('async', 'sync', 'off'), f'UNKNOWN LOG MODE ({mode})'
+            self.mode = mode
+        if sample_every is not None:
+            self.sample_every = max(1, int(sample_every))
+        if max_per_second is not None:
+            self.max_per_second = float(max_per_second)
+            # SECONDS BETWEEN TWO RECORDS OF A SITE, A FLOAT SO RATES BELOW 1/s (E.G. 0.2 = ONE RECORD EVERY 5 s) WORK
+            self.interval = 1 / self.max_per_second if self.max_per_second > 0 else 0.0
+
+    # LOG msg WITH KEYWORD FIELDS. site DEFAULTS TO THE CALLING LINE
+    def __call__(self, msg, site=None, **fields):
+        if self.mode == 'off':
+            return
+        if site is None:
+            frame = sys._getframe(1)
+            site = (frame.f_code.co_filename, frame.f_lineno)
+
+        # PER-SITE STATE: [CALLS, SKIPPED SINCE LAST RECORD, EARLIEST TIME OF THE NEXT RECORD]
+        # NOT LOCKED -- CONCURRENT CALLERS CAN MISCOUNT A SAMPLE, WHICH IS HARMLESS
+        state = self.sites.get(site)
+        if state is None:
+            state = self.sites[site] = [0, 0, 0.0]
+        state[0] += 1
+        if (state[0] - 1) % self.sample_every != 0:
+            state[1] += 1
+            return
+        if self.interval > 0:
+            now = time.monotonic()
+            if now < state[2]:
+                state[1] += 1
+                return
+            state[2] = now + self.interval
+        if state[1]:
+            fields['skipped'] = state[1]
+            state[1] = 0
+
+        record = (time.time(), msg, fields)
+        if self.mode == 'sync':
+            self.write([record])
+            return
+
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+
+        # NEVER BLOCK THE CALLER -- A FULL QUEUE MEANS THE OUTPUT CANNOT KEEP UP
+        except queue.Full:
+            self.dropped += 1
+
+    # FORMAT RECORDS LIKE log AND PRINT THEM WITH ONE WRITE
+    def write(self, records):
+        lines = []
+        for timestamp, msg, fields in records:
+            line = f'[{datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f")[:-3]}]\t {msg}'
+            if fields:
+                line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+            lines.append(line)
+            logging.info(line)
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
+
+    def reset(self):
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def start(self):
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    # BACKGROUND THREAD: WAIT FOR ONE RECORD, THEN WRITE EVERYTHING THAT IS QUEUED
+    def run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < 1000:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(records)
+            except Exception as error:
+                print(f'LOGGER ERROR: {error}', flush=True)
+            for _ in records:
+                self.queue.task_done()
+
+    # WAIT UNTIL EVERY QUEUED RECORD HAS BEEN PRINTED
+    def flush(self):
+        if self.thread is not None:
+            self.queue.join()
+        if self.dropped:
+            log(f'LOGGER DROPPED {self.dropped} RECORDS (QUEUE FULL)')
+            self.dropped = 0
+
+# SHARED HOT-PATH LOGGER, CONFIGURED BY THE CONSUMERS WITH hot_log.configure(...)
+hot_log = create_async_logger()
+
+# CREATE THE FILE THAT THE KUBERNETES READINESS PROBE CHECKS
+def mark_ready(path='/tmp/ready'):
+    with open(path, 'w') as file:
+        file.write(str(time.time()))
+    log(f"READY ({path})")
+
+# REMOVE IT AGAIN WHEN THE CONSUMER LOSES ITS PARTITIONS OR STOPS, SO A STALE FILE DOES NOT KEEP THE POD READY
+def mark_unready(path='/tmp/ready'):
+    if os.path.exists(path):
+        os.remove(path)
+        log(f"NOT READY ({path})")
+
 # THREAD LOCK TO KILL HELPER THREADS
 class create_lock:
     def __init__(self):
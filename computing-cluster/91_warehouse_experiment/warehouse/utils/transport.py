@@ -0,0 +1,328 @@
+import multiprocessing
+import os
+import queue
+import struct
+import time
+from multiprocessing import shared_memory
+from threading import Lock
+
+from .kafka_utils import KAFKA_SERVERS, create_batch_producer, create_consumer, create_producer
+from .misc import log
+
+# A TRANSPORT CREATES THE PRODUCERS AND CONSUMERS OF THE FEEDERS, THE WORKERS AND THE MASTER
+#   kafka:  THE KAFKA CLIENTS OF kafka_utils
+#   memory: ONE QUEUE PER TOPIC, FOR COMPONENTS RUNNING AS THREADS OF ONE PROCESS
+#   shm:    ONE SHARED-MEMORY RING BUFFER PER TOPIC, FOR COMPONENTS FORKED FROM THE PROCESS THAT CREATED THE TRANSPORT
+# THE LOCAL TRANSPORTS NEED NO BROKER. EVERY MESSAGE OF A TOPIC GOES TO EXACTLY ONE CONSUMER, LIKE IN A CONSUMER GROUP,
+# BUT THERE ARE NO PARTITIONS, OFFSETS OR REDELIVERIES
+
+###################################################################################################
+###################################################################################################
+
+class create_kafka_transport:
+    name = 'kafka'
+
+    def __init__(self, kafka_servers=KAFKA_SERVERS):
+        self.kafka_servers = kafka_servers
+
+    # mode='batch' FOR THE BATCHING PRODUCER
+    def producer(self, mode='default', **options):
+        if mode == 'batch':
+            return create_batch_producer(kafka_servers=self.kafka_servers, **options)
+        return create_producer(kafka_servers=self.kafka_servers, **options)
+
+    def consumer(self, topic, **options):
+        return create_consumer(topic, kafka_servers=self.kafka_servers, **options)
+
+    def close(self):
+        pass
+
+###################################################################################################
+###################################################################################################
+
+# QUEUE OF (VALUE, KEY, TIME SENT, TIME INTENDED, TIME ORIGIN) TUPLES, TIMES IN ms
+class create_memory_channel:
+    def __init__(self, max_messages=10000):
+        self.queue = queue.Queue(maxsize=max_messages)
+
+    # BLOCKS WHILE THE QUEUE IS FULL, WHICH PUSHES BACK ON THE PRODUCER
+    def put(self, item, timeout=None):
+        self.queue.put(item, timeout=timeout)
+
+    # RETURNS None WHEN NOTHING ARRIVES WITHIN timeout SECONDS
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # WAIT UP TO timeout SECONDS FOR THE FIRST ITEM, THEN TAKE WHAT IS ALREADY QUEUED, UP TO max_items
+    def get_many(self, max_items, timeout=None):
+        first = self.get(timeout)
+        if first is None:
+            return []
+        items = [first]
+        while len(items) < max_items:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def close(self):
+        pass
+
+# RING BUFFER OF LENGTH-PREFIXED RECORDS IN SHARED MEMORY
+# THE LOCK IS INHERITED, SO PRODUCERS AND CONSUMERS MUST BE FORKED FROM THE PROCESS THAT CREATED THE RING
+class create_shm_ring:
+    HEADER = struct.Struct('<QQ')  # BYTES WRITTEN AND BYTES READ SINCE THE START, NEVER WRAPPED
+    RECORD = struct.Struct('<IqqqH')  # VALUE LENGTH, TIME SENT, INTENDED AND ORIGIN (ms), KEY LENGTH (NO_KEY FOR None)
+    NO_KEY = 0xFFFF
+
+    def __init__(self, capacity, context):
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(create=True, size=self.HEADER.size + capacity)
+        self.buffer = self.memory.buf
+        self.HEADER.pack_into(self.buffer, 0, 0, 0)
+        self.condition = context.Condition()
+        self.owner = os.getpid()
+
+    def _positions(self):
+        return self.HEADER.unpack_from(self.buffer, 0)
+
+    def _used(self):
+        written, read = self._positions()
+        return written - read
+
+    # COPY data INTO THE RING AT position, WRAPPING AROUND THE END
+    def _copy_in(self, position, data):
+        data = memoryview(data).cast('B')
+        start = self.HEADER.size + position % self.capacity
+        first = min(len(data), self.HEADER.size + self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        if first < len(data):
+            self.buffer[self.HEADER.size:self.HEADER.size + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        start = self.HEADER.size + position % self.capacity
+        first = min(size, self.HEADER.size + self.capacity - start)
+        if first == size:
+            return bytes(self.buffer[start:start + size])
+        wrapped = self.buffer[self.HEADER.size:self.HEADER.size + size - first]
+        return bytes(self.buffer[start:start + first]) + bytes(wrapped)
+
+    # BLOCKS WHILE THE RING IS FULL, RAISES queue.Full AFTER timeout SECONDS
+    def put(self, item, timeout=None):
+        value, key, time_sent, time_intended, time_origin = item
+        key_bytes = b'' if key is None else key
+        header = self.RECORD.pack(len(value), time_sent, time_intended, time_origin,
+                                  self.NO_KEY if key is None else len(key_bytes))
+        size = len(header) + len(key_bytes) + len(value)
+        if size > self.capacity:
+            raise ValueError(f'MESSAGE OF {size} BYTES DOES NOT FIT INTO A RING OF {self.capacity} BYTES')
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self._used() + size <= self.capacity, timeout):
+                raise queue.Full
+            written, read = self._positions()
+            self._copy_in(written, header)
+            self._copy_in(written + len(header), key_bytes)
+            self._copy_in(written + len(header) + len(key_bytes), value)
+
+            # PUBLISH THE RECORD ONLY AFTER IT HAS BEEN COPIED
+            self.HEADER.pack_into(self.buffer, 0, written + size, read)
+            self.condition.notify_all()
+
+    # READ THE RECORD AT read, RETURNS ((VALUE, KEY, TIME SENT, TIME INTENDED, TIME ORIGIN), RECORD SIZE)
+    # THE CALLER HOLDS THE LOCK
+    def _read_record(self, read):
+        value_length, time_sent, time_intended, time_origin, key_length = \
+            self.RECORD.unpack(self._copy_out(read, self.RECORD.size))
+        position = read + self.RECORD.size
+        key = None
+        if key_length != self.NO_KEY:
+            key = self._copy_out(position, key_length)
+            position += key_length
+        value = self._copy_out(position, value_length)
+        return (value, key, time_sent, time_intended, time_origin), position + value_length - read
+
+    # RETURNS None WHEN NOTHING ARRIVES WITHIN timeout SECONDS
+    def get(self, timeout=None):
+        items = self.get_many(1, timeout)
+        return items[0] if items else None
+
+    # WAIT UP TO timeout SECONDS FOR THE FIRST RECORD, THEN TAKE WHAT IS ALREADY WRITTEN, UP TO max_items
+    def get_many(self, max_items, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self._used() > 0, timeout):
+                return []
+            written, read = self._positions()
+            items = []
+            while read < written and len(items) < max_items:
+                item, size = self._read_record(read)
+                items.append(item)
+                read += size
+            self.HEADER.pack_into(self.buffer, 0, written, read)
+            self.condition.notify_all()
+        return items
+
+    # THE PROCESS THAT CREATED THE RING ALSO REMOVES IT
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if os.getpid() == self.owner:
+            self.memory.unlink()
+
+###################################################################################################
+###################################################################################################
+
+# PRODUCER WITH THE INTERFACE OF create_producer, FOR THE LOCAL TRANSPORTS
+class create_local_producer:
+    def __init__(self, transport):
+        self.transport = transport
+        self.delivered = 0
+        self.failed = 0
+        self.in_flight = 0
+
+    def connected(self):
+        return True
+
+    # THE OTHER OPTIONS OF THE KAFKA PRODUCERS (E.G. poll_timeout) ARE ACCEPTED AND IGNORED
+    # WITHOUT intended (origin), THE MESSAGE WAS DUE (STARTED) WHEN IT WAS SENT, LIKE A KAFKA MESSAGE WITHOUT THE HEADER
+    def push_msg(self, topic_name, bytes_data, key=None, intended=None, origin=None, **options):
+        value = bytes_data if isinstance(bytes_data, bytes) else bytes(bytes_data)
+        time_sent = int(time.time() * 1000)
+        time_intended = time_sent if intended is None else round(intended * 1000)
+        time_origin = time_sent if origin is None else round(origin * 1000)
+        self.transport.channel(topic_name).put((value, key, time_sent, time_intended, time_origin))
+        self.delivered += 1
+
+    def close(self):
+        log(f'LOCAL PRODUCER CLOSED (delivered: {self.delivered})')
+
+# CONSUMER WITH THE poll_next AND poll_batch INTERFACE OF create_consumer, FOR THE LOCAL TRANSPORTS
+class create_local_consumer:
+    def __init__(self, channel, kafka_topic, on_assigned=None, on_unassigned=None):
+        self.channel = channel
+        self.kafka_topic = kafka_topic
+        self.offsets = None
+        self.on_unassigned = on_unassigned
+
+        # THROUGHPUT COUNTERS, LIKE create_consumer
+        self.processed = 0
+        self.processing_seconds = 0.0
+
+        # THERE IS NO GROUP TO JOIN, SO THE CONSUMER IS READY RIGHT AWAY
+        self.ready = True
+        if on_assigned is not None:
+            on_assigned([])
+
+    def connected(self):
+        return True
+
+    def record_processed(self, n_messages, seconds):
+        self.processed += n_messages
+        self.processing_seconds += seconds
+
+    def poll_next(self, nth_thread, thread_lock, on_message, timeout=1, intended=False, origin=False):
+        log(f'THREAD {nth_thread}: NOW POLLING ({self.kafka_topic})')
+        while thread_lock.is_active():
+            try:
+                item = self.channel.get(timeout)
+                if item is None:
+                    continue
+                t1 = time.perf_counter()
+                on_message(*self.callback_args(item, intended, origin, int(time.time() * 1000)))
+                self.record_processed(1, time.perf_counter() - t1)
+
+            except Exception as error:
+                import traceback
+                log(f'CONSUMER ERROR: {error}\n{traceback.format_exc()}')
+                continue
+        log(f'THREAD {nth_thread}: MANUALLY KILLED')
+
+    # UNLIKE Consumer.consume(), A BATCH IS HANDED OVER AS SOON AS THE FIRST MESSAGE HAS ARRIVED
+    def poll_batch(self, nth_thread, thread_lock, on_batch, batch_size=100, timeout=1, intended=False, origin=False):
+        log(f'THREAD {nth_thread}: NOW POLLING BATCHES OF {batch_size} ({self.kafka_topic})')
+        while thread_lock.is_active():
+            try:
+                batch = self.channel.get_many(batch_size, timeout)
+                if not batch:
+                    continue
+                batch = [self.callback_args(item, intended, origin) for item in batch]
+                t1 = time.perf_counter()
+                on_batch(batch, int(time.time() * 1000))
+                self.record_processed(len(batch), time.perf_counter() - t1)
+
+            except Exception as error:
+                import traceback
+                log(f'CONSUMER ERROR: {error}\n{traceback.format_exc()}')
+                continue
+        log(f'THREAD {nth_thread}: MANUALLY KILLED')
+
+    # THE ARGUMENTS OF create_consumer's CALLBACKS: (VALUE, KEY[, TIME RECEIVED], TIME SENT[, INTENDED][, ORIGIN])
+    @staticmethod
+    def callback_args(item, intended, origin, time_received=None):
+        value, key, time_sent, time_intended, time_origin = item
+        args = (value, key) + (() if time_received is None else (time_received,)) + (time_sent,)
+        if intended:
+            args += (time_intended,)
+        if origin:
+            args += (time_origin,)
+        return args
+
+    def close(self):
+        if self.ready and self.on_unassigned is not None:
+            self.on_unassigned()
+        self.ready = False
+        log(f'LOCAL CONSUMER CLOSED ({self.kafka_topic}, processed: {self.processed})')
+
+###################################################################################################
+###################################################################################################
+
+class create_memory_transport:
+    name = 'memory'
+
+    def __init__(self, max_messages=10000):
+        self.max_messages = max_messages
+        self.channels = {}
+        self.lock = Lock()
+
+    def channel(self, topic):
+        with self.lock:
+            if topic not in self.channels:
+                self.channels[topic] = create_memory_channel(self.max_messages)
+            return self.channels[topic]
+
+    # THE OPTIONS OF THE KAFKA CLIENTS ARE ACCEPTED AND IGNORED
+    def producer(self, mode='default', **options):
+        return create_local_producer(self)
+
+    def consumer(self, topic, on_assigned=None, on_unassigned=None, **options):
+        return create_local_consumer(self.channel(topic), topic, on_assigned, on_unassigned)
+
+    def close(self):
+        pass
+
+# THE RINGS ARE ALLOCATED UP FRONT, SO CREATE THE TRANSPORT WITH EVERY TOPIC BEFORE FORKING THE COMPONENTS
+class create_shm_transport:
+    name = 'shm'
+
+    def __init__(self, topics, capacity=32 * 1024 * 1024):
+        context = multiprocessing.get_context('fork')
+        self.channels = {topic: create_shm_ring(capacity, context) for topic in topics}
+
+    def channel(self, topic):
+        if topic not in self.channels:
+            raise KeyError(f'TOPIC ({topic}) HAS NO RING, ADD IT WHEN CREATING THE TRANSPORT')
+        return self.channels[topic]
+
+    def producer(self, mode='default', **options):
+        return create_local_producer(self)
+
+    def consumer(self, topic, on_assigned=None, on_unassigned=None, **options):
+        return create_local_consumer(self.channel(topic), topic, on_assigned, on_unassigned)
+
+    def close(self):
+        for ring in self.channels.values():
+            ring.close()
@@ -0,0 +1,246 @@
+import struct
+
+import numpy as np
+
+from .grid_cell import CellState
+from .log_odds_grid import LOG_ODDS_CLAMP, LOG_ODDS_EMPTY, LOG_ODDS_OCCUPIED, LogOddsGrid
+
+_HEADER = struct.Struct('<I')  # Number of voxels in the serialized update
+_KEY_BITS = 21  # Bits per axis when packing voxel or block coordinates into one int64
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+_KEY_MASK = (1 << _KEY_BITS) - 1
+MIN_HEIGHT_MM = 20  # Height band of the 2D models (process_points): floor and ceiling hits are not obstacles
+MAX_HEIGHT_MM = 2000
+
+
+def pack_keys(coords: np.ndarray) -> np.ndarray:
+    """ Pack (N, 3) integer coordinates into sortable int64 keys. """
+    coords = np.asarray(coords, dtype=np.int64) + _KEY_OFFSET
+    return (coords[:, 0] << (2 * _KEY_BITS)) | (coords[:, 1] << _KEY_BITS) | coords[:, 2]
+
+
+def unpack_keys(keys: np.ndarray) -> np.ndarray:
+    """ Inverse of pack_keys. """
+    keys = np.asarray(keys, dtype=np.int64)
+    return np.stack([
+        (keys >> (2 * _KEY_BITS)) & _KEY_MASK,
+        (keys >> _KEY_BITS) & _KEY_MASK,
+        keys & _KEY_MASK,
+    ], axis=1) - _KEY_OFFSET
+
+
+def dda_traverse(origins: np.ndarray, ends: np.ndarray, voxel_size_mm: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized 3D DDA (Amanatides & Woo) ray traversal.
+
+    All rays are stepped in lockstep. Rays are sorted by length, so the rays that are still
+    active are always a prefix of the arrays and every step works on slices instead of masks.
+
+    Args:
+        origins: (N, 3) ray start points in millimeters.
+        ends: (N, 3) ray end points in millimeters.
+        voxel_size_mm: Edge length of a voxel in millimeters.
+
+    Returns:
+        Tuple (free_voxels, end_voxels): (M, 3) voxels the rays passed through (end voxels excluded)
+        and the (N, 3) voxels where the rays ended.
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+    current = np.floor(origins / voxel_size_mm).astype(np.int64)
+    end_voxels = np.floor(ends / voxel_size_mm).astype(np.int64)
+
+    direction = ends - origins
+    step = np.sign(direction).astype(np.int64)
+    next_boundary = (current + (step > 0)) * voxel_size_mm
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_max = np.where(step != 0, (next_boundary - origins) / direction, np.inf)
+        t_delta = np.where(step != 0, voxel_size_mm / np.abs(direction), np.inf)
+
+    # Every step moves along exactly one axis, so a ray needs its Manhattan length in steps
+    n_steps = np.abs(end_voxels - current).sum(axis=1)
+    order = np.argsort(-n_steps, kind='stable')
+    current, end_voxels, step = current[order], end_voxels[order], step[order]
+    t_max, t_delta, n_steps = t_max[order], t_delta[order], n_steps[order]
+    n_active = np.searchsorted(-n_steps, -np.arange(int(n_steps[0]) if len(n_steps) else 0), side='left')
+
+    free_voxels = []
+    for k, active in enumerate(n_active):
+        c, t = current[:active], t_max[:active]
+        free_voxels.append(c.copy())
+        # Never step past the end voxel along an axis, even with rounding errors
+        t[c == end_voxels[:active]] = np.inf
+        axis = np.argmin(t, axis=1)
+        rows = np.arange(active)
+        c[rows, axis] += step[:active][rows, axis]
+        t[rows, axis] += t_delta[:active][rows, axis]
+
+    if not free_voxels:
+        return np.empty((0, 3), dtype=np.int64), end_voxels[np.argsort(order)]
+    return np.concatenate(free_voxels), end_voxels[np.argsort(order)]
+
+
+def frame_deltas_3d(hit_voxels: np.ndarray, free_voxels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pre-aggregate the observations of one frame into one log-odds delta per voxel.
+
+    Returns:
+        Tuple (coords, deltas) with unique (K, 3) int32 coordinates and (K,) int8 deltas.
+    """
+    hit_keys = np.unique(pack_keys(hit_voxels))
+    free_keys = np.setdiff1d(pack_keys(free_voxels), hit_keys)  # Occupied wins, like in 2D
+    keys = np.concatenate([free_keys, hit_keys])
+    deltas = np.concatenate([
+        np.full(len(free_keys), LOG_ODDS_EMPTY, dtype=np.int8),
+        np.full(len(hit_keys), LOG_ODDS_OCCUPIED, dtype=np.int8),
+    ])
+    return unpack_keys(keys).astype(np.int32), deltas
+
+
+class VoxelMap:
+    """
+    3D occupancy map with clamped int8 log-odds, stored in hashed blocks.
+
+    Voxels are grouped into blocks of BLOCK_SIZE^3. Only blocks that have been observed are
+    allocated, as rows of one contiguous pool. A sorted array of block keys maps blocks to rows,
+    so lookups and merges are vectorized with searchsorted instead of per-voxel dictionaries.
+    """
+    VOXEL_SIZE_MM: int = 200
+    BLOCK_SIZE: int = 8
+
+    def __init__(self) -> None:
+        """Initialize an empty map."""
+        self._block_keys = np.empty(0, dtype=np.int64)  # Sorted
+        self._block_rows = np.empty(0, dtype=np.int64)  # Pool row of each key in _block_keys
+        self._pool = np.zeros((0, self.BLOCK_SIZE ** 3), dtype=np.int8)
+        self._n_blocks = 0
+
+    def __len__(self) -> int:
+        """Number of voxels with any evidence."""
+        return int(np.count_nonzero(self._pool[:self._n_blocks]))
+
+    @property
+    def n_blocks(self) -> int:
+        return self._n_blocks
+
+    @property
+    def nbytes(self) -> int:
+        return self._pool[:self._n_blocks].nbytes + self._block_keys.nbytes + self._block_rows.nbytes
+
+    def _rows_for_blocks(self, block_keys: np.ndarray) -> np.ndarray:
+        """ Return pool rows for the given unique block keys, allocating missing blocks. """
+        pos = np.searchsorted(self._block_keys, block_keys)
+        found = pos < len(self._block_keys)
+        found[found] = self._block_keys[pos[found]] == block_keys[found]
+
+        new_keys = block_keys[~found]
+        if len(new_keys) > 0:
+            new_rows = np.arange(self._n_blocks, self._n_blocks + len(new_keys))
+            self._n_blocks += len(new_keys)
+            if self._n_blocks > len(self._pool):
+                pool = np.zeros((max(self._n_blocks, 2 * len(self._pool)), self._pool.shape[1]), dtype=np.int8)
+                pool[:len(self._pool)] = self._pool
+                self._pool = pool
+            keys = np.concatenate([self._block_keys, new_keys])
+            rows = np.concatenate([self._block_rows, new_rows])
+            order = np.argsort(keys, kind='stable')
+            self._block_keys, self._block_rows = keys[order], rows[order]
+            pos = np.searchsorted(self._block_keys, block_keys)
+
+        return self._block_rows[pos]
+
+    def merge(self, coords: np.ndarray, deltas: np.ndarray) -> None:
+        """
+        Add log-odds deltas to the map and clamp the result. Duplicate coordinates are summed.
+
+        Args:
+            coords: (N, 3) array of voxel coordinates.
+            deltas: (N,) array of log-odds deltas.
+        """
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+        if len(coords) == 0:
+            return
+        block_keys, block_index = np.unique(pack_keys(coords // self.BLOCK_SIZE), return_inverse=True)
+        rows = self._rows_for_blocks(block_keys)[block_index.reshape(-1)]
+
+        local = coords % self.BLOCK_SIZE
+        local_index = (local[:, 0] * self.BLOCK_SIZE + local[:, 1]) * self.BLOCK_SIZE + local[:, 2]
+        flat = rows * self._pool.shape[1] + local_index
+        flat_lo = flat.min()
+        sums = np.bincount(flat - flat_lo, weights=deltas).astype(np.int32)
+        touched = np.flatnonzero(sums) + flat_lo
+
+        values = self._pool.reshape(-1)
+        merged = values[touched].astype(np.int32) + sums[touched - flat_lo]
+        values[touched] = np.clip(merged, -LOG_ODDS_CLAMP, LOG_ODDS_CLAMP)
+
+    def cells(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return (coords, values) of all voxels with any evidence."""
+        row_to_key = np.empty(self._n_blocks, dtype=np.int64)
+        row_to_key[self._block_rows] = self._block_keys
+        rows, local_index = np.nonzero(self._pool[:self._n_blocks])
+        block_origin = unpack_keys(row_to_key[rows]) * self.BLOCK_SIZE
+        local = np.stack(np.unravel_index(local_index, (self.BLOCK_SIZE,) * 3), axis=1)
+        return (block_origin + local).astype(np.int32), self._pool[rows, local_index]
+
+    def project_2d(self) -> LogOddsGrid:
+        """
+        Project the map to a 2D log-odds grid with the same cell size as the 2D models.
+
+        Only the voxel layers within MIN_HEIGHT_MM..MAX_HEIGHT_MM are projected, the height band the
+        2D models keep. A column is as occupied as its most occupied voxel, or as empty as its
+        emptiest voxel if no voxel in it is occupied.
+        """
+        coords, values = self.cells()
+        in_band = ((coords[:, 2] >= MIN_HEIGHT_MM // self.VOXEL_SIZE_MM)
+                   & (coords[:, 2] <= MAX_HEIGHT_MM // self.VOXEL_SIZE_MM))
+        coords, values = coords[in_band], values[in_band]
+        grid = LogOddsGrid()
+        if len(values) == 0:
+            return grid
+        scale = LogOddsGrid.GRID_CELL_SIZE_MM / self.VOXEL_SIZE_MM
+        columns = np.floor(coords[:, :2] / scale).astype(np.int64)
+        keys, index = np.unique(pack_keys(np.column_stack([columns, np.zeros(len(columns), np.int64)])),
+                                return_inverse=True)
+        index = index.reshape(-1)
+        highest = np.full(len(keys), -LOG_ODDS_CLAMP, dtype=np.int32)
+        lowest = np.full(len(keys), LOG_ODDS_CLAMP, dtype=np.int32)
+        np.maximum.at(highest, index, values)
+        np.minimum.at(lowest, index, values)
+        grid.merge(unpack_keys(keys)[:, :2], np.where(highest > 0, highest, lowest))
+        return grid
+
+    def cell_states(self, current_time: float = None):
+        """ Yield ((x, y), state, certainty) of the 2D projection, for visualization and comparisons. """
+        return self.project_2d().cell_states(current_time)
+
+    def to_bytes(self) -> bytes:
+        """ Convert the non-zero voxels to bytes, so they can be sent over the network. """
+        coords, values = self.cells()
+        return b''.join([
+            _HEADER.pack(len(values)),
+            coords.tobytes(),
+            values.tobytes(),
+        ])
+
+    @staticmethod
+    def decode(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+        """ Parse bytes created by to_bytes() into (coords, deltas) without copying. """
+        (n_voxels,) = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        coords = np.frombuffer(data, dtype=np.int32, count=n_voxels * 3, offset=offset).reshape(n_voxels, 3)
+        offset += coords.nbytes
+        deltas = np.frombuffer(data, dtype=np.int8, count=n_voxels, offset=offset)
+        return coords, deltas
+
+    def update_from_bytes(self, data: bytes) -> None:
+        """ Update the map from bytes received over the network. """
+        self.merge(*self.decode(data))
+
+    def update_from_bytes_batch(self, data_list: list) -> None:
+        """ Merge several updates with a single vectorized addition. """
+        decoded = [self.decode(data) for data in data_list]
+        if not decoded:
+            return
+        self.merge(np.concatenate([coords for coords, _ in decoded]),
+                   np.concatenate([deltas for _, deltas in decoded]))
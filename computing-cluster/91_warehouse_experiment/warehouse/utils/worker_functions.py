@@ -13,6 +13,8 @@ import numpy as np
 from .grid import OccupancyGrid
 from .grid_cell import CellState
 from .grid_visualize import GridVisualizer
+from .log_odds_grid import LogOddsGrid, frame_deltas
+from .voxel_map import MAX_HEIGHT_MM, MIN_HEIGHT_MM, VoxelMap, dda_traverse, frame_deltas_3d
 
 
 @njit
@@ -68,6 +70,40 @@ def process_points(sensor_position, point_cloud, cell_size_mm):
     return updates
 
 
+@njit
+def trace_rays(sensor_position, point_cloud, cell_size_mm):
+    """
+    Numba-optimized variant of process_points that returns flat arrays instead of nested lists.
+
+    Returns:
+        Tuple (hit_cells, empty_cells) of (N, 2) and (M, 2) int64 arrays.
+    """
+    sx = int(sensor_position[0] // cell_size_mm)
+    sy = int(sensor_position[1] // cell_size_mm)
+    hit_cells = np.empty((point_cloud.shape[0], 2), dtype=np.int64)
+    n_hits = 0
+    ray_cells = []
+
+    for i in range(point_cloud.shape[0]):
+        gx, gy, gz = point_cloud[i]
+        if gz < 20 or gz > 2000:
+            continue
+
+        hit_cell_x = int(gx // cell_size_mm)
+        hit_cell_y = int(gy // cell_size_mm)
+        hit_cells[n_hits, 0] = hit_cell_x
+        hit_cells[n_hits, 1] = hit_cell_y
+        n_hits += 1
+        for cell in bresenham_line_algorithm(sx, sy, hit_cell_x, hit_cell_y):
+            ray_cells.append(cell)
+
+    empty_cells = np.empty((len(ray_cells), 2), dtype=np.int64)
+    for i in range(len(ray_cells)):
+        empty_cells[i, 0] = ray_cells[i][0]
+        empty_cells[i, 1] = ray_cells[i][1]
+    return hit_cells[:n_hits], empty_cells
+
+
 def to_grid_space(value, cell_size_mm):
     """
     Convert world coordinates to grid coordinates.
@@ -99,11 +135,15 @@ def local_to_world_space(point_cloud, sensor_position, sensor_rotation):
     world_space_lidar *= 1000  # Meter to millimeter
     return world_space_lidar
 
-def process_point_cloud(point_cloud, sensor_position):
+def process_point_cloud(point_cloud, sensor_position, now=None):
     """
     Process a LiDAR point cloud and update the occupancy grid.
+
+    Args:
+        now: Observation time in seconds. Defaults to the current time; offline tools pass the replay time.
     """
-    now = time.time()  # TODO: Time in seconds, nanoseconds or milliseconds?
+    if now is None:
+        now = time.time()  # TODO: Time in seconds, nanoseconds or milliseconds?
 
     # Mark the vehicle's cell
     update_grid = OccupancyGrid()  # New grid where we will place all updates
@@ -130,6 +170,37 @@ def process_point_cloud(point_cloud, sensor_position):
     return update_grid
 
 
+def process_point_cloud_log_odds(point_cloud, sensor_position):
+    """
+    Process a LiDAR point cloud into a pre-aggregated log-odds update.
+    """
+    hit_cells, empty_cells = trace_rays(
+        sensor_position * 1000,  # Vehicle position to millimeters
+        np.array(point_cloud),
+        LogOddsGrid.GRID_CELL_SIZE_MM
+    )
+    update_grid = LogOddsGrid()
+    update_grid.merge(*frame_deltas(hit_cells, empty_cells))
+    return update_grid
+
+
+def process_point_cloud_voxels(point_cloud, sensor_position):
+    """
+    Process a LiDAR point cloud into a pre-aggregated 3D voxel update.
+
+    Unlike the 2D models, the height of the points is kept and rays are cast in 3D. Like the 2D
+    models, points outside the MIN_HEIGHT_MM..MAX_HEIGHT_MM band (floor and ceiling) are skipped.
+    """
+    point_cloud = np.asarray(point_cloud, dtype=np.float64).reshape(-1, 3)
+    height = point_cloud[:, 2]
+    point_cloud = point_cloud[(height >= MIN_HEIGHT_MM) & (height <= MAX_HEIGHT_MM)]
+    origins = np.broadcast_to(np.asarray(sensor_position, dtype=np.float64) * 1000, point_cloud.shape)
+    free_voxels, hit_voxels = dda_traverse(origins, point_cloud, VoxelMap.VOXEL_SIZE_MM)
+    update_map = VoxelMap()
+    update_map.merge(*frame_deltas_3d(hit_voxels, free_voxels))
+    return update_map
+
+
 # Example Usage
 if __name__ == "__main__":
     # Initialize the grid and LiDAR processor
@@ -5,6 +5,8 @@ import time
 from kafka import KafkaConsumer
 from kafka.errors import KafkaTimeoutError
 
+from .utils.latency_stats import create_latency_tracker
+
 
 class ValidationThread(threading.Thread):
     def __init__(self, kafka_servers, kafka_topic, msg_callback=None, timeout_s=999999):
@@ -17,6 +19,7 @@ class ValidationThread(threading.Thread):
         self.duplicates = 0
         self.unknowns = 0
         self.errors = 0
+        self.latencies = create_latency_tracker()  # Corrected and uncorrected latency of the received messages
         self.running = True
         self.topic = kafka_topic
         self.consumer = KafkaConsumer(
@@ -37,6 +40,7 @@ class ValidationThread(threading.Thread):
         if self.get_num_msg_remaining() == 0:
             print(f"Successfully received all {len(self.msg_ids)} messages! "
                   f"(duplicates: {self.duplicates}, unknowns: {self.unknowns})")
+            print(self.latencies.report())
             self.running = False
         else:
             print(f"Waiting for {len(self.msg_ids)} messages with timeout {timeout_s} seconds")
@@ -87,6 +91,7 @@ class ValidationThread(threading.Thread):
                         self.unknowns += 1
                     else:
                         self.received_ids.add(msg_id)
+                        self.latencies.add(message.value.get('timestamps', {}))
                         self.print_sparse_message(
                             f"Received message {message.value['id']} with timestamp: {message.value['timestamps']}, ({self.get_num_msg_remaining()} remaining)"
                         )
@@ -94,6 +99,7 @@ class ValidationThread(threading.Thread):
                         print(
                             f"Successfully received all {len(self.msg_ids)} messages! (duplicates: {self.duplicates}, unknowns: {self.unknowns})"
                         )
+                        print(self.latencies.report())
                         self.running = False
             prev_msg_received_time = time.time()
 
@@ -119,6 +125,7 @@ class ValidationThread(threading.Thread):
         print(f"Messages received: {self.received_ids}")
         print(f"Messages missing: {len(self.msg_ids - self.received_ids)}")
         print(f"Duplicates: {self.duplicates}, errors: {self.errors}")
+        print(self.latencies.report())
 
 if __name__ == '__main__':
     kafka_servers = ['localhost:10001', 'localhost:10002', 'localhost:10003']
@@ -3,16 +3,28 @@ import os
 import socket
 import time
 
-from utils.kafka_utils import create_consumer, create_producer
-from utils.misc import custom_serializer, log, create_lock
+from utils.claim_check import create_local_blob_store
+from utils.consumer_runtime import create_process_pool, poll_processes
+from utils.kafka_utils import create_metrics_exporter
+from utils.misc import custom_serializer, hot_log, log, create_lock, mark_ready, mark_unready
+from utils.transport import create_kafka_transport
 
-from utils.worker_functions import local_to_world_space, process_point_cloud
+from utils.worker_functions import local_to_world_space, process_point_cloud, process_point_cloud_log_odds, \
+    process_point_cloud_voxels
 from utils.lidar_frame import LidarFrame
 
 errors = 0
 
+# Cell models selectable with GRID_MODEL (the master must use the same model)
+GRID_MODELS = {
+    'timestamp': process_point_cloud,
+    'log_odds': process_point_cloud_log_odds,
+    'voxel': process_point_cloud_voxels,
+}
 
-def run():
+
+def run(transport=None):
+    """ transport: where messages come from and go to, Kafka (KAFKA_SERVERS) by default. """
     # Dynamic arguments for YOLO processing
     args = {
         'validate_results': os.environ.get('VALIDATE_RESULTS', 'TRUE') == 'TRUE',
@@ -21,36 +33,88 @@ def run():
         'kafka_validate': os.environ.get('KAFKA_VALIDATE_TOPIC', 'grid_worker_validate'),
         'kafka_servers': os.environ.get('KAFKA_SERVERS', 'localhost:10001,localhost:10002'),
         'VERBOSE': os.environ.get('VERBOSE', 'FALSE') == 'TRUE',
-
+        'producer_mode': os.environ.get('PRODUCER_MODE', 'default'),  # 'batch' for the batching producer
+        'commit_mode': os.environ.get('COMMIT_MODE', 'eager'),  # 'batched' commits processed offsets in batches
+        'assignment': os.environ.get('ASSIGNMENT', 'eager'),  # 'cooperative' rebalances without pausing the group
+        'instance_id': os.environ.get('POD_NAME'),  # Static group membership, set from the pod name
+        'metrics_port': int(os.environ.get('METRICS_PORT', '0')),  # Prometheus lag/throughput endpoint, 0 disables
+        'log_mode': os.environ.get('LOG_MODE', 'async'),  # Per-message logs: 'async', 'sync' or 'off'
+        'log_sample_every': int(os.environ.get('LOG_SAMPLE_EVERY', '1')),  # Log 1 in N per call site
+        'log_max_per_second': float(os.environ.get('LOG_MAX_PER_SECOND', '0')),  # Per call site, 0 is unlimited
+        'claim_check_dir': os.environ.get('CLAIM_CHECK_DIR', ''),  # Shared blob directory for large payloads
+        'grid_model': os.environ.get('GRID_MODEL', 'timestamp'),
+        'batch_size': int(os.environ.get('BATCH_SIZE', '1')),  # Messages per consume() call, 1 polls one by one
+        'num_processes': int(os.environ.get('NUM_PROCESSES', '1')),  # Worker processes behind one poller
+        'order_by': os.environ.get('ORDER_BY', 'key'),  # Routing to the processes: 'key' or 'partition'
     }
     logging.basicConfig(filename='grid_worker_log.log', level=logging.DEBUG)
+    hot_log.configure(args['log_mode'], args['log_sample_every'], args['log_max_per_second'])
     log(args)
+    process_frame = GRID_MODELS[args['grid_model']]
+    idle_timer = time.time()
 
-    kafka_consumer = create_consumer(args['kafka_input'], kafka_servers=args['kafka_servers'])
-    kafka_producer = create_producer(kafka_servers=args['kafka_servers'])
+    def process_in_worker(data_bytes, msg_key, time_received, time_sent, time_intended):
+        """ Runs in a pool process: everything except the Kafka calls, which stay with the poller. """
+        nonlocal idle_timer
+        t_idle = (time.time() - idle_timer) * 1000
+
+        t1 = time.time()
+        frame = LidarFrame.from_bytes(data_bytes)
+        world_space_lidar = local_to_world_space(frame.data, frame.position, frame.rotation)
+        t_pre = (time.time() - t1) * 1000
+
+        t2 = time.time()
+        update_bytes = process_frame(world_space_lidar, frame.position).to_bytes()
+        t_inf = (time.time() - t2) * 1000
+
+        idle_timer = time.time()
+        return msg_key, time_received, time_sent, time_intended, update_bytes, t_idle, t_pre, t_inf
+
+    # The process pool polls the Kafka client directly
+    if transport is None:
+        transport = create_kafka_transport(args['kafka_servers'])
+    if args['num_processes'] > 1 and transport.name != 'kafka':
+        log(f'NUM_PROCESSES > 1 needs the Kafka transport, not {transport.name}!')
+        return
+
+    # Fork the pool before the Kafka clients start their threads
+    pool = None
+    if args['num_processes'] > 1:
+        pool = create_process_pool(process_in_worker, args['num_processes'])
+
+    # Payloads above the claim-check threshold arrive as references to blobs in this directory
+    blob_store = create_local_blob_store(args['claim_check_dir']) if args['claim_check_dir'] else None
+    kafka_consumer = transport.consumer(args['kafka_input'], commit_mode=args['commit_mode'],
+                                        assignment=args['assignment'], instance_id=args['instance_id'],
+                                        on_assigned=lambda partitions: mark_ready(),
+                                        on_unassigned=mark_unready, blob_store=blob_store)
+    kafka_producer = transport.producer(args['producer_mode'])
 
     # Check that Kafka is working
     if not kafka_producer.connected() or not kafka_consumer.connected():
         log(f'Could not connect Kafka producer or consumer!')
         return
 
+    # Export the queue depth and throughput of the consumer
+    if args['metrics_port'] > 0:
+        create_metrics_exporter(kafka_consumer, port=args['metrics_port'])
+
     # Track which machine (pod) is doing the processing
     hostname = socket.gethostname()
     ip_addr = socket.gethostbyname(hostname)
-    idle_timer = time.time()
 
     # Consumer thread setup
     thread_lock = create_lock()
 
 
-    def process_event(data_bytes, msg_key, time_received, time_sent):
+    def process_event(data_bytes, msg_key, time_received, time_sent, time_intended):
         global errors
         nonlocal idle_timer
         queue_time = time_received - time_sent  # How long was the message waiting in queue?
         msg_id = msg_key.decode('utf-8')
 
         if args['VERBOSE']:
-            log(f"Message {msg_id} received! Queue_time: {queue_time} ms, size {len(data_bytes)} bytes.")
+            hot_log("Message received", id=msg_id, queue_ms=queue_time, bytes=len(data_bytes))
         t_idle = (time.time() - idle_timer) * 1000
 
         # Preprocessing
@@ -61,13 +125,15 @@ def run():
 
         # Inference
         t2 = time.time()
-        update_grid = process_point_cloud(world_space_lidar, frame.position)
+        update_grid = process_frame(world_space_lidar, frame.position)
         t_inf = (time.time() - t2) * 1000
 
         # Postprocessing
         t3 = time.time()
         update_bytes = update_grid.to_bytes()
-        kafka_producer.push_msg(args['kafka_output'], update_bytes, key=msg_key)
+        # Forward the feeder's intended and actual send time, so the master measures its latencies end-to-end
+        kafka_producer.push_msg(args['kafka_output'], update_bytes, key=msg_key, intended=time_intended / 1000,
+                                origin=time_sent / 1000)
         t_post = (time.time() - t3) * 1000
 
         idle_timer = time.time()  # Do not count pushing results to idle timer
@@ -81,24 +147,120 @@ def run():
                     'inf': t_inf,
                     'post': t_post,
                     'queue': queue_time,
+                    'queue_corrected': time_received - time_intended,  # From the feeder's schedule
                     'start_time': time_sent,
+                    'intended_time': time_intended,
                     'end_time': time_received
                 },
                 'id': msg_id,
                 'errors': errors,
                 'source': ip_addr,
+                'output_bytes': len(update_bytes),  # Size of the update sent to the master
+                'batch_size': 1,
             }))
         # print("Errors:", errors)
 
+    def process_batch(batch, time_received):
+        global errors
+        nonlocal idle_timer
+
+        if args['VERBOSE']:
+            hot_log("Batch received", size=len(batch))
+        t_idle = (time.time() - idle_timer) * 1000
+
+        # Preprocessing
+        t1 = time.time()
+        frames = [LidarFrame.from_bytes(data_bytes) for data_bytes, _, _, _ in batch]
+        world_space_lidars = [local_to_world_space(frame.data, frame.position, frame.rotation) for frame in frames]
+        t_pre = (time.time() - t1) * 1000
+
+        # Inference
+        t2 = time.time()
+        update_grids = [process_frame(world_space_lidar, frame.position)
+                        for world_space_lidar, frame in zip(world_space_lidars, frames)]
+        t_inf = (time.time() - t2) * 1000
+
+        # Postprocessing: one update per message, so the master can still validate every message ID
+        t3 = time.time()
+        all_update_bytes = [update_grid.to_bytes() for update_grid in update_grids]
+        for (_, msg_key, time_sent, time_intended), update_bytes in zip(batch, all_update_bytes):
+            kafka_producer.push_msg(args['kafka_output'], update_bytes, key=msg_key, intended=time_intended / 1000,
+                                    origin=time_sent / 1000)
+        t_post = (time.time() - t3) * 1000
+
+        idle_timer = time.time()  # Do not count pushing results to idle timer
+
+        # Every message gets a record with the timings of its whole batch
+        if args['validate_results']:
+            for (_, msg_key, time_sent, time_intended), update_bytes in zip(batch, all_update_bytes):
+                kafka_producer.push_msg(args['kafka_validate'], custom_serializer({
+                    'timestamps': {
+                        'idle': t_idle,  # Time spent waiting for next batch
+                        'pre': t_pre,
+                        'inf': t_inf,
+                        'post': t_post,
+                        'queue': time_received - time_sent,
+                        'queue_corrected': time_received - time_intended,
+                        'start_time': time_sent,
+                        'intended_time': time_intended,
+                        'end_time': time_received
+                    },
+                    'id': msg_key.decode('utf-8'),
+                    'errors': errors,
+                    'source': ip_addr,
+                    'output_bytes': len(update_bytes),
+                    'batch_size': len(batch),
+                }))
+
+    def process_result(result):
+        msg_key, time_received, time_sent, time_intended, update_bytes, t_idle, t_pre, t_inf = result
+
+        t3 = time.time()
+        kafka_producer.push_msg(args['kafka_output'], update_bytes, key=msg_key, intended=time_intended / 1000,
+                                origin=time_sent / 1000)
+        t_post = (time.time() - t3) * 1000
+
+        if args['validate_results']:
+            kafka_producer.push_msg(args['kafka_validate'], custom_serializer({
+                'timestamps': {
+                    'idle': t_idle,  # Time the worker process spent waiting for its next message
+                    'pre': t_pre,
+                    'inf': t_inf,
+                    'post': t_post,
+                    'queue': time_received - time_sent,
+                    'queue_corrected': time_received - time_intended,
+                    'start_time': time_sent,
+                    'intended_time': time_intended,
+                    'end_time': time_received
+                },
+                'id': msg_key.decode('utf-8'),
+                'errors': pool.errors,
+                'source': ip_addr,
+                'output_bytes': len(update_bytes),
+                'batch_size': 1,
+                'num_processes': args['num_processes'],
+            }))
+
     # Create & start worker threads
     try:
-        kafka_consumer.poll_next(1, thread_lock, process_event)
+        if pool is not None:
+            poll_processes(kafka_consumer, pool, thread_lock, process_result, order_by=args['order_by'], intended=True)
+        elif args['batch_size'] > 1:
+            kafka_consumer.poll_batch(1, thread_lock, process_batch, batch_size=args['batch_size'], intended=True)
+        else:
+            kafka_consumer.poll_next(1, thread_lock, process_event, intended=True)
     except KeyboardInterrupt:
         thread_lock.kill()
         log('Worker manually killed.', True)
     except Exception as e:
         log(f'Exception: {e}', True)
         print(e)
+    finally:
+        if pool is not None:
+            pool.close()  # Push the results of the messages still in flight
+        kafka_producer.close()  # Deliver the queued results before exiting
+        kafka_consumer.close()  # Commit the processed offsets before leaving the group
 
 
-run()
+if __name__ == "__main__":
+    run()